@@ -19,7 +19,6 @@ from phylib import add_default_handler, _Formatter   # noqa
 from phylib import _logger_date_fmt, _logger_fmt   # noqa
 
 from phy import __version_git__
-from phy.gui.qt import QtDialogLogger
 from phy.utils.profiling import _enable_profiler, _enable_pdb
 
 from .base import (  # noqa
@@ -72,6 +71,7 @@ def capture_exceptions():  # pragma: no cover
     sys.excepthook = exceptionHandler
 
     # Add a dialog exception handler.
+    from phy.gui.qt import QtDialogLogger
     handler = QtDialogLogger()
     handler.setLevel(logging.ERROR)
     logging.getLogger('phy').addHandler(handler)
@@ -168,6 +168,19 @@ def cli_template_describe(ctx, params_path):
     template_describe(params_path)
 
 
+@phycli.command('template-curate')
+@click.argument('params-paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.argument('rules-path', type=click.Path(exists=True))
+@click.option('-j', '--n-jobs', type=int, help="Number of parallel processes.")
+@click.pass_context
+def cli_template_curate(ctx, params_paths, rules_path, n_jobs=None):
+    """Apply a curation script on one or several params.py files, without GUI."""
+    from .template.gui import template_curate
+    out = template_curate(params_paths, rules_path, n_jobs=n_jobs)
+    if any(isinstance(v, Exception) for v in out.values()):
+        ctx.exit(1)
+
+
 #------------------------------------------------------------------------------
 # Kwik GUI
 #------------------------------------------------------------------------------
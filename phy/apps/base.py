@@ -7,38 +7,35 @@
 # Imports
 #------------------------------------------------------------------------------
 
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 import inspect
 import logging
 import os
 from pathlib import Path
 import shutil
+import threading
 
 import numpy as np
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt, sosfiltfilt
 
 from phylib import _add_log_file
-from phylib.io.array import SpikeSelector, _flatten
-from phylib.stats import correlograms, firing_rate
+from phylib.io.array import _flatten, _times_in_chunks
 from phylib.utils import Bunch, emit, connect, unconnect
-from phylib.utils._misc import write_tsv
+from phylib.utils._misc import write_tsv, load_json, save_json
 
+from phy.cluster._correlograms import PairwiseCorrelograms
+from phy.cluster._templates import ClusterTemplateCounts
 from phy.cluster._utils import RotatingProperty
 from phy.cluster.supervisor import Supervisor
-from phy.cluster.views.base import ManualClusteringView, BaseColorView
-from phy.cluster.views import (
-    WaveformView, FeatureView, TraceView, TraceImageView, CorrelogramView, AmplitudeView,
-    ScatterView, ProbeView, RasterView, TemplateView, ISIView, FiringRateView, ClusterScatterView,
-    select_traces)
-from phy.cluster.views.trace import _iter_spike_waveforms
-from phy.gui import GUI
-from phy.gui.gui import _prompt_save
-from phy.gui.qt import AsyncCaller
-from phy.gui.state import _gui_state_path
-from phy.gui.widgets import IPythonView
 from phy.utils.context import Context, _cache_methods
 from phy.utils.plugin import attach_plugins
 
+# NOTE: the views and the GUI depend on Qt and OpenGL, they are only imported when they are
+# created, so that the controller can be used without GUI (for example, in
+# `phy template-curate`).
+
 logger = logging.getLogger(__name__)
 
 
@@ -73,25 +70,166 @@ class StatusBarHandler(logging.Handler):
         self.gui.status_message = self.format(record)
 
 
+class ChannelClusterIndex(object):
+    """Inverted index mapping every channel to the clusters that have this channel among their
+    best channels.
+
+    The index is built on the first request, and then kept up-to-date with the clusters added
+    and deleted by the clustering actions. The best channels of the new clusters are only
+    computed when the index is next requested.
+
+    Constructor
+    -----------
+
+    get_cluster_ids : function
+        Return the list of all cluster ids.
+    get_best_channels : function
+        Return the best channels of a given cluster.
+
+    """
+    def __init__(self, get_cluster_ids, get_best_channels):
+        self.get_cluster_ids = get_cluster_ids
+        self.get_best_channels = get_best_channels
+        # Mapping {channel_id: set of cluster ids}.
+        self._clusters = None
+        # Mapping {cluster_id: best channels}, used to remove the deleted clusters.
+        self._channels = {}
+        # Clusters added since the last request.
+        self._pending = set()
+        # NOTE: the index may be requested from the views' worker threads.
+        self._lock = threading.Lock()
+
+    def _update(self):
+        if self._clusters is None:
+            self._clusters = {}
+            self._pending = set(self.get_cluster_ids())
+        for cluster_id in self._pending:
+            channel_ids = [int(ch) for ch in self.get_best_channels(cluster_id)]
+            self._channels[cluster_id] = channel_ids
+            for channel_id in channel_ids:
+                self._clusters.setdefault(channel_id, set()).add(cluster_id)
+        self._pending.clear()
+
+    def update(self, up):
+        """Update the index after a clustering action."""
+        with self._lock:
+            if self._clusters is None:
+                return
+            for cluster_id in up.deleted:
+                self._pending.discard(cluster_id)
+                for channel_id in self._channels.pop(cluster_id, ()):
+                    self._clusters[channel_id].discard(cluster_id)
+            self._pending.update(up.added)
+
+    def get(self, channel_id):
+        """Return the sorted list of the clusters having a given channel among their best
+        channels."""
+        with self._lock:
+            self._update()
+            return sorted(self._clusters.get(int(channel_id), ()))
+
+
+class SpikeSelector(object):
+    """Select a given number of spikes per cluster, among a subset of the chunks or of the
+    spikes.
+
+    The spikes of every cluster are taken in the stable random order maintained by the
+    clustering, so that selecting n spikes of a cluster only looks at about n spikes (or
+    n / fraction of kept spikes when subsetting), and always returns the same spikes.
+
+    Constructor
+    -----------
+
+    get_spike_order : function
+        Return the spikes of a cluster in a stable random order.
+    get_spikes_per_cluster : function
+        Return all spikes of a cluster.
+    spike_times : array-like
+        The spike times, in the same unit as `chunk_bounds`.
+    chunk_bounds : array-like
+        The bounds of the chunks of the raw data.
+    n_chunks_kept : int
+        The number of chunks kept when subsetting the chunks.
+
+    """
+    def __init__(
+            self, get_spike_order=None, get_spikes_per_cluster=None, spike_times=None,
+            chunk_bounds=None, n_chunks_kept=None):
+        self.get_spike_order = get_spike_order
+        self.get_spikes_per_cluster = get_spikes_per_cluster
+        self.spike_times = spike_times
+        self.chunks_kept = []
+        n_chunks = len(chunk_bounds) - 1
+        for i in range(0, n_chunks, max(1, int(np.ceil(n_chunks / n_chunks_kept)))):
+            self.chunks_kept.extend(chunk_bounds[i:i + 2])
+        self.chunks_kept = np.array(self.chunks_kept)
+
+    def _select(self, spike_ids, n, subset_chunks=False, subset_spikes=None):
+        """Return the first n spikes of an array among the kept chunks or spikes."""
+        if not subset_chunks and subset_spikes is None:
+            return spike_ids[:n]
+        out = []
+        n_kept = 0
+        start = 0
+        # The spikes are scanned by blocks of increasing size until n spikes are kept.
+        size = n or len(spike_ids)
+        while start < len(spike_ids) and (n is None or n_kept < n):
+            block = spike_ids[start:start + size]
+            if subset_chunks:
+                block = block[_times_in_chunks(self.spike_times[block], self.chunks_kept)]
+            if subset_spikes is not None:
+                block = block[np.isin(block, subset_spikes)]
+            out.append(block)
+            n_kept += len(block)
+            start += size
+            size *= 2
+        return np.concatenate(out)[:n] if out else spike_ids[:0]
+
+    def __call__(self, n_spk_clu, cluster_ids, subset_chunks=False, subset_spikes=None):
+        """Select about n_spk_clu random spikes from each of the requested clusters, only
+        in the kept chunks or among the kept spikes."""
+        if not len(cluster_ids):
+            return np.array([], dtype=np.int64)
+        n = n_spk_clu if n_spk_clu is not None and n_spk_clu > 0 else None
+        get_spikes = self.get_spike_order if n else self.get_spikes_per_cluster
+        selection = [
+            self._select(
+                get_spikes(cluster_id), n,
+                subset_chunks=subset_chunks, subset_spikes=subset_spikes)
+            for cluster_id in cluster_ids]
+        return np.unique(np.concatenate(selection)).astype(np.int64)
+
+
 #--------------------------------------------------------------------------
 # Raw data filtering
 #--------------------------------------------------------------------------
 
+def _sos_margin(sos, tol=1e-6, max_samples=100000):
+    """Return the number of samples after which the impulse response of a filter defined by
+    second-order sections falls below a relative tolerance."""
+    h = np.abs(sosfilt(sos, np.r_[1., np.zeros(max_samples - 1)]))
+    return int(np.nonzero(h > tol * h.max())[0][-1]) + 1
+
+
+def _split_chunk_bounds(chunk_bounds, max_size):
+    """Split the chunks so that they have at most max_size samples."""
+    out = [int(chunk_bounds[0])]
+    for a, b in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        n = max(1, int(np.ceil((b - a) / max_size)))
+        out.extend(int(a + (b - a) * k // n) for k in range(1, n + 1))
+    return np.array(out, dtype=np.int64)
+
+
 class RawDataFilter(RotatingProperty):
     def __init__(self):
         super(RawDataFilter, self).__init__()
         self.add('raw', lambda x, axis=None: x)
+        # Mapping {name: (sos, margin)} for the filters defined by second-order sections.
+        self._sos = {}
 
     def add_default_filter(self, sample_rate):
-        b, a = butter(3, 150.0 / sample_rate * 2.0, 'high')
-
-        @self.add_filter
-        def high_pass(arr, axis=0):
-            arr = lfilter(b, a, arr, axis=axis)
-            arr = np.flip(arr, axis=axis)
-            arr = lfilter(b, a, arr, axis=axis)
-            arr = np.flip(arr, axis=axis)
-            return arr
+        sos = butter(3, 150.0 / sample_rate * 2.0, 'high', output='sos')
+        self.add_sos_filter(sos, name='high_pass')
         self.set('high_pass')
 
     def add_filter(self, fun=None, name=None):
@@ -100,8 +238,32 @@ class RawDataFilter(RotatingProperty):
             return partial(self.add_filter, name=name)
         name = name or fun.__name__
         logger.debug("Add filter `%s`.", name)
+        self._sos.pop(name, None)
         self.add(name, fun)
 
+    def add_sos_filter(self, sos, name=None, margin=None):
+        """Add a zero-phase raw data filter defined by second-order sections.
+
+        Such a filter can be applied chunk by chunk on the raw data, every chunk being filtered
+        with margins of `margin` samples on both sides (by default, the length of the impulse
+        response of the filter).
+
+        """
+        assert name
+        sos = np.asarray(sos, dtype=np.float64)
+
+        def fun(arr, axis=0):
+            padlen = min(3 * (2 * len(sos) + 1), arr.shape[axis] - 1)
+            return sosfiltfilt(sos, arr, axis=axis, padlen=padlen)
+
+        self.add_filter(fun, name=name)
+        self._sos[name] = (sos, margin or _sos_margin(sos))
+
+    def get_sos(self, name=None):
+        """Return the `(sos, margin)` pair of a filter defined by second-order sections, or None
+        for other filters."""
+        return self._sos.get(name or self.current, None)
+
     def apply(self, arr, axis=None, name=None):
         """Filter raw data."""
         self.set(name or self.current)
@@ -114,6 +276,492 @@ class RawDataFilter(RotatingProperty):
         return arr
 
 
+class FilteredTraces(object):
+    """Raw data filtered chunk by chunk with the raw data filters defined by second-order
+    sections.
+
+    Every chunk is filtered together with margins on both sides, which are then discarded, so
+    that the filtered data is seamless across chunks, up to the tolerance of the margins. The
+    chunks are the native chunks of the raw data, split so that they are at most
+    `chunk_duration` long, and the last filtered chunks are kept in memory up to `cache_size`
+    bytes. The filtered data is computed in single precision.
+
+    Constructor
+    -----------
+
+    traces : array-like
+        The `(n_samples, n_channels)` raw data array.
+    sample_rate : float
+        The sampling rate.
+    raw_data_filter : RawDataFilter
+        The raw data filter.
+    read_lock : Lock
+        The lock serialising the reads of the raw data, optional.
+
+    """
+
+    """Maximum duration of the filtered chunks, in seconds."""
+    chunk_duration = 1.
+
+    """Maximum size of the filtered chunks kept in memory, in bytes."""
+    cache_size = 512 * 1024 ** 2
+
+    def __init__(self, traces=None, sample_rate=None, raw_data_filter=None, read_lock=None):
+        self.traces = traces
+        self.sample_rate = sample_rate
+        self.raw_data_filter = raw_data_filter
+        self.n_samples, self.n_channels = traces.shape
+        chunk_bounds = getattr(traces, 'chunk_bounds', None)
+        if chunk_bounds is None or len(chunk_bounds) < 2:
+            chunk_bounds = [0, self.n_samples]
+        self.chunk_bounds = _split_chunk_bounds(
+            chunk_bounds, max(1, int(round(self.chunk_duration * sample_rate))))
+        # Mapping {(filter_name, chunk_idx): (n_channels, n_samples) array}, in the order of
+        # last use.
+        self._chunks = OrderedDict()
+        self._size = 0
+        # NOTE: the filtered data is requested from the trace cache and the views' threads.
+        self._lock = threading.RLock()
+        # NOTE: the raw data readers are not thread-safe, all reads of the raw data go through
+        # this lock, which is shared with the trace cache and the trace pyramid.
+        self.read_lock = read_lock or threading.Lock()
+
+    @property
+    def is_active(self):
+        """Whether the current raw data filter can be applied chunk by chunk."""
+        return self.raw_data_filter.get_sos() is not None
+
+    def _filter_chunk(self, name, k):
+        sos, margin = self.raw_data_filter.get_sos(name)
+        i, j = self.chunk_bounds[k], self.chunk_bounds[k + 1]
+        i0, j0 = max(0, i - margin), min(self.n_samples, j + margin)
+        # NOTE: filtering along the last axis of a contiguous array is faster.
+        with self.read_lock:
+            raw = np.asarray(self.traces[i0:j0])
+        raw = np.ascontiguousarray(raw.astype(np.float32).T)
+        padlen = min(3 * (2 * len(sos) + 1), raw.shape[1] - 1)
+        out = sosfiltfilt(sos.astype(np.float32), raw, axis=1, padlen=padlen)
+        return np.ascontiguousarray(out[:, i - i0:j - i0], dtype=np.float32)
+
+    def _get_chunk(self, name, k):
+        """Return a filtered chunk, as a `(n_channels, n_samples)` array."""
+        key = (name, k)
+        with self._lock:
+            if key not in self._chunks:
+                chunk = self._filter_chunk(name, k)
+                self._chunks[key] = chunk
+                self._size += chunk.nbytes
+                while self._size > self.cache_size and len(self._chunks) > 1:
+                    self._size -= self._chunks.popitem(last=False)[1].nbytes
+            self._chunks.move_to_end(key)
+            return self._chunks[key]
+
+    def get(self, i, j, name=None):
+        """Return the filtered data between samples i and j, as an `(n_samples, n_channels)`
+        array."""
+        name = name or self.raw_data_filter.current
+        i, j = max(0, i), min(self.n_samples, j)
+        if j <= i:
+            return np.zeros((0, self.n_channels), dtype=np.float32)
+        k0 = int(np.searchsorted(self.chunk_bounds, i, side='right')) - 1
+        k1 = int(np.searchsorted(self.chunk_bounds, j, side='left'))
+        chunks = [self._get_chunk(name, k) for k in range(k0, k1)]
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks, axis=1)
+        offset = self.chunk_bounds[k0]
+        return data[:, i - offset:j - offset].T
+
+    def get_waveforms(self, spike_samples, channel_ids, n_samples_waveforms, name=None):
+        """Return the `(n_spikes, n_samples_waveforms, n_channels)` filtered waveforms of
+        spikes, zero-padded at the edges of the recording like `phylib.io.traces`.
+
+        The waveforms are taken from the filtered chunks kept in memory. Otherwise, the raw
+        waveforms are filtered together with the margins of the filter.
+
+        """
+        name = name or self.raw_data_filter.current
+        sos, margin = self.raw_data_filter.get_sos(name)
+        spike_samples = np.asarray(spike_samples, dtype=np.int64)
+        channel_ids = np.asarray(channel_ids, dtype=np.int64)
+        nsw = n_samples_waveforms
+        a = nsw // 2
+        out = np.zeros((len(spike_samples), nsw, len(channel_ids)), dtype=np.float32)
+        chunk_idx = np.searchsorted(self.chunk_bounds, spike_samples, side='right') - 1
+        to_filter = []
+        for m, (s, k) in enumerate(zip(spike_samples, chunk_idx)):
+            t0, t1 = s - a, s - a + nsw
+            with self._lock:
+                chunk = self._chunks.get((name, k), None)
+            if chunk is not None and self.chunk_bounds[k] <= t0 and t1 <= self.chunk_bounds[k + 1]:
+                t = t0 - self.chunk_bounds[k]
+                out[m] = chunk[channel_ids, t:t + nsw].T
+            elif t0 - margin >= 0 and t1 + margin <= self.n_samples:
+                to_filter.append(m)
+            else:
+                # Spikes at the edges of the recording.
+                data = self.get(t0, t1, name=name)[:, channel_ids]
+                out[m, max(0, -t0):max(0, -t0) + len(data)] = data
+        if to_filter:
+            # Filter the raw waveforms with their margins together.
+            with self.read_lock:
+                raw = np.stack([
+                    np.asarray(self.traces[s - a - margin:s - a + nsw + margin])[:, channel_ids]
+                    for s in spike_samples[to_filter]]).astype(np.float32)
+            raw = np.ascontiguousarray(raw.transpose((0, 2, 1)))
+            padlen = min(3 * (2 * len(sos) + 1), raw.shape[2] - 1)
+            filtered = sosfiltfilt(sos.astype(np.float32), raw, axis=2, padlen=padlen)
+            out[to_filter] = filtered[..., margin:margin + nsw].transpose((0, 2, 1))
+        # Missing channels are padded with -1, their waveforms are zero.
+        out[..., channel_ids == -1] = 0
+        return out
+
+
+#------------------------------------------------------------------------------
+# Trace cache
+#------------------------------------------------------------------------------
+
+class TraceCache(object):
+    """Cache of the filtered trace windows shown in the trace views.
+
+    Every window is keyed by its bounds in samples, the raw data filter, the cluster selection
+    and whether all spikes are shown. After every request, the next windows in the scroll
+    direction (the last shift repeated) are computed in a background thread, so that scrolling
+    is served from memory. The raw data is read by blocks spanning the requested window and
+    one window on each side, so that adjacent windows do not read from disk either. When the
+    raw data filter is defined by second-order sections, the filtered traces are taken from a
+    `FilteredTraces` instance instead.
+
+    The last windows are kept in memory up to `cache_size` bytes. The windows larger than
+    `max_prefetch_size` bytes, when zooming out on many channels, are neither prefetched nor
+    read with the neighbouring windows. The sizes are those of the windows in double precision.
+
+    Constructor
+    -----------
+
+    traces : array-like
+        The `(n_samples, n_channels)` raw data array.
+    sample_rate : float
+        The sampling rate.
+    raw_data_filter : RawDataFilter
+        The raw data filter applied to the traces.
+    get_spike_waveforms : function
+        Maps `(interval, traces_interval, cluster_ids, show_all_spikes)` to the list of spike
+        waveforms shown in the window.
+    prefetch : boolean
+        Whether to prefetch the next windows in a background thread.
+    filtered_traces : FilteredTraces
+        The raw data filtered chunk by chunk, optional. Its raw data read lock is shared.
+
+    """
+
+    """Maximum size of the windows kept in memory, in bytes."""
+    cache_size = 256 * 1024 ** 2
+
+    """Maximum size of the prefetched windows, in bytes."""
+    max_prefetch_size = 32 * 1024 ** 2
+
+    """Number of windows prefetched in the scroll direction."""
+    n_prefetch = 2
+
+    def __init__(
+            self, traces=None, sample_rate=None, raw_data_filter=None,
+            get_spike_waveforms=None, prefetch=True, filtered_traces=None):
+        self.traces = traces
+        self.sample_rate = sample_rate
+        self.raw_data_filter = raw_data_filter
+        self.get_spike_waveforms = get_spike_waveforms
+        self.prefetch = prefetch
+        self.filtered_traces = filtered_traces
+        # Mapping {key: Future}, in the order of last use.
+        self._windows = OrderedDict()
+        # Total size of the windows, in bytes.
+        self._size = 0
+        # Last raw data block, as (start, array).
+        self._block = (0, None)
+        self._last = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='phy-traces')
+        self._lock = threading.Lock()
+        # NOTE: the raw data readers are not thread-safe, so the reads are serialised with
+        # those of the filtered traces.
+        self._read_lock = (
+            filtered_traces.read_lock if filtered_traces is not None else threading.Lock())
+
+    def _window_size(self, i, j):
+        """Size of the window between samples i and j, in bytes."""
+        return (j - i) * self.traces.shape[1] * 8
+
+    def _read(self, i, j):
+        """Return the raw data between samples i and j, read by blocks."""
+        with self._read_lock:
+            start, block = self._block
+            if block is None or i < start or j > start + len(block):
+                n = j - i if self._window_size(i, j) <= self.max_prefetch_size else 0
+                start = max(0, i - n)
+                block = np.asarray(self.traces[start:j + n])
+                self._block = (start, block)
+        return block[i - start:j - start]
+
+    def _compute(self, key):
+        i, j, filter_name, cluster_ids, show_all_spikes = key
+        if (self.filtered_traces is not None and
+                self.raw_data_filter.get_sos(filter_name) is not None):
+            traces = self.filtered_traces.get(i, j, name=filter_name)
+        else:
+            # Same as select_traces().
+            traces = self._read(i, j)
+            traces = traces - np.median(traces, axis=0)
+            fun = self.raw_data_filter.get(filter_name)
+            if fun:
+                traces = fun(traces, axis=0)
+        interval = (i / self.sample_rate, j / self.sample_rate)
+        return Bunch(
+            data=traces, waveforms=self.get_spike_waveforms(
+                interval, traces, list(cluster_ids), show_all_spikes))
+
+    def _submit(self, key, background=False):
+        """Return the future of a window, computing it if needed."""
+        with self._lock:
+            future = self._windows.get(key, None)
+            if future is None:
+                if background:
+                    future = self._executor.submit(self._compute, key)
+                else:
+                    future = Future()
+                self._windows[key] = future
+                self._size += self._window_size(key[0], key[1])
+                while self._size > self.cache_size and len(self._windows) > 1:
+                    old, _ = self._windows.popitem(last=False)
+                    self._size -= self._window_size(old[0], old[1])
+                compute = not background
+            else:
+                compute = False
+            self._windows.move_to_end(key)
+        if compute:
+            try:
+                future.set_result(self._compute(key))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def get(self, interval, cluster_ids, show_all_spikes=False):
+        """Return a `Bunch(data, waveforms)` with the filtered traces and spike waveforms in
+        an interval, and prefetch the next windows in the scroll direction."""
+        i, j = (int(round(self.sample_rate * t)) for t in interval)
+        key = (i, j, self.raw_data_filter.current, tuple(cluster_ids), show_all_spikes)
+        try:
+            out = self._submit(key).result()
+        except Exception:
+            with self._lock:
+                if self._windows.pop(key, None) is not None:
+                    self._size -= self._window_size(i, j)
+            raise
+        # Prefetch the next windows if the window was shifted.
+        last, self._last = self._last, key
+        if (not self.prefetch or last is None or j - i != last[1] - last[0] or
+                self._window_size(i, j) > self.max_prefetch_size):
+            return out
+        delta = i - last[0]
+        for k in range(1, self.n_prefetch + 1 if delta else 1):
+            start, stop = i + k * delta, j + k * delta
+            if start < 0 or stop > self.traces.shape[0]:
+                break
+            self._submit((start, stop) + key[2:], background=True)
+        return out
+
+    def clear(self):
+        """Remove all windows, for example after a clustering action."""
+        with self._lock:
+            self._windows.clear()
+            self._size = 0
+
+
+#------------------------------------------------------------------------------
+# Trace pyramid
+#------------------------------------------------------------------------------
+
+def _decimate(mins, maxs, k):
+    """Return the minima and maxima of `(n, n_channels)` arrays by bins of k rows."""
+    idx = np.arange(0, len(mins), k)
+    return (
+        np.minimum.reduceat(mins, idx, axis=0), np.maximum.reduceat(maxs, idx, axis=0))
+
+
+def _build_trace_pyramid(
+        traces, sample_rate, name, sos, margin, factors, path, read_lock=None, dtype=np.float16):
+    """Build the min/max pyramid of the raw data filtered with a filter defined by second-order
+    sections, in a directory."""
+    logger.debug("Building the trace pyramid of the `%s` filter in %s.", name, path)
+    rdf = RawDataFilter()
+    rdf.add_sos_filter(sos, name=name, margin=margin)
+    filtered = FilteredTraces(
+        traces=traces, sample_rate=sample_rate, raw_data_filter=rdf, read_lock=read_lock)
+    # A few chunks are enough, as the raw data is read sequentially.
+    filtered.cache_size = 0
+    n_samples, n_channels = filtered.n_samples, filtered.n_channels
+    # The filtered data is clipped to the range of the pyramid's data type.
+    vmax = np.finfo(dtype).max
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    prev = prev_factor = None
+    for f in factors:
+        level = np.lib.format.open_memmap(
+            tmp_path / ('level_%d.npy' % f), mode='w+', dtype=dtype,
+            shape=(-(-n_samples // f), 2, n_channels))
+        if prev is None:
+            # The first level is computed from the filtered data.
+            block = f * 1024
+            for i in range(0, n_samples, block):
+                data = np.clip(filtered.get(i, i + block, name=name), -vmax, vmax)
+                level[i // f:i // f + -(-len(data) // f)] = np.stack(
+                    _decimate(data, data, f), axis=1)
+        else:
+            # The next levels are computed from the previous level.
+            k = f // prev_factor
+            block = k * 4096
+            for i in range(0, len(prev), block):
+                data = prev[i:i + block]
+                level[i // k:i // k + -(-len(data) // k)] = np.stack(
+                    _decimate(data[:, 0], data[:, 1], k), axis=1)
+        level.flush()
+        prev, prev_factor = level, f
+    del prev, level
+    save_json(tmp_path / 'meta.json', _trace_pyramid_meta(
+        n_samples, n_channels, factors, sos, margin, dtype))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.debug("Built the trace pyramid of the `%s` filter.", name)
+
+
+def _trace_pyramid_meta(n_samples, n_channels, factors, sos, margin, dtype):
+    return dict(
+        n_samples=int(n_samples), n_channels=int(n_channels), factors=[int(f) for f in factors],
+        sos=np.asarray(sos).tolist(), margin=int(margin), dtype=np.dtype(dtype).name)
+
+
+class TracePyramid(object):
+    """On-disk multi-resolution pyramid of the minima and maxima of the filtered raw data,
+    used to display long intervals in the trace views.
+
+    Every level stores the minimum and the maximum of every channel by bins of `factor`
+    samples, the factors being `factor0 * base ** k`. The levels of a raw data filter defined by
+    second-order sections are built once, in a background thread by default, and saved in
+    `path / filter_name /` as `level_<factor>.npy` files that are then memory-mapped. The levels
+    are stored in half precision, which is enough for display, so that the pyramid takes less than
+    a twentieth of the size of 16-bit raw data.
+
+    Constructor
+    -----------
+
+    path : Path
+        The directory containing the pyramids.
+    filtered_traces : FilteredTraces
+        The filtered raw data.
+    background : boolean
+        Whether to build the pyramids in a background thread, or synchronously when they are
+        first requested.
+
+    """
+
+    """Number of samples of the bins of the finest level."""
+    factor0 = 64
+
+    """Ratio between the bin sizes of successive levels."""
+    base = 4
+
+    """Maximum number of bins of the coarsest level."""
+    max_bins = 4096
+
+    """Data type of the levels."""
+    dtype = np.float16
+
+    def __init__(self, path=None, filtered_traces=None, background=True):
+        self.path = Path(path)
+        self.filtered_traces = filtered_traces
+        self.raw_data_filter = filtered_traces.raw_data_filter
+        self.background = background
+        n_samples = filtered_traces.n_samples
+        self.factors = [self.factor0]
+        while -(-n_samples // self.factors[-1]) > self.max_bins:
+            self.factors.append(self.factors[-1] * self.base)
+        # Mapping {filter_name: {factor: memmap}}.
+        self._levels = {}
+        # Mapping {filter_name: thread}.
+        self._builders = {}
+
+    def _meta(self, name):
+        sos, margin = self.raw_data_filter.get_sos(name)
+        ft = self.filtered_traces
+        return _trace_pyramid_meta(
+            ft.n_samples, ft.n_channels, self.factors, sos, margin, self.dtype)
+
+    def _load(self, name):
+        """Return the levels of the pyramid of a filter, or None if it has not been built."""
+        if name in self._levels:
+            return self._levels[name]
+        path = self.path / name
+        if not (path / 'meta.json').exists() or load_json(path / 'meta.json') != self._meta(name):
+            return
+        self._levels[name] = {
+            f: np.load(path / ('level_%d.npy' % f), mmap_mode='r') for f in self.factors}
+        return self._levels[name]
+
+    def is_building(self, name=None):
+        """Whether the pyramid of a filter is being built in the background."""
+        builder = self._builders.get(name or self.raw_data_filter.current, None)
+        return builder is not None and builder.is_alive()
+
+    def build(self, name=None):
+        """Build the pyramid of a filter defined by second-order sections, if needed."""
+        name = name or self.raw_data_filter.current
+        if (self.raw_data_filter.get_sos(name) is None or self.is_building(name) or
+                self._load(name) is not None):
+            return
+        sos, margin = self.raw_data_filter.get_sos(name)
+        ft = self.filtered_traces
+        args = (
+            ft.traces, ft.sample_rate, name, sos, margin, self.factors, self.path / name,
+            ft.read_lock, self.dtype)
+        if not self.background:
+            return _build_trace_pyramid(*args)
+        logger.info("Building the trace pyramid of the `%s` filter in the background.", name)
+        # NOTE: the GUI process is multithreaded (Qt, thread pool), so it must not be forked.
+        # The build mostly runs in numpy and scipy, which release the GIL.
+        builder = threading.Thread(
+            target=_build_trace_pyramid, args=args, name='phy-pyramid', daemon=True)
+        self._builders[name] = builder
+        builder.start()
+
+    def get_factor(self, n_samples, n_pixels):
+        """Return the largest bin size with at least two bins per pixel, or None if the
+        raw data should be displayed at full resolution."""
+        factors = [f for f in self.factors if f * 2 * n_pixels <= n_samples]
+        return factors[-1] if factors else None
+
+    def get(self, i, j, n_pixels, name=None):
+        """Return the `(samples, data)` pair of the minima and maxima between samples i and j
+        at the resolution of the given number of pixels.
+
+        The `(2 * n_bins, n_channels)` data array contains the minimum and maximum of every bin
+        in turn, and the samples array the center of the bins. Return None if the raw data
+        should be displayed at full resolution, or if the pyramid is not available yet.
+
+        """
+        name = name or self.raw_data_filter.current
+        factor = self.get_factor(j - i, n_pixels)
+        if factor is None or self.raw_data_filter.get_sos(name) is None:
+            return
+        if self._load(name) is None:
+            self.build(name)
+            if self._load(name) is None:
+                return
+        level = self._levels[name][factor]
+        a, b = max(0, i // factor), min(len(level), -(-j // factor))
+        data = np.asarray(level[a:b], dtype=np.float32).reshape((-1, level.shape[2]))
+        samples = np.repeat(np.arange(a, b) * factor + factor // 2, 2)
+        return samples, data
+
+
 #------------------------------------------------------------------------------
 # View mixins
 #------------------------------------------------------------------------------
@@ -148,6 +796,37 @@ class WaveformMixin(object):
         '_get_mean_waveforms',
     )
 
+    _cluster_keyed = (
+        '_get_waveforms_with_n_spikes',
+        '_get_mean_waveforms',
+    )
+
+    _cache_state = (
+        ('_get_waveforms_with_n_spikes', 'raw_data_filter.current'),
+        ('_get_mean_waveforms', 'raw_data_filter.current'),
+        ('_get_mean_waveforms', 'n_spikes_waveforms'),
+    )
+
+    def _get_filtered_waveforms(self, spike_ids, channel_ids):
+        """Return the filtered waveforms of spikes on some channels.
+
+        When the raw data filter can be applied chunk by chunk, the waveforms are extracted
+        from the filtered raw data, which is shared with the trace view. Otherwise, they are
+        loaded either from the raw data directly, or from the _phy_spikes* files, and filtered
+        independently.
+
+        """
+        if (self.filtered_traces is not None and self.filtered_traces.is_active and
+                getattr(self.model, 'spike_waveforms', None) is None):
+            return self.filtered_traces.get_waveforms(
+                self.model.spike_samples[spike_ids], channel_ids,
+                self.model.n_samples_waveforms)
+        data = self.model.get_waveforms(spike_ids, channel_ids)
+        if data is not None:
+            data = data - np.median(data, axis=1)[:, np.newaxis, :]
+            data = self.raw_data_filter.apply(data, axis=1)
+        return data
+
     def get_spike_raw_amplitudes(self, spike_ids, channel_id=None, **kwargs):
         """Return the maximum amplitude of the raw waveforms on the best channel of
         the first selected cluster.
@@ -161,12 +840,10 @@ class WaveformMixin(object):
         spike_clusters = self.supervisor.clustering.spike_clusters[spike_ids]
         # Only keep spikes from clusters on the "best" channel.
         to_keep = np.in1d(spike_clusters, self.get_clusters_on_channel(channel_id))
-        waveforms = self.model.get_waveforms(spike_ids[to_keep], [channel_id])
+        waveforms = self._get_filtered_waveforms(spike_ids[to_keep], [channel_id])
         if waveforms is not None:
             waveforms = waveforms[..., 0]
             assert waveforms.ndim == 2  # shape: (n_spikes_kept, n_samples)
-            # Filter the waveforms.
-            waveforms = self.raw_data_filter.apply(waveforms, axis=1)
             # Amplitudes of the kept spikes.
             amplitudes = waveforms.max(axis=1) - waveforms.min(axis=1)
             out[to_keep] = amplitudes
@@ -178,10 +855,7 @@ class WaveformMixin(object):
         spike_ids = self._get_amplitude_spike_ids(cluster_id)
         return np.mean(self.get_spike_raw_amplitudes(spike_ids))
 
-    def _get_waveforms_with_n_spikes(
-            self, cluster_id, n_spikes_waveforms, current_filter=None):
-
-        # HACK: we pass self.raw_data_filter.current_filter so that it is cached properly.
+    def _get_waveforms_with_n_spikes(self, cluster_id, n_spikes_waveforms):
         pos = self.model.channel_positions
 
         # Only keep spikes from the spike waveforms selection.
@@ -198,15 +872,9 @@ class WaveformMixin(object):
         channel_ids = self.get_best_channels(cluster_id)
         channel_labels = self._get_channel_labels(channel_ids)
 
-        # Load the waveforms, either from the raw data directly, or from the _phy_spikes* files.
-        data = self.model.get_waveforms(spike_ids, channel_ids)
-        if data is not None:
-            data = data - np.median(data, axis=1)[:, np.newaxis, :]
+        # Load the filtered waveforms.
+        data = self._get_filtered_waveforms(spike_ids, channel_ids)
         assert data.ndim == 3  # n_spikes, n_samples, n_channels
-
-        # Filter the waveforms.
-        if data is not None:
-            data = self.raw_data_filter.apply(data, axis=1)
         return Bunch(
             data=data,
             channel_ids=channel_ids,
@@ -216,10 +884,9 @@ class WaveformMixin(object):
 
     def _get_waveforms(self, cluster_id):
         """Return a selection of waveforms for a cluster."""
-        return self._get_waveforms_with_n_spikes(
-            cluster_id, self.n_spikes_waveforms, current_filter=self.raw_data_filter.current)
+        return self._get_waveforms_with_n_spikes(cluster_id, self.n_spikes_waveforms)
 
-    def _get_mean_waveforms(self, cluster_id, current_filter=None):
+    def _get_mean_waveforms(self, cluster_id):
         """Get the mean waveform of a cluster on its best channels."""
         b = self._get_waveforms(cluster_id)
         if b.data is not None:
@@ -237,6 +904,7 @@ class WaveformMixin(object):
         return {name: getattr(self, method) for name, method in waveform_functions}
 
     def create_waveform_view(self):
+        from phy.cluster.views import WaveformView
         waveforms_dict = self._get_waveforms_dict()
         if not waveforms_dict:
             return
@@ -290,6 +958,14 @@ class FeatureMixin(object):
         'get_spike_feature_amplitudes',
     )
 
+    _cluster_keyed = (
+        '_get_features',
+    )
+
+    _cache_state = (
+        ('_get_features', 'n_spikes_features'),
+    )
+
     def get_spike_feature_amplitudes(
             self, spike_ids, channel_id=None, channel_ids=None, pc=None, **kwargs):
         """Return the features for the specified channel and PC."""
@@ -386,6 +1062,7 @@ class FeatureMixin(object):
         return self._get_spike_features(spike_ids, channel_ids)
 
     def create_feature_view(self):
+        from phy.cluster.views import FeatureView
         if self.model.features is None and getattr(self.model, 'spike_waveforms', None) is None:
             # NOTE: we can still construct the feature view when there are spike waveforms.
             return
@@ -460,12 +1137,24 @@ class TemplateMixin(object):
     _memcached = (
         '_get_template_waveforms',
         'get_mean_spike_template_amplitudes',
-        'get_template_counts',
         'get_template_for_cluster',
         'get_template_amplitude',
         'get_cluster_amplitude',
     )
 
+    _cluster_keyed = (
+        'get_amplitudes',
+        '_get_template_waveforms',
+        'get_mean_spike_template_amplitudes',
+        'get_template_for_cluster',
+        'get_cluster_amplitude',
+    )
+
+    _cache_state = (
+        ('get_amplitudes', 'n_spikes_amplitudes'),
+        ('get_mean_spike_template_amplitudes', 'n_spikes_amplitudes'),
+    )
+
     def __init__(self, *args, **kwargs):
         super(TemplateMixin, self).__init__(*args, **kwargs)
 
@@ -480,19 +1169,25 @@ class TemplateMixin(object):
         spike_ids = self._get_amplitude_spike_ids(cluster_id, load_all=load_all)
         return self.model.amplitudes[spike_ids]
 
+    def _set_supervisor(self):
+        super(TemplateMixin, self)._set_supervisor()
+        clustering = self.supervisor.clustering
+        # Sparse cluster x template counts, updated after every clustering action, including
+        # the actions made within a supervisor batch.
+        self.template_counts = ClusterTemplateCounts(
+            self.model.spike_templates, self.model.n_templates, lambda: clustering.spike_clusters)
+        connect(self._update_template_counts, event='cluster', sender=clustering)
+
+    def _update_template_counts(self, sender, up):
+        self.template_counts.update(up)
+
     def get_template_counts(self, cluster_id):
         """Return a histogram of the number of spikes in each template for a given cluster."""
-        spike_ids = self.supervisor.clustering.spikes_per_cluster[cluster_id]
-        st = self.model.spike_templates[spike_ids]
-        return np.bincount(st, minlength=self.model.n_templates)
+        return self.template_counts.get_dense(cluster_id)
 
     def get_template_for_cluster(self, cluster_id):
         """Return the largest template associated to a cluster."""
-        spike_ids = self.supervisor.clustering.spikes_per_cluster[cluster_id]
-        st = self.model.spike_templates[spike_ids]
-        template_ids, counts = np.unique(st, return_counts=True)
-        ind = np.argmax(counts)
-        return template_ids[ind]
+        return self.template_counts.best_template(cluster_id)
 
     def get_template_amplitude(self, template_id):
         """Return the maximum amplitude of a template's waveforms across all channels."""
@@ -545,9 +1240,7 @@ class TemplateMixin(object):
     def _get_template_waveforms(self, cluster_id):
         """Return the waveforms of the templates corresponding to a cluster."""
         pos = self.model.channel_positions
-        count = self.get_template_counts(cluster_id)
-        template_ids = np.nonzero(count)[0]
-        count = count[template_ids]
+        template_ids, count = self.template_counts.get(cluster_id)
         # Get local channels.
         channel_ids = self.get_best_channels(cluster_id)
         # Get masks, related to the number of spikes per template which the cluster stems from.
@@ -586,6 +1279,7 @@ class TemplateMixin(object):
 
     def create_template_view(self):
         """Create a template view."""
+        from phy.cluster.views import TemplateView
         view = TemplateView(
             templates=self._get_all_templates,
             channel_ids=np.arange(self.model.n_channels),
@@ -601,23 +1295,87 @@ class TraceMixin(object):
     _new_views = ('TraceView', 'TraceImageView')
     waveform_duration = 1.0  # in milliseconds
 
-    def _get_traces(self, interval, show_all_spikes=False):
-        """Get traces and spike waveforms."""
-        traces_interval = select_traces(
-            self.model.traces, interval, sample_rate=self.model.sample_rate)
-        # Filter the loaded traces.
-        traces_interval = self.raw_data_filter.apply(traces_interval, axis=0)
-        out = Bunch(data=traces_interval)
-        out.waveforms = list(_iter_spike_waveforms(
+    # Whether to display long intervals from the trace pyramid, which is built in the cache
+    # directory.
+    use_trace_pyramid = True
+
+    _state_params = (
+        'use_trace_pyramid',
+    )
+
+    # Mapping {trace_view: (interval, spike_index)} with the spikes of the last window of every
+    # trace view.
+    _trace_spike_index_cache = None
+
+    @property
+    def _n_samples_trace_waveforms(self):
+        return int(round(1e-3 * self.waveform_duration * self.model.sample_rate))
+
+    def _get_trace_waveforms(
+            self, interval, traces_interval, cluster_ids, show_all_spikes, spike_index=None):
+        """Return the spike waveforms in a trace window."""
+        from phy.cluster.views.trace import _extract_spike_waveforms
+        return _extract_spike_waveforms(
             interval=interval,
             traces_interval=traces_interval,
             model=self.model,
-            supervisor=self.supervisor,
-            n_samples_waveforms=int(round(1e-3 * self.waveform_duration * self.model.sample_rate)),
+            supervisor=Bunch(selected=cluster_ids),
+            n_samples_waveforms=self._n_samples_trace_waveforms,
             get_best_channels=self.get_channel_amplitudes,
             show_all_spikes=show_all_spikes,
-        ))
-        return out
+            spike_index=spike_index,
+        )
+
+    def _get_trace_spike_waveforms(
+            self, view, interval, traces_interval, show_all_spikes=False):
+        """Return the spike waveforms of the selected clusters in a trace view window, keeping
+        the spikes of the window in memory while the selection changes."""
+        from phy.cluster.views.trace import _trace_spike_index
+        interval = tuple(interval)
+        cached = self._trace_spike_index_cache.get(view, None)
+        if cached is None or cached[0] != interval:
+            cached = (interval, _trace_spike_index(
+                interval=interval, model=self.model,
+                n_samples_waveforms=self._n_samples_trace_waveforms))
+            self._trace_spike_index_cache[view] = cached
+        return self._get_trace_waveforms(
+            interval, traces_interval, self.supervisor.selected, show_all_spikes,
+            spike_index=cached[1])
+
+    def _get_traces(self, interval, show_all_spikes=False, n_pixels=None):
+        """Get traces and spike waveforms, or the minima and maxima of the traces from the
+        trace pyramid when the interval is long compared to the number of pixels."""
+        if n_pixels and self.use_trace_pyramid and self.filtered_traces.is_active:
+            sr = self.model.sample_rate
+            out = self.trace_pyramid.get(
+                int(round(interval[0] * sr)), int(round(interval[1] * sr)), n_pixels)
+            if out is not None:
+                samples, data = out
+                return Bunch(data=data, times=samples / sr, waveforms=[])
+        return self.trace_cache.get(
+            interval, self.supervisor.selected, show_all_spikes=show_all_spikes)
+
+    def _set_supervisor(self):
+        super(TraceMixin, self)._set_supervisor()
+        if self.model.traces is None:
+            return
+        # Filtered trace windows, prefetched in the scroll direction.
+        self.trace_cache = TraceCache(
+            traces=self.model.traces, sample_rate=self.model.sample_rate,
+            raw_data_filter=self.raw_data_filter,
+            get_spike_waveforms=self._get_trace_waveforms,
+            prefetch=self._enable_threading, filtered_traces=self.filtered_traces)
+        # Minima and maxima of the filtered traces, to display long intervals.
+        self.trace_pyramid = TracePyramid(
+            path=self.cache_dir / 'trace_pyramid', filtered_traces=self.filtered_traces,
+            background=self._enable_threading)
+        self._trace_spike_index_cache = {}
+        connect(self._update_trace_cache, event='cluster', sender=self.supervisor)
+
+    def _update_trace_cache(self, sender, up):
+        # The spike waveforms depend on the spike clusters.
+        self.trace_cache.clear()
+        self._trace_spike_index_cache.clear()
 
     def _trace_spike_times(self):
         cluster_ids = self.supervisor.selected
@@ -630,6 +1388,7 @@ class TraceMixin(object):
 
     def create_trace_view(self):
         """Create a trace view."""
+        from phy.cluster.views import TraceView
         if self.model.traces is None:
             return
 
@@ -643,11 +1402,20 @@ class TraceMixin(object):
             channel_positions=self.model.channel_positions,
         )
 
-        # Update the get_traces() function with show_all_spikes.
+        # Update the get_traces() function with show_all_spikes and the width of the view.
         def _get_traces(interval):
-            return self._get_traces(interval, show_all_spikes=view.show_all_spikes)
+            return self._get_traces(
+                interval, show_all_spikes=view.show_all_spikes, n_pixels=view.n_pixels)
         view.traces = _get_traces
+
+        # Only update the spike waveforms when the cluster selection changes.
+        def _get_spike_waveforms(interval, traces_interval):
+            return self._get_trace_spike_waveforms(
+                view, interval, traces_interval, show_all_spikes=view.show_all_spikes)
+        view.spike_waveforms = _get_spike_waveforms
         view.ex_status = self.raw_data_filter.current
+        if self._enable_threading and self.use_trace_pyramid:
+            self.trace_pyramid.build()
 
         @connect(sender=view)
         def on_select_spike(sender, channel_id=None, spike_id=None, cluster_id=None):
@@ -669,11 +1437,13 @@ class TraceMixin(object):
             unconnect(on_select_spike)
             unconnect(on_time_range_selected)
             unconnect(on_select_time)
+            self._trace_spike_index_cache.pop(view, None)
 
         return view
 
     def create_trace_image_view(self):
         """Create a trace image view."""
+        from phy.cluster.views import TraceImageView
         if self.model.traces is None:
             return
 
@@ -686,6 +1456,12 @@ class TraceMixin(object):
             channel_positions=self.model.channel_positions,
         )
 
+        def _get_traces(interval):
+            return self._get_traces(interval, n_pixels=view.n_pixels)
+        view.traces = _get_traces
+        if self._enable_threading and self.use_trace_pyramid:
+            self.trace_pyramid.build()
+
         @connect
         def on_select_time(sender, time):
             view.go_to(time)
@@ -843,13 +1619,21 @@ class BaseController(object):
         'get_best_channels',
         'get_channel_shank',
         'get_probe_depth',
-        'peak_channel_similarity',
     )
     # Methods that are cached on disk for performance.
-    _cached = (
-        '_get_correlograms',
-        '_get_correlograms_rate',
+    _cached = ()
+    # Cached methods whose first argument is a cluster id or a list of cluster ids. Their cached
+    # results are discarded when the clusters are deleted.
+    _cluster_keyed = (
+        'get_mean_firing_rate',
+        'get_best_channel',
+        'get_best_channels',
+        'get_channel_shank',
+        'get_probe_depth',
     )
+    # Pairs (method, attribute) with the controller attributes on which cached methods depend,
+    # in addition to their arguments. The attributes are part of the cache keys.
+    _cache_state = ()
 
     # Views to load by default.
     _new_views = (
@@ -886,6 +1670,11 @@ class BaseController(object):
         # Raw data filter.
         self.raw_data_filter = RawDataFilter()
         self.raw_data_filter.add_default_filter(self.model.sample_rate)
+        self.filtered_traces = (
+            FilteredTraces(
+                traces=self.model.traces, sample_rate=self.model.sample_rate,
+                raw_data_filter=self.raw_data_filter)
+            if getattr(self.model, 'traces', None) is not None else None)
 
         # Map view names to method creating new views. Other views can be added by plugins.
         self._set_view_creator()
@@ -901,6 +1690,7 @@ class BaseController(object):
         if getattr(self, 'default_views', None) is None:
             self.default_views = _concatenate_parents_attributes(self.__class__, '_new_views')
         self._async_callers = {}
+        self._save_thread = None
         self.config_dir = config_dir
 
         # Clear the GUI state files if needed.
@@ -943,6 +1733,7 @@ class BaseController(object):
 
     def _clear_state(self):
         """Clear the global and local GUI state files."""
+        from phy.gui.state import _gui_state_path
         state_path = _gui_state_path(self.gui_name, config_dir=self.config_dir)
         if state_path.exists():
             logger.warning("Deleting %s.", state_path)
@@ -968,8 +1759,8 @@ class BaseController(object):
         self.view_creator = {
             'ClusterScatterView': self.create_cluster_scatter_view,
             'CorrelogramView': self.create_correlogram_view,
-            'ISIView': self._make_histogram_view(ISIView, self._get_isi),
-            'FiringRateView': self._make_histogram_view(FiringRateView, self._get_firing_rate),
+            'ISIView': self._make_histogram_view('ISIView', self._get_isi),
+            'FiringRateView': self._make_histogram_view('FiringRateView', self._get_firing_rate),
             'AmplitudeView': self.create_amplitude_view,
             'ProbeView': self.create_probe_view,
             'RasterView': self.create_raster_view,
@@ -1028,8 +1819,37 @@ class BaseController(object):
         # to the model's saving functions.
         connect(self.on_save_clustering, sender=supervisor)
 
+        # NOTE: the caches below are updated on the clustering's cluster events, which are raised
+        # once per action, even within a supervisor batch, and before the supervisor's event.
+
+        # Inverted index of the clusters on every channel, updated after every action.
+        self.channel_cluster_index = ChannelClusterIndex(
+            lambda: supervisor.clustering.cluster_ids, self.get_best_channels)
+        connect(
+            self._update_channel_cluster_index, event='cluster', sender=supervisor.clustering)
+
+        # Pairwise correlograms, updated after every action.
+        self.pairwise_correlograms = PairwiseCorrelograms(
+            self.model.spike_times, self._get_correlogram_spike_ids,
+            sample_rate=self.model.sample_rate, duration=self.model.duration)
+        connect(
+            self._update_correlograms, event='cluster', sender=supervisor.clustering)
+
+        # Discard the cached results of the deleted clusters.
+        connect(self._invalidate_cache, event='cluster', sender=supervisor.clustering)
+
         self.supervisor = supervisor
 
+    def _update_channel_cluster_index(self, sender, up):
+        self.channel_cluster_index.update(up)
+
+    def _update_correlograms(self, sender, up):
+        self.pairwise_correlograms.update(up)
+
+    def _invalidate_cache(self, sender, up):
+        if up.deleted:
+            self.context.invalidate_clusters(up.deleted)
+
     def _set_selector(self):
         """Set the Selector instance."""
 
@@ -1042,7 +1862,11 @@ class BaseController(object):
         except AttributeError:
             chunk_bounds = [0.0, self.model.spike_samples[-1] + 1]
 
+        def spike_order(cluster_id):
+            return self.supervisor.clustering.spike_order(cluster_id)
+
         self.selector = SpikeSelector(
+            get_spike_order=spike_order,
             get_spikes_per_cluster=spikes_per_cluster,
             spike_times=self.model.spike_samples,  # NOTE: chunk_bounds is in samples, not seconds
             chunk_bounds=chunk_bounds,
@@ -1052,9 +1876,13 @@ class BaseController(object):
         """Cache methods as specified in `self._memcached` and `self._cached`."""
         # Environment variable that can be used to disable the cache.
         if not os.environ.get('PHY_DISABLE_CACHE', False):
-            memcached = _concatenate_parents_attributes(self.__class__, '_memcached')
-            cached = _concatenate_parents_attributes(self.__class__, '_cached')
-            _cache_methods(self, memcached, cached)
+            # NOTE: classes that do not define these attributes inherit them from their parents,
+            # so we remove the duplicates to avoid caching the same method twice.
+            memcached, cached, cluster_keyed, state = (
+                list(dict.fromkeys(_concatenate_parents_attributes(self.__class__, name)))
+                for name in ('_memcached', '_cached', '_cluster_keyed', '_cache_state'))
+            _cache_methods(
+                self, memcached, cached, cluster_keyed=cluster_keyed, state=state)
 
     def _get_channel_labels(self, channel_ids=None):
         """Return the labels of a list of channels."""
@@ -1081,6 +1909,7 @@ class BaseController(object):
         # Async caller to avoid blocking cluster view loading when updating the view.
         # NOTE: it needs to be set as a property so as not to be garbage collected, leading
         # to Qt C++ segfaults.
+        from phy.gui.qt import AsyncCaller
         self._async_callers[view] = ac = AsyncCaller(delay=0)
 
         def resort(is_async=True, up=None):
@@ -1154,18 +1983,38 @@ class BaseController(object):
     # -------------------------------------------------------------------------
 
     def on_save_clustering(self, sender, spike_clusters, groups, *labels):
-        """Save the modified data."""
+        """Save the modified data in a background thread."""
+        # NOTE: the data is copied here as the clustering may change during the save.
+        self._run_save(
+            self._save_clustering, spike_clusters.copy(), labels, self.supervisor.cluster_info)
+
+    def _save_clustering(self, spike_clusters, labels, cluster_info):
         # Save the clusters.
         self.model.save_spike_clusters(spike_clusters)
         # Save cluster metadata.
         for name, values in labels:
             self.model.save_metadata(name, values)
-        self._save_cluster_info()
-
-    def _save_cluster_info(self):
+        self._save_cluster_info(cluster_info)
+
+    def _run_save(self, f, *args):
+        """Run a saving function in a background thread, if threading is enabled, once the
+        previous saving has finished."""
+        self.wait_save()
+        if not self._enable_threading:
+            return f(*args)
+        self._save_thread = threading.Thread(target=f, args=args, name='phy-save')
+        self._save_thread.start()
+
+    def wait_save(self):
+        """Wait until the data has been saved to disk."""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+    def _save_cluster_info(self, cluster_info=None):
         """Save all the contents of the cluster view into `cluster_info.tsv`."""
         # HACK: rename id to cluster_id for consistency in the cluster_info.tsv file.
-        cluster_info = self.supervisor.cluster_info.copy()
+        cluster_info = (cluster_info or self.supervisor.cluster_info).copy()
         for d in cluster_info:
             d['cluster_id'] = d.pop('id')
         write_tsv(
@@ -1219,9 +2068,7 @@ class BaseController(object):
 
     def get_clusters_on_channel(self, channel_id):
         """Return all clusters which have the specified channel among their best channels."""
-        return [
-            cluster_id for cluster_id in self.supervisor.clustering.cluster_ids
-            if channel_id in self.get_best_channels(cluster_id)]
+        return self.channel_cluster_index.get(channel_id)
 
     # Default similarity functions
     # -------------------------------------------------------------------------
@@ -1242,9 +2089,7 @@ class BaseController(object):
 
         """
         ch = self.get_best_channel(cluster_id)
-        return [
-            (other, 1.) for other in self.supervisor.clustering.cluster_ids
-            if ch in self.get_best_channels(other)]
+        return [(other, 1.) for other in self.get_clusters_on_channel(ch)]
 
     # Public spike methods
     # -------------------------------------------------------------------------
@@ -1357,6 +2202,7 @@ class BaseController(object):
 
     def create_amplitude_view(self):
         """Create the amplitude view."""
+        from phy.cluster.views import AmplitudeView
         amplitudes_dict = {
             name: partial(self._amplitude_getter, name=name)
             for name in sorted(self._get_amplitude_functions())}
@@ -1416,6 +2262,7 @@ class BaseController(object):
 
     def create_cluster_scatter_view(self):
         """Create a cluster scatter view."""
+        from phy.cluster.views import ClusterScatterView
         view = ClusterScatterView(
             cluster_ids=self.supervisor.clustering.cluster_ids,
             cluster_info=self.supervisor.get_cluster_info,
@@ -1458,6 +2305,7 @@ class BaseController(object):
 
     def create_raster_view(self):
         """Create a raster view."""
+        from phy.cluster.views import RasterView
         view = RasterView(
             self.model.spike_times,
             self.supervisor.clustering.spike_clusters,
@@ -1470,24 +2318,24 @@ class BaseController(object):
     # Correlograms
     # -------------------------------------------------------------------------
 
-    def _get_correlograms(self, cluster_ids, bin_size, window_size):
-        """Return the cross- and auto-correlograms of a set of clusters."""
-        spike_ids = self.selector(self.n_spikes_correlograms, cluster_ids)
-        st = self.model.spike_times[spike_ids]
-        sc = self.supervisor.clustering.spike_clusters[spike_ids]
-        return correlograms(
-            st, sc, sample_rate=self.model.sample_rate, cluster_ids=cluster_ids,
-            bin_size=bin_size, window_size=window_size)
+    def _get_correlogram_spike_ids(self, cluster_id, n_spikes):
+        return self.selector(n_spikes, [cluster_id])
+
+    def _get_correlograms(self, cluster_ids, bin_size, window_size, all_spikes=False):
+        """Return the cross- and auto-correlograms of a set of clusters, computed on all spikes
+        or on a subset of `n_spikes_correlograms` spikes per cluster."""
+        return self.pairwise_correlograms.correlograms(
+            cluster_ids, bin_size, window_size,
+            n_spikes=None if all_spikes else self.n_spikes_correlograms)
 
-    def _get_correlograms_rate(self, cluster_ids, bin_size):
+    def _get_correlograms_rate(self, cluster_ids, bin_size, all_spikes=False):
         """Return the baseline firing rate of the cross- and auto-correlograms of clusters."""
-        spike_ids = self.selector(self.n_spikes_correlograms, cluster_ids)
-        sc = self.supervisor.clustering.spike_clusters[spike_ids]
-        return firing_rate(
-            sc, cluster_ids=cluster_ids, bin_size=bin_size, duration=self.model.duration)
+        return self.pairwise_correlograms.firing_rate(
+            cluster_ids, bin_size, n_spikes=None if all_spikes else self.n_spikes_correlograms)
 
     def create_correlogram_view(self):
         """Create a correlogram view."""
+        from phy.cluster.views import CorrelogramView
         return CorrelogramView(
             correlograms=self._get_correlograms,
             firing_rate=self._get_correlograms_rate,
@@ -1499,6 +2347,7 @@ class BaseController(object):
 
     def create_probe_view(self):
         """Create a probe view."""
+        from phy.cluster.views import ProbeView
         return ProbeView(
             positions=self.model.channel_positions,
             best_channels=self.get_best_channels,
@@ -1508,10 +2357,11 @@ class BaseController(object):
     # Histogram views
     # -------------------------------------------------------------------------
 
-    def _make_histogram_view(self, view_cls, method):
-        """Return a function that creates a HistogramView of a given class."""
+    def _make_histogram_view(self, view_name, method):
+        """Return a function that creates a HistogramView of a given class name."""
         def _make():
-            return view_cls(cluster_stat=method)
+            from phy.cluster import views
+            return getattr(views, view_name)(cluster_stat=method)
         return _make
 
     def _get_isi(self, cluster_id):
@@ -1545,11 +2395,14 @@ class BaseController(object):
                 bunchs.append(Bunch(x=x, y=y, spike_ids=spike_ids, data_bounds=None))
             return bunchs
 
-        # Dynamic type deriving from ScatterView.
-        view_cls = type(view_name, (ScatterView,), {})
+        # Dynamic type deriving from ScatterView, created with the first view.
+        view_cls = []
 
         def _make():
-            return view_cls(coords=coords)
+            if not view_cls:
+                from phy.cluster.views import ScatterView
+                view_cls.append(type(view_name, (ScatterView,), {}))
+            return view_cls[0](coords=coords)
         return _make
 
     # IPython View
@@ -1557,6 +2410,7 @@ class BaseController(object):
 
     def create_ipython_view(self):
         """Create an IPython View."""
+        from phy.gui.widgets import IPythonView
         view = IPythonView()
         view.start_kernel()
         view.inject(
@@ -1581,6 +2435,7 @@ class BaseController(object):
                 gui.create_and_add_view(view_name)
 
     def create_misc_actions(self, gui):
+        from phy.cluster.views import TraceView, WaveformView
 
         # Toggle spike reorder.
         @gui.view_actions.add(
@@ -1654,6 +2509,9 @@ class BaseController(object):
             count are added.
 
         """
+        from phy.cluster.views.base import ManualClusteringView, BaseColorView
+        from phy.gui import GUI
+        from phy.gui.gui import _prompt_save
         default_views = self.default_views if default_views is None else default_views
         gui = GUI(
             name=self.gui_name,
@@ -1724,6 +2582,10 @@ class BaseController(object):
                     # Prevent closing of the GUI by returning False.
                     return False
                 # Otherwise (r is 'close') we do nothing and close as usual.
+            # The session is over: wait for the data to be saved and discard the journal.
+            self.wait_save()
+            if self.supervisor.journal:
+                self.supervisor.journal.clear()
 
         # Status bar handler
         handler = StatusBarHandler(gui)
@@ -227,10 +227,14 @@ class KwikController(WaveformMixin, FeatureMixin, TraceMixin, BaseController):
         return channel_ids, np.ones(len(channel_ids))
 
     def on_save_clustering(self, sender, spike_clusters, groups, *labels):
-        """Save the modified data."""
+        """Save the modified data in a background thread."""
         groups = {c: g.title() for c, g in groups.items()}
+        self._run_save(
+            self._save_clustering, spike_clusters.copy(), groups, self.supervisor.cluster_info)
+
+    def _save_clustering(self, spike_clusters, groups, cluster_info):
         self.model.save(spike_clusters, groups)
-        self._save_cluster_info()
+        self._save_cluster_info(cluster_info)
 
 
 #------------------------------------------------------------------------------
@@ -8,4 +8,4 @@
 #------------------------------------------------------------------------------
 
 from phylib.io.model import TemplateModel, from_sparse, get_template_params, load_model  # noqa
-from .gui import TemplateController, template_describe, template_gui  # noqa
+from .gui import TemplateController, template_curate, template_describe, template_gui  # noqa
@@ -7,9 +7,10 @@
 # Imports
 #------------------------------------------------------------------------------
 
+from concurrent.futures import ProcessPoolExecutor
 import logging
-from operator import itemgetter
 from pathlib import Path
+import runpy
 
 import numpy as np
 
@@ -18,21 +19,12 @@ from phylib.io.model import TemplateModel, load_model
 from phylib.io.traces import MtscompEphysReader
 from phylib.utils import Bunch, connect
 
-from phy.cluster.views import ScatterView
-from phy.gui import create_app, run_app
+from phy.cluster import TemplateSimilarityIndex
 from ..base import WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin, BaseController
 
 logger = logging.getLogger(__name__)
 
 
-#------------------------------------------------------------------------------
-# Custom views
-#------------------------------------------------------------------------------
-
-class TemplateFeatureView(ScatterView):
-    """Scatter view showing the template features."""
-
-
 #------------------------------------------------------------------------------
 # Template Controller
 #------------------------------------------------------------------------------
@@ -60,6 +52,12 @@ class TemplateController(WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin,
 
     gui_name = 'TemplateGUI'
 
+    # Number of most similar clusters shown in the similarity view.
+    n_similar_clusters = 200
+
+    # Index of the most similar clusters, created when the similarity is first requested.
+    _similarity_index = None
+
     # Specific views implemented in this class.
     _new_views = ('TemplateFeatureView',)
 
@@ -106,6 +104,18 @@ class TemplateController(WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin,
                 s = supervisor.clustering.spikes_in_clusters(cluster_ids)
                 supervisor.actions.split(s, self.model.spike_templates[s])
 
+        # NOTE: the clustering raises one event per action, even within a supervisor batch, and
+        # before the supervisor's cluster event. The similarity index is thus up-to-date when
+        # the similarity view is updated after an action, and within a batch. This callback is
+        # connected after the template counts are updated.
+        @connect(sender=supervisor.clustering)
+        def on_cluster(sender, up):
+            if self._similarity_index is None or not (up.added or up.deleted):
+                return
+            self._similarity_index.update(
+                added={c: self.template_counts.get(c)[0] for c in up.added},
+                deleted=up.deleted)
+
     def _set_similarity_functions(self):
         super(TemplateController, self)._set_similarity_functions()
         self.similarity_functions['template'] = self.template_similarity
@@ -163,23 +173,19 @@ class TemplateController(WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin,
         d = (M - m) if m < M else 1.0
         return template.channel_ids, (template.amplitude - m) / d
 
+    def _create_similarity_index(self):
+        index = TemplateSimilarityIndex(
+            self.model.similar_templates, n_neighbors=self.n_similar_clusters)
+        index.set_templates(
+            {c: template_ids for c, (template_ids, _) in self.template_counts.rows.items()})
+        return index
+
     def template_similarity(self, cluster_id):
-        """Return the list of similar clusters to a given cluster."""
-        # Templates of the cluster.
-        temp_i = np.nonzero(self.get_template_counts(cluster_id))[0]
-        # The similarity of the cluster with each template.
-        sims = np.max(self.model.similar_templates[temp_i, :], axis=0)
-
-        def _sim_ij(cj):
-            # Templates of the cluster.
-            if cj < self.model.n_templates:
-                return float(sims[cj])
-            temp_j = np.nonzero(self.get_template_counts(cj))[0]
-            return float(np.max(sims[temp_j]))
-
-        out = [(cj, _sim_ij(cj)) for cj in self.supervisor.clustering.cluster_ids]
-        # NOTE: hard-limit to 100 for performance reasons.
-        return sorted(out, key=itemgetter(1), reverse=True)[:100]
+        """Return the list of the `n_similar_clusters` most similar clusters to a given
+        cluster."""
+        if self._similarity_index is None:
+            self._similarity_index = self._create_similarity_index()
+        return self._similarity_index.similar(cluster_id)
 
     def get_template_amplitude(self, template_id):
         """Return the maximum amplitude of a template's waveforms across all channels."""
@@ -190,6 +196,7 @@ class TemplateController(WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin,
         return (waveforms.max(axis=0) - waveforms.min(axis=0)).max()
 
     def create_template_feature_view(self):
+        from .views import TemplateFeatureView
         if self.model.template_features is None:
             return
         return TemplateFeatureView(coords=self._get_template_features)
@@ -201,6 +208,7 @@ class TemplateController(WaveformMixin, FeatureMixin, TemplateMixin, TraceMixin,
 
 def template_gui(params_path, **kwargs):  # pragma: no cover
     """Launch the Template GUI."""
+    from phy.gui import create_app, run_app
     # Create a `phy.log` log file with DEBUG level.
     p = Path(params_path)
     dir_path = p.parent
@@ -222,8 +230,103 @@ def template_gui(params_path, **kwargs):  # pragma: no cover
     controller.model.close()
 
 
+def _template_curate_session(params_path, rules_path):
+    """Apply a curation script on a template dataset without GUI, and save the result."""
+    p = Path(params_path)
+    dir_path = p.parent
+    _add_log_file(dir_path / 'phy.log')
+
+    curate = runpy.run_path(str(rules_path)).get('curate', None)
+    if curate is None:
+        raise ValueError(
+            "The curation script `%s` should define a `curate(controller)` function." %
+            rules_path)
+
+    model = load_model(params_path)
+    # No GUI or view is created here, the controller only provides the clustering, the
+    # cluster metadata, the cluster metrics and the similarity functions.
+    controller = TemplateController(model=model, dir_path=dir_path, enable_threading=False)
+    supervisor = controller.supervisor
+    n_clusters = supervisor.clustering.n_clusters
+
+    # All actions are applied as a single batch, without refreshing anything in between.
+    with supervisor.batch():
+        curate(controller)
+
+    supervisor.save()
+    # The curated data has been saved, the journal of the actions is not needed anymore.
+    supervisor.journal.clear()
+    controller.context.save_memcache()
+    model.close()
+    logger.info(
+        "Curated %s: %d clusters => %d clusters.",
+        dir_path, n_clusters, supervisor.clustering.n_clusters)
+    return supervisor.clustering.n_clusters
+
+
+def template_curate(params_paths, rules_path, n_jobs=None):
+    """Apply a curation script on one or several template datasets, without GUI.
+
+    The curation script is a Python file defining a function `curate(controller)`, which
+    receives a `TemplateController` instance without GUI. The function may use
+    `controller.cluster_metrics`, `controller.similarity_functions`, `controller.model`, and
+    the clustering actions of `controller.supervisor` (`merge()`, `split()`, `label()`,
+    `move()`). The result is saved at the end.
+
+    Parameters
+    ----------
+
+    params_paths : str or list
+        One or several paths to `params.py` files.
+    rules_path : str
+        Path to the curation script.
+    n_jobs : int
+        Number of processes used to curate several datasets in parallel. By default, this is
+        the number of CPUs.
+
+    Returns
+    -------
+
+    n_clusters : dict
+        Maps every params path to the number of clusters after curation, or to the exception
+        raised during the curation.
+
+    """
+    if isinstance(params_paths, (str, Path)):
+        params_paths = [params_paths]
+    params_paths = [str(p) for p in params_paths]
+    out = {}
+    if n_jobs == 1 or len(params_paths) == 1:
+        for params_path in params_paths:
+            try:
+                out[params_path] = _template_curate_session(params_path, rules_path)
+            except Exception as e:
+                logger.error("Error while curating %s: %s", params_path, e)
+                out[params_path] = e
+        return out
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {
+            params_path: executor.submit(_template_curate_session, params_path, rules_path)
+            for params_path in params_paths}
+        for params_path, future in futures.items():
+            try:
+                out[params_path] = future.result()
+            except Exception as e:
+                logger.error("Error while curating %s: %s", params_path, e)
+                out[params_path] = e
+    return out
+
+
 def template_describe(params_path):
     """Describe a template dataset."""
     model = load_model(params_path)
     model.describe()
     model.close()
+
+
+def __getattr__(name):
+    # The views depend on Qt and OpenGL, they are only imported when they are first used.
+    if name == 'TemplateFeatureView':
+        from .views import TemplateFeatureView
+        return TemplateFeatureView
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -9,6 +9,8 @@
 import logging
 from pathlib import Path
 import re
+import subprocess
+import sys
 import unittest
 
 import numpy as np
@@ -19,7 +21,7 @@ from phylib.utils.testing import captured_output
 
 from phy.apps.tests.test_base import MinimalControllerTests, BaseControllerTests, GlobalViewsTests
 from ..gui import (
-    template_describe, TemplateController, TemplateFeatureView)
+    template_curate, template_describe, TemplateController, TemplateFeatureView)
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +45,91 @@ def test_template_describe(qtbot, tempdir):
     assert '314' in stdout.getvalue()
 
 
+def test_template_curate(tempdir):
+    params_path = _make_dataset(tempdir, param='dense', has_spike_attributes=False)
+    model = load_model(params_path)
+    spike_clusters = model.spike_clusters.copy()
+    model.close()
+
+    rules_path = tempdir / 'rules.py'
+    rules_path.write_text(
+        'def curate(controller):\n'
+        '    s = controller.supervisor\n'
+        '    s.merge([0, 1])\n'
+        '    s.label("quality", 3, cluster_ids=[2])\n')
+    out = template_curate(params_path, rules_path)
+    assert list(out.values()) == [len(np.unique(spike_clusters)) - 1]
+
+    model = load_model(params_path)
+    merged = np.isin(spike_clusters, [0, 1])
+    assert np.all(model.spike_clusters[merged] == spike_clusters.max() + 1)
+    assert np.all(model.spike_clusters[~merged] == spike_clusters[~merged])
+    assert model.metadata['quality'] == {2: 3}
+    model.close()
+
+    # Invalid curation script.
+    rules_path.write_text('')
+    assert isinstance(template_curate(params_path, rules_path)[str(params_path)], ValueError)
+
+
+def test_template_curate_without_qt(tempdir):
+    params_path = _make_dataset(tempdir, param='dense', has_spike_attributes=False)
+    rules_path = tempdir / 'rules.py'
+    rules_path.write_text(
+        'def curate(controller):\n'
+        '    controller.supervisor.merge([0, 1])\n')
+    # Run the command in a Python process where PyQt5 and OpenGL cannot be imported.
+    script = (
+        'import sys\n'
+        'class BlockQt(object):\n'
+        '    def find_spec(self, name, path, target=None):\n'
+        '        if name.split(".")[0] in ("PyQt5", "OpenGL"):\n'
+        '            raise ImportError(name)\n'
+        'sys.meta_path.insert(0, BlockQt())\n'
+        'from phy.apps import phycli\n'
+        'phycli(["template-curate", sys.argv[1], sys.argv[2]])\n')
+    subprocess.run(
+        [sys.executable, '-c', script, str(params_path), str(rules_path)],
+        cwd=str(Path(__file__).parents[4]), check=True)
+    model = load_model(params_path)
+    assert 0 not in model.spike_clusters
+    model.close()
+
+
+def test_template_curate_indexes(tempdir):
+    params_path = _make_dataset(tempdir, param='dense', has_spike_attributes=False)
+    model = load_model(params_path)
+    spike_clusters = model.spike_clusters.copy()
+    model.close()
+
+    # The controller indexes are up-to-date after every action of the curation script.
+    rules_path = tempdir / 'rules.py'
+    rules_path.write_text(
+        'def curate(controller):\n'
+        '    s = controller.supervisor\n'
+        '    s.merge([0, 1])\n'
+        '    new = int(s.clustering.cluster_ids[-1])\n'
+        '    similar = [c for c, _ in controller.template_similarity(new)]\n'
+        '    assert similar\n'
+        '    assert 0 not in similar and 1 not in similar and new not in similar\n'
+        '    for c in s.clustering.cluster_ids:\n'
+        '        assert not {0, 1} & {d for d, _ in controller.template_similarity(c)}\n'
+        '    channel_id = controller.get_best_channels(new)[0]\n'
+        '    clusters = controller.get_clusters_on_channel(channel_id)\n'
+        '    assert new in clusters and 0 not in clusters and 1 not in clusters\n'
+        '    # Merge the new cluster with its most similar cluster.\n'
+        '    s.merge([new, similar[0]])\n'
+        '    assert controller.get_template_counts(new + 1).sum() == (\n'
+        '        len(s.clustering.spikes_per_cluster[new + 1]))\n')
+    out = template_curate(params_path, rules_path)
+    assert list(out.values()) == [len(np.unique(spike_clusters)) - 2]
+
+    model = load_model(params_path)
+    assert np.sum(model.spike_clusters == spike_clusters.max() + 2) > np.sum(
+        np.isin(spike_clusters, [0, 1]))
+    model.close()
+
+
 class TemplateControllerTests(GlobalViewsTests, BaseControllerTests):
     """Base template controller tests."""
     @classmethod
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+"""Custom views of the Template GUI."""
+
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+from phy.cluster.views import ScatterView
+
+
+#------------------------------------------------------------------------------
+# Custom views
+#------------------------------------------------------------------------------
+
+class TemplateFeatureView(ScatterView):
+    """Scatter view showing the template features."""
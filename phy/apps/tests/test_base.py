@@ -12,9 +12,14 @@ import os
 from pathlib import Path
 import shutil
 import tempfile
+import threading
+from timeit import default_timer
 import unittest
 
 import numpy as np
+from numpy.testing import assert_array_equal as ae
+from numpy.testing import assert_allclose as ac
+from pytest import mark
 from pytestqt.plugin import QtBot
 
 from phylib.io.mock import (
@@ -25,12 +30,18 @@ from phylib.io.mock import (
 from phylib.utils import connect, unconnect, Bunch, reset, emit
 
 from phy.cluster.views import (
-    WaveformView, FeatureView, AmplitudeView, TraceView, TemplateView,
+    WaveformView, FeatureView, AmplitudeView, TraceView, TemplateView, select_traces,
 )
 from phy.gui.qt import Debouncer, create_app
 from phy.gui.widgets import Barrier
 from phy.plot.tests import mouse_click
-from ..base import BaseController, WaveformMixin, FeatureMixin, TraceMixin, TemplateMixin
+from phy.cluster import UpdateInfo
+from phy.cluster.clustering import Clustering
+from phy.cluster.views.trace import _extract_spike_waveforms, _trace_spike_index
+from phy.utils.profiling import benchmark
+from ..base import (
+    BaseController, WaveformMixin, FeatureMixin, TraceMixin, TemplateMixin, ChannelClusterIndex,
+    SpikeSelector, TraceCache, RawDataFilter, FilteredTraces, TracePyramid)
 
 logger = logging.getLogger(__name__)
 
@@ -129,6 +140,436 @@ def _mock_controller(tempdir, cls):
         clear_cache=True, enable_threading=False)
 
 
+#------------------------------------------------------------------------------
+# Utils tests
+#------------------------------------------------------------------------------
+
+def test_channel_cluster_index():
+    cluster_ids = [0, 1, 2]
+    best_channels = {0: [0, 1], 1: [1, 2], 2: [2, 0], 3: [3]}
+    calls = []
+
+    def get_best_channels(cluster_id):
+        calls.append(cluster_id)
+        return best_channels[cluster_id]
+
+    index = ChannelClusterIndex(lambda: cluster_ids, get_best_channels)
+    # The index is only built when requested.
+    index.update(UpdateInfo(added=[3], deleted=[0, 1]))
+    assert not calls
+
+    assert index.get(0) == [0, 2]
+    assert index.get(np.int64(1)) == [0, 1]
+    assert index.get(3) == []
+    assert sorted(calls) == [0, 1, 2]
+
+    # Merge clusters 0 and 1 into 3.
+    cluster_ids[:] = [2, 3]
+    index.update(UpdateInfo(added=[3], deleted=[0, 1]))
+    assert index.get(1) == []
+    assert index.get(3) == [3]
+    assert index.get(0) == [2]
+
+    # Undo the merge.
+    cluster_ids[:] = [0, 1, 2]
+    index.update(UpdateInfo(added=[0, 1], deleted=[3]))
+    assert index.get(3) == []
+    assert index.get(1) == [0, 1]
+
+
+def _spike_selector(n_spikes=1000, n_clusters=10):
+    spike_clusters = np.arange(n_spikes) % n_clusters
+    clustering = Clustering(spike_clusters)
+    selector = SpikeSelector(
+        get_spike_order=clustering.spike_order,
+        get_spikes_per_cluster=lambda cl: clustering.spikes_per_cluster[cl],
+        spike_times=np.arange(n_spikes),
+        chunk_bounds=np.linspace(0, n_spikes, 11),
+        n_chunks_kept=2)
+    return clustering, selector
+
+
+def test_spike_selector():
+    clustering, selector = _spike_selector()
+    spc = clustering.spikes_per_cluster
+    assert len(selector(10, [])) == 0
+
+    spike_ids = selector(10, [0, 1])
+    assert len(spike_ids) == 20
+    assert np.all(np.diff(spike_ids) > 0)
+    assert np.all(np.isin(spike_ids, np.r_[spc[0], spc[1]]))
+    # The selection is stable and random.
+    ae(selector(10, [0, 1]), spike_ids)
+    assert spike_ids[-1] > 500
+
+    # All spikes.
+    ae(selector(None, [2]), spc[2])
+    ae(selector(0, [2]), spc[2])
+    ae(selector(1000, [2]), spc[2])
+
+    # Only keep the spikes in the kept chunks, [0, 100[ and [500, 600[.
+    spike_ids = selector(5, [3], subset_chunks=True)
+    assert len(spike_ids) == 5
+    assert np.all((spike_ids < 100) | ((spike_ids >= 500) & (spike_ids < 600)))
+    assert len(selector(None, [3], subset_chunks=True)) == 20
+
+    # Only keep some spikes.
+    subset_spikes = np.arange(0, 1000, 7)
+    spike_ids = selector(5, [4], subset_spikes=subset_spikes)
+    assert len(spike_ids) == 5
+    assert np.all(np.isin(spike_ids, subset_spikes))
+    ae(selector(5, [4], subset_chunks=True, subset_spikes=subset_spikes), [14, 84, 504, 574])
+
+
+def test_spike_selector_merge():
+    clustering, selector = _spike_selector()
+    before = set(selector(10, [0])) | set(selector(10, [1]))
+    clustering.merge([0, 1])
+    # The random order of the merged cluster is derived from the orders of its parents.
+    assert 10 in clustering._spike_orders
+    # The first spikes of the merged cluster are among the first spikes of its parents.
+    spike_ids = selector(10, [10])
+    assert len(spike_ids) == 10
+    assert set(spike_ids) <= before
+
+    clustering.undo()
+    assert set(selector(10, [0])) | set(selector(10, [1])) == before
+
+
+@mark.benchmark
+def test_spike_selector_benchmark():
+    clustering, selector = _spike_selector(n_spikes=10_000_000, n_clusters=100)
+    with benchmark("First spike selection in a cluster", repeats=10):
+        for cluster_id in range(10):
+            selector(1000, [cluster_id])
+    with benchmark("Spike selection", repeats=100):
+        for cluster_id in range(10):
+            selector(1000, [cluster_id], subset_chunks=True)
+    with benchmark("Merge with spike orders", repeats=10):
+        for i in range(0, 10, 2):
+            clustering.merge([i, i + 1])
+    assert len(selector(1000, [clustering.cluster_ids[-1]])) == 1000
+
+
+class _CountingTraces(object):
+    def __init__(self, traces):
+        self.traces = traces
+        self.shape = traces.shape
+        self.reads = []
+
+    def __getitem__(self, item):
+        self.reads.append(item)
+        return self.traces[item]
+
+
+def test_trace_cache():
+    sr = 1000.
+    traces = _CountingTraces(artificial_traces(10000, 4))
+    rdf = RawDataFilter()
+    rdf.add_default_filter(sr)
+    _computed = []
+
+    def get_spike_waveforms(interval, traces_interval, cluster_ids, show_all_spikes):
+        _computed.append((interval, cluster_ids))
+        return [Bunch(data=traces_interval[:10], cluster_ids=cluster_ids)]
+
+    cache = TraceCache(
+        traces=traces, sample_rate=sr, raw_data_filter=rdf,
+        get_spike_waveforms=get_spike_waveforms)
+
+    def _wait():
+        for future in list(cache._windows.values()):
+            future.result()
+
+    out = cache.get((1., 2.), [3])
+    ae(out.data, rdf.apply(select_traces(traces.traces, (1., 2.), sample_rate=sr), axis=0))
+    assert out.waveforms[0].cluster_ids == [3]
+    assert len(_computed) == 1
+    # The raw data is read by blocks with one window on each side.
+    assert traces.reads == [slice(0, 3000)]
+
+    # Repeated requests are cached.
+    assert cache.get((1., 2.), [3]) is out
+    assert len(_computed) == 1
+
+    # The next windows in the scroll direction are prefetched.
+    cache.get((1.1, 2.1), [3])
+    _wait()
+    assert [c[0] for c in _computed[-2:]] == [(1.2, 2.2), (1.3, 2.3)]
+    n = len(_computed)
+    out = cache.get((1.2, 2.2), [3])
+    ae(out.data, rdf.apply(select_traces(traces.traces, (1.2, 2.2), sample_rate=sr), axis=0))
+    _wait()
+    assert (1.2, 2.2) not in [c[0] for c in _computed[n:]]
+    assert traces.reads == [slice(0, 3000)]
+
+    # The window depends on the cluster selection and the filter.
+    cache.get((1.2, 2.2), [4])
+    assert _computed[-1] == ((1.2, 2.2), [4])
+    rdf.set('raw')
+    out = cache.get((1.2, 2.2), [4])
+    ae(out.data, select_traces(traces.traces, (1.2, 2.2), sample_rate=sr))
+
+    # Cleared after a clustering action.
+    _wait()
+    cache.clear()
+    n = len(_computed)
+    cache.get((1.2, 2.2), [4])
+    assert len(_computed) == n + 1
+
+
+def test_trace_cache_size():
+    sr = 1000.
+    traces = _CountingTraces(artificial_traces(10000, 4))
+    rdf = RawDataFilter()
+    rdf.add_default_filter(sr)
+    cache = TraceCache(
+        traces=traces, sample_rate=sr, raw_data_filter=rdf,
+        get_spike_waveforms=lambda *args: [], prefetch=False)
+    # A window of 1 second is 1000 * 4 * 8 bytes.
+    cache.cache_size = 3 * 32000
+    cache.max_prefetch_size = 32000
+
+    # The windows are kept up to the cache size.
+    for t in range(5):
+        cache.get((t, t + 1.), [])
+    assert cache._size == 3 * 32000
+    assert [key[:2] for key in cache._windows] == [(2000, 3000), (3000, 4000), (4000, 5000)]
+
+    # The large windows are neither read with their neighbours nor prefetched.
+    cache.prefetch = True
+    del traces.reads[:]
+    cache.get((5., 7.), [])
+    cache.get((6., 8.), [])
+    assert traces.reads == [slice(5000, 7000), slice(6000, 8000)]
+    # The last window is kept.
+    assert [key[:2] for key in cache._windows] == [(6000, 8000)]
+    assert cache._size == 64000
+
+    cache.clear()
+    assert cache._size == 0
+
+
+def _filtered_traces(n_samples=25000, n_channels=4, chunk_bounds=None):
+    sr = 10000.
+    traces = _CountingTraces(
+        (np.random.RandomState(0).normal(size=(n_samples, n_channels)) * 100).astype(np.int16))
+    if chunk_bounds is not None:
+        traces.chunk_bounds = chunk_bounds
+    rdf = RawDataFilter()
+    rdf.add_default_filter(sr)
+    return traces, rdf, FilteredTraces(traces=traces, sample_rate=sr, raw_data_filter=rdf)
+
+
+def test_filtered_traces():
+    traces, rdf, ft = _filtered_traces(chunk_bounds=[0, 12000, 25000])
+    assert ft.is_active
+    ae(ft.chunk_bounds, [0, 6000, 12000, 18500, 25000])
+    sos, margin = rdf.get_sos()
+    assert 0 < margin < 1000
+
+    # The filtered data is seamless across chunks.
+    expected = rdf.apply(traces.traces.astype(np.float64), axis=0)
+    scale = np.abs(expected).max()
+    for i, j in ((0, 25000), (5000, 7000), (11990, 12010), (24000, 25000)):
+        ac(ft.get(i, j), expected[i:j], atol=1e-4 * scale)
+    assert ft.get(10, 10).shape == (0, 4)
+    ae(ft.get(-10, 10), ft.get(0, 10))
+
+    # The filtered chunks are kept in memory.
+    n = len(traces.reads)
+    ft.get(100, 200)
+    assert len(traces.reads) == n
+
+    # Waveforms, in filtered chunks in memory, filtered with their margins, or at the edges.
+    ft._chunks.clear()
+    ft.get(0, 100)
+    spike_samples = [20, 3000, 7000, 24995]
+    channel_ids = [2, 0]
+    waveforms = ft.get_waveforms(spike_samples, channel_ids, 40)
+    assert waveforms.shape == (4, 40, 2)
+    padded = np.pad(expected, ((20, 20), (0, 0)))
+    for w, s in zip(waveforms, spike_samples):
+        ac(w, padded[s:s + 40, channel_ids], atol=1e-4 * scale)
+
+    # Missing channels, padded with -1, are zero.
+    waveforms = ft.get_waveforms(spike_samples, [2, -1], 40)
+    ac(waveforms[..., 0], ft.get_waveforms(spike_samples, [2], 40)[..., 0])
+    ae(waveforms[..., 1], 0)
+
+    # Other filters are not applied chunk by chunk.
+    rdf.set('raw')
+    assert not ft.is_active
+    rdf.add_filter(lambda arr, axis=0: arr, name='high_pass')
+    assert rdf.get_sos('high_pass') is None
+
+
+@mark.benchmark
+def test_filtered_traces_benchmark():
+    n_samples, n_channels = 300000, 384
+    traces, rdf, ft = _filtered_traces(n_samples=n_samples, n_channels=n_channels)
+    start = default_timer()
+    with benchmark("Filter 30s of 384-channel raw data chunk by chunk"):
+        ft.get(0, n_samples)
+    mb = n_samples * n_channels * 2 / 1024. ** 2
+    logger.info("Filtering throughput: %.1f MB/s.", mb / (default_timer() - start))
+    with benchmark("Filtered window in memory", repeats=100):
+        for i in range(100):
+            ft.get(1000 * i, 1000 * i + 2500)
+    with benchmark("Filtered waveforms", repeats=10):
+        for i in range(10):
+            ft._chunks.clear()
+            ft.get_waveforms(np.arange(1000, 299000, 2990), np.arange(32), 82)
+
+
+class _LockedTraces(_CountingTraces):
+    """Record whether the read lock is held during every read."""
+    read_lock = None
+
+    def __getitem__(self, item):
+        self.reads.append(self.read_lock.locked())
+        return self.traces[item]
+
+
+def test_trace_read_lock(tempdir):
+    sr = 10000.
+    traces = _LockedTraces(artificial_traces(100000, 3))
+    rdf = RawDataFilter()
+    rdf.add_default_filter(sr)
+    ft = FilteredTraces(traces=traces, sample_rate=sr, raw_data_filter=rdf)
+    traces.read_lock = ft.read_lock
+    cache = TraceCache(
+        traces=traces, sample_rate=sr, raw_data_filter=rdf,
+        get_spike_waveforms=lambda *args: [], prefetch=False, filtered_traces=ft)
+    assert cache._read_lock is ft.read_lock
+
+    # All reads of the raw data hold the read lock shared by the filtered traces, the trace
+    # cache and the trace pyramid.
+    ft.get(0, 1000)
+    ft.get_waveforms([5000, 50000], [0, 2], 40)
+    TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft, background=False).build()
+    rdf.set('raw')
+    cache.get((1., 2.), [])
+    assert len(traces.reads) >= 4
+    assert all(traces.reads)
+
+
+def test_trace_pyramid(tempdir):
+    traces, rdf, ft = _filtered_traces(n_samples=1000000, n_channels=3)
+    pyramid = TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft, background=False)
+    assert pyramid.factors == [64, 256]
+
+    # Full resolution for short intervals.
+    assert pyramid.get_factor(10000, 100) is None
+    assert pyramid.get(0, 10000, 100) is None
+    assert pyramid.get_factor(100000, 100) == 256
+    assert pyramid.get_factor(20000, 100) == 64
+
+    # The pyramid is built when it is first needed.
+    samples, data = pyramid.get(1000, 101000, 100)
+    assert (tempdir / 'pyramid/high_pass/meta.json').exists()
+    filtered = ft.get(0, 1000000)
+    for factor in (64, 256):
+        bins = filtered[:999936].reshape((-1, factor, 3))
+        level = pyramid._levels['high_pass'][factor]
+        # The levels are stored in half precision.
+        assert level.dtype == np.float16
+        ae(level[:len(bins), 0], bins.min(axis=1).astype(np.float16))
+        ae(level[:len(bins), 1], bins.max(axis=1).astype(np.float16))
+        # Last partial bin.
+        ae(level[-1, 0], filtered[len(bins) * factor:].min(axis=0).astype(np.float16))
+    assert data.shape == (2 * 392, 3)
+    assert data.dtype == np.float32
+    ae(samples[:4], [896, 896, 1152, 1152])
+    ae(data[::2], pyramid._levels['high_pass'][256][3:395, 0])
+
+    # The pyramid is rebuilt when the data type changes.
+    pyramid = TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft, background=False)
+    pyramid.dtype = np.float32
+    assert pyramid._load('high_pass') is None
+
+    # The pyramid is rebuilt when the filter changes.
+    rdf.add_sos_filter(np.array([[1., 0, 0, 1, 0, 0]]), name='high_pass')
+    pyramid = TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft, background=False)
+    assert pyramid._load('high_pass') is None
+    samples, data = pyramid.get(0, 1000000, 1000)
+    ac(data[:2], [traces.traces[:256].min(axis=0), traces.traces[:256].max(axis=0)])
+
+    # No pyramid for the other filters.
+    rdf.set('raw')
+    assert pyramid.get(0, 1000000, 1000) is None
+
+
+def test_trace_pyramid_background(tempdir):
+    traces, rdf, ft = _filtered_traces(n_samples=100000, n_channels=3)
+    pyramid = TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft)
+    pyramid.build()
+    # The pyramid is built in a thread, the GUI process is never forked.
+    assert isinstance(pyramid._builders['high_pass'], threading.Thread)
+    pyramid._builders['high_pass'].join()
+    assert not pyramid.is_building()
+    samples, data = pyramid.get(0, 100000, 100)
+    assert data.shape == (2 * 1563, 3)
+
+
+@mark.benchmark
+def test_trace_pyramid_benchmark(tempdir):
+    traces, rdf, ft = _filtered_traces(n_samples=3000000, n_channels=64)
+    pyramid = TracePyramid(path=tempdir / 'pyramid', filtered_traces=ft, background=False)
+    with benchmark("Build the trace pyramid of 300s of 64-channel raw data"):
+        pyramid.build()
+    with benchmark("Zoomed-out trace window", repeats=100):
+        for i in range(100):
+            pyramid.get(10000 * i, 10000 * i + 1000000, 1000)
+
+
+@mark.benchmark
+def test_trace_selection_benchmark():
+    sr = 25000.
+    n_channels = 64
+    duration = 10.
+    n_spikes = 20000
+    n_clusters = 200
+    traces = artificial_traces(int(sr * duration), n_channels).astype(np.float32)
+    spike_times = np.sort(np.random.uniform(0, duration, n_spikes))
+    model = Bunch(
+        spike_times=spike_times, spike_clusters=np.random.randint(0, n_clusters, n_spikes),
+        sample_rate=sr)
+    best_channels = {c: (np.arange(c % 52, c % 52 + 12), np.ones(12)) for c in range(n_clusters)}
+    rdf = RawDataFilter()
+    rdf.add_default_filter(sr)
+    interval = (4., 6.)
+    ns = 25
+
+    def get_spike_waveforms(interval, traces_interval, cluster_ids, show_all_spikes,
+                            spike_index=None):
+        return _extract_spike_waveforms(
+            interval=interval, traces_interval=traces_interval, model=model,
+            supervisor=Bunch(selected=cluster_ids), n_samples_waveforms=ns,
+            get_best_channels=best_channels.__getitem__, show_all_spikes=show_all_spikes,
+            spike_index=spike_index)
+
+    cache = TraceCache(
+        traces=traces, sample_rate=sr, raw_data_filter=rdf,
+        get_spike_waveforms=get_spike_waveforms, prefetch=False)
+    selections = [[c, c + 1] for c in range(0, 20, 2)]
+
+    # Before: every selection change reloads and refilters the whole window.
+    with benchmark("Selection change, reloading the trace window", repeats=len(selections)):
+        for cluster_ids in selections:
+            out = cache.get(interval, cluster_ids, show_all_spikes=True)
+
+    # Now: only the spike waveforms are updated on top of the last window.
+    data = out.data
+    spike_index = _trace_spike_index(interval=interval, model=model, n_samples_waveforms=ns)
+    with benchmark("Selection change, updating the spike waveforms", repeats=len(selections)):
+        for cluster_ids in selections:
+            waveforms = get_spike_waveforms(
+                interval, data, cluster_ids, True, spike_index=spike_index)
+    assert len(waveforms.spike_ids) == len(out.waveforms.spike_ids)
+    ae(waveforms.data, out.waveforms.data)
+
+
 #------------------------------------------------------------------------------
 # Base classes
 #------------------------------------------------------------------------------
@@ -470,6 +911,27 @@ class MockControllerTTests(GlobalViewsTests, MinimalControllerTests, unittest.Te
         emit('select_time', self, 0)
         self.trace_view.actions.next_color_scheme()
 
+    def test_trace_view_selection(self):
+        v = self.trace_view
+        _calls = []
+        traces = v.traces
+
+        def _traces(interval):
+            _calls.append(interval)
+            return traces(interval)
+        v.traces = _traces
+
+        # The traces are not reloaded when only the cluster selection changes.
+        self.supervisor.select([2])
+        self.supervisor.select([3, 4])
+        assert not _calls
+        assert set(v._waveform_times.spike_clusters) <= {3, 4}
+        assert self.controller._trace_spike_index_cache[v][0] == v.interval
+
+        # But they are when the interval changes.
+        v.go_right()
+        assert _calls == [v.interval]
+
 
 class MockControllerTmpTests(MinimalControllerTests, unittest.TestCase):
     """Mock controller with templates."""
@@ -3,7 +3,45 @@
 
 """Manual clustering facilities."""
 
+from ._correlograms import PairwiseCorrelograms
+from ._metrics import ClusterMetrics, batch_metric
+from ._similarity import TemplateSimilarityIndex
+from ._templates import ClusterTemplateCounts
 from ._utils import ClusterMeta, UpdateInfo
 from .clustering import Clustering
-from .supervisor import Supervisor, ClusterView, SimilarityView
-from .views import *  # noqa
+from .supervisor import Supervisor
+
+
+# NOTE: the tables and the views depend on Qt and OpenGL. They are only imported when they are
+# first used, so that the clustering facilities can be used without GUI.
+_gui_names = {
+    'ClusterView': 'tables',
+    'SimilarityView': 'tables',
+    'ManualClusteringView': 'views',
+    'ClusterScatterView': 'views',
+    'AmplitudeView': 'views',
+    'CorrelogramView': 'views',
+    'FeatureView': 'views',
+    'HistogramView': 'views',
+    'ISIView': 'views',
+    'FiringRateView': 'views',
+    'ProbeView': 'views',
+    'RasterView': 'views',
+    'ScatterView': 'views',
+    'TemplateView': 'views',
+    'TraceView': 'views',
+    'TraceImageView': 'views',
+    'select_traces': 'views',
+    'WaveformView': 'views',
+}
+
+
+def __getattr__(name):
+    if name in _gui_names:
+        from importlib import import_module
+        return getattr(import_module('.' + _gui_names[name], __name__), name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_gui_names))
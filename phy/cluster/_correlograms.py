@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""Store of the pairwise cross-correlograms between clusters, updated after merges."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+
+import numpy as np
+
+from phylib.io.array import _index_of, _unique
+from phylib.stats.ccg import _symmetrize_correlograms
+
+logger = logging.getLogger(__name__)
+
+
+#------------------------------------------------------------------------------
+# Sorted-sweep correlograms
+#------------------------------------------------------------------------------
+
+"""Number of spikes processed at once by every thread."""
+_SWEEP_BLOCK_SIZE = 2 ** 16
+
+
+def _sweep_block(spike_samples, offsets_i, offsets_j, binsize, max_delay, counts, start, stop):
+    """Add the delays between the spikes in `[start, stop[` and all following spikes within the
+    window to the flattened histogram `counts`.
+
+    At every step, the spikes whose next spike at the current shift is out of the window are
+    discarded, so that the total cost is proportional to the number of pairs of spikes within
+    the window.
+
+    """
+    n_spikes = len(spike_samples)
+    # The active spikes, with their times and offsets, discarded as the shift increases.
+    idx = np.arange(start, stop, dtype=np.int64)
+    samples = spike_samples[idx]
+    offsets = offsets_i[idx]
+    shift = 1
+    while len(idx):
+        if idx[-1] >= n_spikes - shift:
+            k = np.searchsorted(idx, n_spikes - shift)
+            idx, samples, offsets = idx[:k], samples[:k], offsets[:k]
+        j = idx + shift
+        delays = spike_samples[j]
+        delays -= samples
+        kept = delays < max_delay
+        if not kept.all():
+            idx, samples, offsets = idx[kept], samples[kept], offsets[kept]
+            j, delays = j[kept], delays[kept]
+        delays //= binsize
+        delays += offsets
+        delays += offsets_j[j]
+        counts += np.bincount(delays, minlength=len(counts))
+        shift += 1
+
+
+def _sweep(
+        spike_samples, spike_clusters_i, binsize, n_bins, n_clusters, start, stop,
+        block_size=None):
+    """Return the flattened `(n_clusters, n_clusters, n_bins)` histogram of the delays between
+    the spikes in `[start, stop[` and all following spikes within the window.
+
+    The spikes are processed in blocks of `block_size` spikes, so that the arrays of every step
+    fit in the CPU cache.
+
+    """
+    block_size = block_size or _SWEEP_BLOCK_SIZE
+    counts = np.zeros(n_clusters * n_clusters * n_bins, dtype=np.int64)
+    # Offsets of the first and second clusters of every pair in the flattened histogram.
+    offsets_i = spike_clusters_i * (n_clusters * n_bins)
+    offsets_j = spike_clusters_i * n_bins
+    for block in range(start, stop, block_size):
+        _sweep_block(
+            spike_samples, offsets_i, offsets_j, binsize, n_bins * binsize, counts,
+            block, min(block + block_size, stop))
+    return counts
+
+
+def sweep_correlograms(
+        spike_times, spike_clusters, cluster_ids=None, sample_rate=1.,
+        bin_size=None, window_size=None, symmetrize=True, n_threads=None):
+    """Compute all pairwise cross-correlograms among the clusters appearing in
+    `spike_clusters`, with a sorted sweep over the spikes split across several threads.
+
+    This function has the same parameters and returns the same `(n_clusters, n_clusters,
+    n_bins)` array as `phylib.stats.correlograms()`, with an additional `n_threads` parameter
+    (by default, one thread per CPU, with at least 100,000 spikes per thread). Its cost is
+    proportional to the number of pairs of spikes within the window, which makes it suitable
+    for all spikes of large clusters.
+
+    """
+    assert sample_rate > 0.
+    spike_times = np.asarray(spike_times, dtype=np.float64)
+    assert np.all(np.diff(spike_times) >= 0), "The spike times must be increasing."
+    spike_samples = (spike_times * sample_rate).astype(np.int64)
+    spike_clusters = np.asarray(spike_clusters, dtype=np.int64)
+    assert spike_samples.shape == spike_clusters.shape
+
+    # Same bin and window sizes as `phylib.stats.correlograms()`.
+    bin_size = np.clip(bin_size, 1e-5, 1e5)
+    binsize = int(sample_rate * bin_size)
+    assert binsize >= 1
+    window_size = np.clip(window_size, 1e-5, 1e5)
+    winsize_bins = 2 * int(.5 * window_size / bin_size) + 1
+    n_bins = winsize_bins // 2 + 1
+
+    clusters = _unique(spike_clusters) if cluster_ids is None else np.asarray(cluster_ids)
+    n_clusters = len(clusters)
+    spike_clusters_i = _index_of(spike_clusters, clusters).astype(np.int64)
+
+    n_spikes = len(spike_samples)
+    if n_threads is None:
+        n_threads = min(os.cpu_count() or 1, n_spikes // 100000 + 1)
+    bounds = np.linspace(0, n_spikes, max(1, n_threads) + 1).astype(np.int64)
+    args = (spike_samples, spike_clusters_i, binsize, n_bins, n_clusters)
+    if len(bounds) > 2:
+        # NOTE: the NumPy operations of the sweep release the GIL.
+        with ThreadPoolExecutor(len(bounds) - 1) as executor:
+            counts = sum(executor.map(
+                lambda i: _sweep(*args, bounds[i], bounds[i + 1]), range(len(bounds) - 1)))
+    else:
+        counts = _sweep(*args, 0, n_spikes)
+    counts = counts.reshape((n_clusters, n_clusters, n_bins))
+    return _symmetrize_correlograms(counts) if symmetrize else counts
+
+
+#------------------------------------------------------------------------------
+# Pairwise correlograms
+#------------------------------------------------------------------------------
+
+class PairwiseCorrelograms(object):
+    """Store of the cross-correlograms of every pair of clusters.
+
+    The correlograms of a set of clusters are assembled from the correlograms of all pairs of
+    clusters, and only the missing pairs are computed. Every pair is stored as the one-sided,
+    non-symmetrized correlogram returned by `correlograms(..., symmetrize=False)`, which is
+    additive: after a merge, the correlograms of the merged cluster with the other clusters
+    are the sums of the correlograms of the merged clusters, and are not recomputed.
+
+    Every cluster is represented by a subset of at most `n_spikes` of its spikes, given by
+    `get_spike_ids()`. The correlograms of a merged cluster are only derived from those of the
+    merged clusters when the union of their subsets does not exceed `n_spikes`, that is, when
+    it contains all spikes of the merged cluster. Otherwise, the merged cluster is subsampled
+    again and its correlograms are computed when requested. The subsets are kept in memory in
+    least recently used order, up to `max_spikes` spikes in total.
+
+    Constructor
+    -----------
+
+    spike_times : array-like
+        The spike times, in seconds.
+    get_spike_ids : function
+        Return the spike subset of a cluster, given the cluster id and the maximum number of
+        spikes.
+    sample_rate : float
+        The sampling rate.
+    duration : float
+        The duration of the recording, in seconds.
+
+    """
+
+    """Number of sets of parameters (bin size, window size, number of spikes) kept in memory."""
+    n_params = 4
+
+    """Maximum total number of spikes of the subsets kept in memory."""
+    max_spikes = 10000000
+
+    def __init__(self, spike_times, get_spike_ids, sample_rate=1., duration=None):
+        self.spike_times = spike_times
+        self.get_spike_ids = get_spike_ids
+        self.sample_rate = sample_rate
+        self.duration = duration
+        # Mapping {(n_spikes, cluster_id): spike_ids}, in the order of last use.
+        self._spikes = OrderedDict()
+        self._n_stored = 0
+        # Mapping {(n_spikes, bin_size, window_size): {(cluster_i, cluster_j): correlogram}},
+        # in the order of last use.
+        self._pairs = OrderedDict()
+        # NOTE: the correlograms are requested from the views' worker threads.
+        self._lock = threading.RLock()
+
+    def _store(self, key, spike_ids):
+        """Keep a spike subset in memory, and discard the least recently used subsets if
+        needed."""
+        self._discard(key)
+        self._spikes[key] = spike_ids
+        self._n_stored += len(spike_ids)
+        while self._n_stored > self.max_spikes and len(self._spikes) > 1:
+            _, old = self._spikes.popitem(last=False)
+            self._n_stored -= len(old)
+
+    def _discard(self, key):
+        spike_ids = self._spikes.pop(key, None)
+        if spike_ids is not None:
+            self._n_stored -= len(spike_ids)
+        return spike_ids
+
+    def _subset(self, cluster_id, n_spikes):
+        key = (n_spikes, cluster_id)
+        spike_ids = self._spikes.get(key, None)
+        if spike_ids is None:
+            # NOTE: the subsets are stable, so that a discarded subset is the same when it is
+            # requested again.
+            spike_ids = np.asarray(self.get_spike_ids(cluster_id, n_spikes), dtype=np.int64)
+            self._store(key, spike_ids)
+        else:
+            self._spikes.move_to_end(key)
+        return spike_ids
+
+    def _get_pairs(self, params):
+        if params not in self._pairs:
+            self._pairs[params] = {}
+            while len(self._pairs) > self.n_params:
+                self._pairs.popitem(last=False)
+        self._pairs.move_to_end(params)
+        return self._pairs[params]
+
+    def _compute(self, cluster_ids, params):
+        """Compute the correlograms of all pairs among some clusters."""
+        n_spikes, bin_size, window_size = params
+        subsets = [self._subset(c, n_spikes) for c in cluster_ids]
+        spike_ids = np.concatenate(subsets)
+        spike_clusters = np.repeat(cluster_ids, [len(s) for s in subsets])
+        # The spikes need to be sorted by time.
+        order = np.argsort(spike_ids, kind='stable')
+        ccg = sweep_correlograms(
+            self.spike_times[spike_ids[order]], spike_clusters[order],
+            cluster_ids=cluster_ids, sample_rate=self.sample_rate,
+            bin_size=bin_size, window_size=window_size, symmetrize=False)
+        pairs = self._get_pairs(params)
+        for i, ci in enumerate(cluster_ids):
+            for j, cj in enumerate(cluster_ids):
+                pairs[ci, cj] = ccg[i, j]
+
+    def correlograms(self, cluster_ids, bin_size, window_size, n_spikes=None):
+        """Return the `(n_clusters, n_clusters, n_bins)` array with the symmetrized cross- and
+        auto-correlograms of a set of clusters."""
+        cluster_ids = [int(c) for c in cluster_ids]
+        params = (n_spikes, bin_size, window_size)
+        with self._lock:
+            pairs = self._get_pairs(params)
+            if not all((ci, cj) in pairs for ci in cluster_ids for cj in cluster_ids):
+                # NOTE: the missing pairs are computed in a single pass over the spikes of all
+                # requested clusters.
+                self._compute(cluster_ids, params)
+            n = len(cluster_ids)
+            n_bins = int(.5 * window_size / bin_size) + 1
+            out = np.zeros((n, n, n_bins), dtype=np.int64)
+            for i, ci in enumerate(cluster_ids):
+                for j, cj in enumerate(cluster_ids):
+                    out[i, j] = pairs[ci, cj]
+        return _symmetrize_correlograms(out)
+
+    def firing_rate(self, cluster_ids, bin_size, n_spikes=None):
+        """Return the baseline firing rate of the cross- and auto-correlograms of clusters,
+        consistent with the spike subsets used by `correlograms()`."""
+        with self._lock:
+            bc = np.array(
+                [len(self._subset(int(c), n_spikes)) for c in cluster_ids], dtype=np.int64)
+        return bc * np.c_[bc] * (bin_size / (self.duration or 1.))
+
+    def update(self, up):
+        """Update the store after a clustering action."""
+        if not up.deleted:
+            return
+        deleted = set(up.deleted)
+        with self._lock:
+            if up.description == 'merge' and len(up.added) == 1:
+                self._merge(up.deleted, up.added[0])
+            for key in [key for key in self._spikes if key[1] in deleted]:
+                self._discard(key)
+            for pairs in self._pairs.values():
+                for key in [key for key in pairs if key[0] in deleted or key[1] in deleted]:
+                    del pairs[key]
+
+    def _merge(self, parents, merged):
+        """Derive the correlograms of a merged cluster from those of the merged clusters."""
+        for n_spikes in set(n for n, _ in self._spikes):
+            subsets = [self._spikes.get((n_spikes, p), None) for p in parents]
+            if any(s is None for s in subsets):
+                continue
+            # The union of the subsets of the merged clusters only represents the merged
+            # cluster if it contains all its spikes.
+            if n_spikes is not None and sum(len(s) for s in subsets) > n_spikes:
+                continue
+            self._store((n_spikes, merged), np.sort(np.concatenate(subsets)))
+            for params, pairs in self._pairs.items():
+                if params[0] != n_spikes:
+                    continue
+                # The other clusters whose correlograms with all merged clusters are known.
+                others = set(
+                    key[1] for key in pairs if key[0] == parents[0] and key[1] not in parents)
+                for other in others:
+                    if not all((p, other) in pairs and (other, p) in pairs for p in parents):
+                        continue
+                    pairs[merged, other] = sum(pairs[p, other] for p in parents)
+                    pairs[other, merged] = sum(pairs[other, p] for p in parents)
+                if all((p, q) in pairs for p in parents for q in parents):
+                    pairs[merged, merged] = sum(pairs[p, q] for p in parents for q in parents)
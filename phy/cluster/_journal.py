@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""Write-ahead journal of the clustering actions, used to recover unsaved sessions."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import json
+import logging
+from pathlib import Path
+import re
+import struct
+import zlib
+
+import numpy as np
+
+from .clustering import _pack_spike_clusters, _unpack_spike_clusters
+
+logger = logging.getLogger(__name__)
+
+
+#------------------------------------------------------------------------------
+# Journal file format
+#------------------------------------------------------------------------------
+
+# File header: magic, version, number of spikes, checksum of the base spike clusters.
+_MAGIC = b'PHYJ'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBQI')
+
+# Record header: kind, payload size, payload checksum.
+_RECORD = struct.Struct('<cII')
+_KIND_ASSIGN = b'A'
+_KIND_META = b'M'
+
+_ASSIGN = struct.Struct('<QIc')
+
+
+def _checksum(spike_clusters):
+    """Checksum of a spike clusters assignment."""
+    return zlib.adler32(np.ascontiguousarray(spike_clusters, dtype=np.int64).data) & 0xffffffff
+
+
+def _encode_assign(spike_ids, spike_clusters):
+    """Encode a spike-cluster assignment delta."""
+    spike_ids = np.asarray(spike_ids, dtype=np.uint64)
+    clusters, indices = _pack_spike_clusters(np.asarray(spike_clusters, dtype=np.int64))
+    # The indices are None when all spikes are assigned to the same cluster.
+    dtype = indices.dtype.char.encode() if indices is not None else b'-'
+    return b''.join((
+        _ASSIGN.pack(len(spike_ids), len(clusters), dtype),
+        spike_ids.tobytes(), clusters.astype(np.int64).tobytes(),
+        indices.tobytes() if indices is not None else b''))
+
+
+def _decode_assign(payload):
+    """Decode a spike-cluster assignment delta."""
+    n_spikes, n_clusters, dtype = _ASSIGN.unpack_from(payload)
+    offset = _ASSIGN.size
+    spike_ids = np.frombuffer(payload, dtype=np.uint64, count=n_spikes, offset=offset)
+    offset += spike_ids.nbytes
+    clusters = np.frombuffer(payload, dtype=np.int64, count=n_clusters, offset=offset)
+    offset += clusters.nbytes
+    indices = None
+    if dtype != b'-':
+        indices = np.frombuffer(payload, dtype=dtype.decode(), count=n_spikes, offset=offset)
+    spike_clusters = _unpack_spike_clusters((clusters, indices), n_spikes)
+    return spike_ids.astype(np.int64), spike_clusters
+
+
+def _json_default(obj):
+    """Convert NumPy scalars to native Python objects."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(obj)  # pragma: no cover
+
+
+#------------------------------------------------------------------------------
+# Journal
+#------------------------------------------------------------------------------
+
+class Journal(object):
+    """Append-only binary journal of the clustering and cluster metadata changes.
+
+    Every change is appended as a compact record to a journal file in the cache directory, so
+    that a session can be recovered after a crash by replaying the journal on top of the
+    saved spike clusters and metadata.
+
+    A new journal file (a generation) is started at every save, with a checksum of the saved
+    spike clusters assignment. When recovering, each generation is only replayed if its
+    checksum matches the current assignment, so that a save interrupted before the model files
+    were fully written is also recovered. Generations that no longer apply are deleted.
+
+    Constructor
+    -----------
+
+    dir_path : str or Path
+        The directory where to store the journal files (typically the `.phy` cache directory).
+
+    """
+    file_pattern = 'journal.%d.bin'
+
+    def __init__(self, dir_path):
+        self.dir_path = Path(dir_path)
+        self._file = None
+        self._generation = None
+
+    def _generations(self):
+        """Return the sorted list of the existing generation numbers."""
+        if not self.dir_path.exists():
+            return []
+        regex = re.compile(r'^journal\.(\d+)\.bin$')
+        return sorted(
+            int(m.group(1)) for m in (regex.match(p.name) for p in self.dir_path.iterdir()) if m)
+
+    def _path(self, generation):
+        return self.dir_path / (self.file_pattern % generation)
+
+    def _iter_records(self, path, n_spikes, checksum):
+        """Iterate over the (kind, payload) records of a journal file, if its header matches
+        the passed spike clusters assignment."""
+        with open(str(path), 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            magic, version, n, c = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION or n != n_spikes or c != checksum:
+                logger.debug("Skip journal file %s that does not match the data.", path)
+                return
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                kind, size, crc = _RECORD.unpack(header)
+                payload = f.read(size)
+                # Stop at the first truncated or corrupted record, which may happen after
+                # a crash in the middle of a write.
+                if len(payload) < size or zlib.crc32(payload) & 0xffffffff != crc:
+                    logger.warning("Ignore the truncated end of the journal %s.", path)
+                    break
+                yield kind, payload
+
+    def recover(self, spike_clusters):
+        """Replay the journal on top of a spike clusters assignment.
+
+        Return a tuple `(spike_clusters, meta)` where `spike_clusters` is the recovered
+        assignment (a modified copy, or the passed array if there was nothing to recover), and
+        `meta` is a list of `(cluster_ids, {field: values})` metadata changes to apply in order.
+
+        """
+        meta = []
+        n_spikes = len(spike_clusters)
+        checksum = _checksum(spike_clusters)
+        n_records = 0
+        copied = False
+        for generation in self._generations():
+            path = self._path(generation)
+            records = list(self._iter_records(path, n_spikes, checksum))
+            if not records:
+                # This journal file is either empty or stale.
+                path.unlink()
+                continue
+            for kind, payload in records:
+                if kind == _KIND_ASSIGN:
+                    spike_ids, new_spike_clusters = _decode_assign(payload)
+                    if not copied:
+                        spike_clusters, copied = spike_clusters.copy(), True
+                    spike_clusters[spike_ids] = new_spike_clusters
+                elif kind == _KIND_META:
+                    d = json.loads(payload.decode('utf-8'))
+                    meta.append((d['clusters'], d['values']))
+                n_records += 1
+            # The next generation starts from the assignment at the end of this one.
+            checksum = _checksum(spike_clusters)
+        if n_records:
+            logger.info("Recovered %d unsaved actions from the journal.", n_records)
+        return spike_clusters, meta
+
+    def rotate(self, spike_clusters):
+        """Start a new journal generation, on top of a given spike clusters assignment."""
+        self.close()
+        generations = self._generations()
+        self._generation = generations[-1] + 1 if generations else 0
+        path = self._path(self._generation)
+        logger.log(5, "Start journal file %s.", path)
+        self._file = open(str(path), 'wb')
+        self._file.write(_HEADER.pack(
+            _MAGIC, _VERSION, len(spike_clusters), _checksum(spike_clusters)))
+        self._file.flush()
+
+    def _append(self, kind, payload):
+        assert self._file, "The journal must be started with rotate()."
+        self._file.write(_RECORD.pack(kind, len(payload), zlib.crc32(payload) & 0xffffffff))
+        self._file.write(payload)
+        # NOTE: flushing is enough to survive a crash of the process.
+        self._file.flush()
+
+    def add_assign(self, spike_ids, spike_clusters):
+        """Record a new spike-cluster assignment of some spikes."""
+        self._append(_KIND_ASSIGN, _encode_assign(spike_ids, spike_clusters))
+
+    def add_meta(self, cluster_ids, values):
+        """Record the metadata values of some clusters, as a `{field: values}` dictionary."""
+        payload = json.dumps(
+            dict(clusters=list(cluster_ids), values=values), default=_json_default)
+        self._append(_KIND_META, payload.encode('utf-8'))
+
+    def close(self):
+        """Close the current journal file."""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """Close and delete all journal files."""
+        self.close()
+        for generation in self._generations():
+            self._path(generation).unlink()
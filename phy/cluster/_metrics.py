@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""Batch computation and caching of the cluster metrics."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+def batch_metric(f):
+    """Create a cluster metric function `cluster_id => value` from a function computing the
+    metric of several clusters at once `cluster_ids => values`.
+
+    The metrics engine calls the batch function directly when computing many clusters.
+
+    """
+    def metric(cluster_id):
+        return f([cluster_id])[0]
+    metric.batch = f
+    metric.__name__ = getattr(f, '__name__', 'metric')
+    return metric
+
+
+#------------------------------------------------------------------------------
+# Cluster metrics engine
+#------------------------------------------------------------------------------
+
+class ClusterMetrics(object):
+    """Compute the cluster metrics shown in the cluster view, with a per-cluster cache.
+
+    Metrics are computed in batch: with the metric's `batch` function if it has one (see
+    `batch_metric()`), or in a pool of worker threads otherwise. Since a cluster id always
+    refers to the same set of spikes, the computed values are cached per cluster id and can be
+    persisted across sessions.
+
+    Constructor
+    -----------
+
+    functions : dict
+        Maps metric names to functions `cluster_id => value`. The dictionary is kept by
+        reference, so that metrics added later (for example by plugins) are taken into account.
+    n_workers : int
+        Number of worker threads for the metrics that do not support batch computation.
+
+    """
+    def __init__(self, functions=None, n_workers=None):
+        self.functions = functions if functions is not None else {}
+        self.n_workers = n_workers
+        # Mapping {name: {cluster_id: value}}.
+        self._cache = {}
+
+    def _cached(self, name):
+        return self._cache.setdefault(name, {})
+
+    def get(self, name, cluster_id):
+        """Return the value of a metric for a given cluster, computing it if needed."""
+        cache = self._cached(name)
+        if cluster_id not in cache:
+            cache[cluster_id] = self.functions[name](cluster_id)
+        return cache[cluster_id]
+
+    def get_cached(self, name, cluster_id, default=None):
+        """Return the value of a metric for a given cluster if it has already been computed."""
+        return self._cache.get(name, {}).get(cluster_id, default)
+
+    def missing(self, cluster_ids, names=None):
+        """Return the clusters that have at least one metric that has not been computed yet."""
+        names = names or list(self.functions)
+        caches = [self._cached(name) for name in names]
+        return [c for c in cluster_ids if any(c not in cache for cache in caches)]
+
+    def _compute_metric(self, name, cluster_ids, executor=None):
+        """Compute a metric on clusters whose value is not in the cache."""
+        f = self.functions[name]
+        cache = self._cached(name)
+        cluster_ids = [c for c in cluster_ids if c not in cache]
+        if not cluster_ids:
+            return
+        batch = getattr(f, 'batch', None)
+        if batch is not None:
+            cache.update(zip(cluster_ids, batch(cluster_ids)))
+            return
+
+        def _compute(cluster_id):
+            # NOTE: a cluster may be deleted during a computation in a background thread,
+            # in which case its value is simply not cached.
+            try:
+                cache[cluster_id] = f(cluster_id)
+            except Exception as e:  # pragma: no cover
+                logger.debug("Error when computing %s for cluster %d: %s", name, cluster_id, e)
+
+        if executor is None:
+            for cluster_id in cluster_ids:
+                _compute(cluster_id)
+        else:
+            list(executor.map(_compute, cluster_ids))
+
+    def compute(self, cluster_ids, names=None):
+        """Compute the metrics of some clusters, and return a dictionary
+        `{name: [value, ...]}` with the values of all clusters."""
+        names = names or list(self.functions)
+        cluster_ids = list(cluster_ids)
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for name in names:
+                self._compute_metric(name, cluster_ids, executor=executor)
+        return {
+            name: [self.get_cached(name, c) for c in cluster_ids] for name in names}
+
+    def to_dict(self, cluster_ids=None):
+        """Return the cache as a dictionary `{name: {cluster_id: value}}`, restricted to some
+        clusters if specified."""
+        if cluster_ids is None:
+            return {name: cache.copy() for name, cache in self._cache.items()}
+        return {
+            name: {c: cache[c] for c in cluster_ids if c in cache}
+            for name, cache in self._cache.items()}
+
+    def from_dict(self, d):
+        """Load cached values from a dictionary `{name: {cluster_id: value}}`."""
+        for name, values in (d or {}).items():
+            self._cached(name).update(values)
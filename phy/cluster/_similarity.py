@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Index of the most similar clusters, based on the similarity between templates."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+def _cluster_templates(spike_clusters, spike_templates, n_templates):
+    """Return a dictionary `{cluster_id: template_ids}` with the templates of the spikes of
+    every cluster."""
+    spike_clusters = np.asarray(spike_clusters, dtype=np.int64)
+    keys = np.unique(spike_clusters * n_templates + np.asarray(spike_templates, dtype=np.int64))
+    clusters, templates = np.divmod(keys, n_templates)
+    # The keys are sorted by cluster, then by template.
+    if not len(keys):
+        return {}
+    splits = np.nonzero(np.diff(clusters))[0] + 1
+    return dict(zip(clusters[np.r_[0, splits]].tolist(), np.split(templates, splits)))
+
+
+def _top(ids, sims, k):
+    """Return the k pairs with the highest similarity, sorted by decreasing similarity and
+    increasing id."""
+    if k is not None and len(sims) > k:
+        ind = np.argpartition(-sims, k - 1)[:k]
+        # NOTE: include the ties with the k-th similarity so that the order does not depend on
+        # argpartition.
+        ind = np.nonzero(sims >= sims[ind].min())[0]
+        ids, sims = ids[ind], sims[ind]
+    order = np.lexsort((ids, -sims))[:k]
+    return ids[order], sims[order]
+
+
+#------------------------------------------------------------------------------
+# Similarity index
+#------------------------------------------------------------------------------
+
+class TemplateSimilarityIndex(object):
+    """Index of the top-k most similar clusters of every cluster.
+
+    The similarity between two clusters is the maximum similarity between their templates.
+    The neighbors of a cluster are computed when it is first requested, in a single vectorized
+    pass over all clusters, and are then kept up-to-date after every clustering action, so that
+    most requests are answered directly from the index.
+
+    Constructor
+    -----------
+
+    similar_templates : array-like
+        A `(n_templates, n_templates)` array with the similarity between templates.
+    n_neighbors : int
+        Number of neighbors kept for every cluster.
+
+    """
+    def __init__(self, similar_templates, n_neighbors=100):
+        self.similar_templates = np.asarray(similar_templates)
+        self.n_templates = self.similar_templates.shape[0]
+        self.n_neighbors = n_neighbors
+        # Mapping {cluster_id: template_ids}.
+        self._templates = {}
+        # Mapping {cluster_id: (neighbor_ids, similarities)}, sorted by decreasing similarity.
+        self._neighbors = {}
+        # Concatenated templates of all clusters, used for the vectorized computations.
+        self._flat = None
+
+    def set_spike_clusters(self, spike_clusters, spike_templates):
+        """Build the index from the spike clusters and spike templates assignments."""
+        self.set_templates(
+            _cluster_templates(spike_clusters, spike_templates, self.n_templates))
+
+    def set_templates(self, templates):
+        """Build the index from a dictionary `{cluster_id: template_ids}`."""
+        self._templates = dict(templates)
+        self._neighbors.clear()
+        self._flat = None
+
+    @property
+    def cluster_ids(self):
+        """Sorted array of all cluster ids."""
+        return self._flatten()[0]
+
+    def _flatten(self):
+        """Return the sorted cluster ids, and the concatenated templates of these clusters,
+        with the offset of each cluster."""
+        if self._flat is None:
+            cluster_ids = np.array(sorted(self._templates), dtype=np.int64)
+            templates = [self._templates[c] for c in cluster_ids.tolist()]
+            sizes = np.array([len(t) for t in templates], dtype=np.int64)
+            offsets = np.r_[0, np.cumsum(sizes)[:-1]] if len(sizes) else sizes
+            flat = np.concatenate(templates) if templates else np.zeros(0, dtype=np.int64)
+            self._flat = (cluster_ids, flat, offsets)
+        return self._flat
+
+    def _max_per_cluster(self, values):
+        """Given a value for every template, return the maximum value across the templates of
+        every cluster."""
+        cluster_ids, flat, offsets = self._flatten()
+        if not len(cluster_ids):
+            return values[:0]
+        return np.maximum.reduceat(values[flat], offsets)
+
+    def similarity(self, cluster_id):
+        """Return the similarity between a cluster and all clusters, as a pair of arrays
+        `(cluster_ids, similarities)`."""
+        sims = self.similar_templates[self._templates[cluster_id]].max(axis=0)
+        return self.cluster_ids, self._max_per_cluster(sims)
+
+    def _compute_neighbors(self, cluster_id):
+        ids, sims = self.similarity(cluster_id)
+        keep = ids != cluster_id
+        return _top(ids[keep], sims[keep], self.n_neighbors)
+
+    def similar(self, cluster_id):
+        """Return the list of the most similar clusters to a given cluster, as a list of pairs
+        `(cluster_id, similarity)` sorted by decreasing similarity."""
+        if cluster_id not in self._templates:
+            return []
+        if cluster_id not in self._neighbors:
+            self._neighbors[cluster_id] = self._compute_neighbors(cluster_id)
+        ids, sims = self._neighbors[cluster_id]
+        return list(zip(ids.tolist(), sims.tolist()))
+
+    def update(self, added=None, deleted=()):
+        """Update the index after a clustering action.
+
+        Parameters
+        ----------
+
+        added : dict
+            Mapping `{cluster_id: template_ids}` with the templates of the new clusters.
+        deleted : list
+            List of the deleted clusters.
+
+        """
+        added = added or {}
+        deleted = set(deleted)
+        for cluster_id in deleted:
+            self._templates.pop(cluster_id, None)
+            self._neighbors.pop(cluster_id, None)
+        for cluster_id, templates in added.items():
+            self._templates[cluster_id] = np.unique(np.asarray(templates, dtype=np.int64))
+        self._flat = None
+
+        # Remove the deleted clusters from the neighbors. If the neighbors were not complete,
+        # other clusters may now enter the top-k, so the neighbors need to be recomputed.
+        for cluster_id, (ids, sims) in list(self._neighbors.items()):
+            keep = ~np.isin(ids, list(deleted)) if deleted else None
+            if keep is not None and not keep.all():
+                if len(ids) < self.n_neighbors:
+                    self._neighbors[cluster_id] = (ids[keep], sims[keep])
+                else:
+                    del self._neighbors[cluster_id]
+
+        # Insert the new clusters in the neighbors of the existing clusters.
+        if not self._neighbors:
+            return
+        cluster_ids = self.cluster_ids
+        for new_id in added:
+            # Similarity of every cluster to the new cluster.
+            to_new = self.similar_templates[:, self._templates[new_id]].max(axis=1)
+            sims_new = self._max_per_cluster(to_new)
+            for cluster_id, (ids, sims) in list(self._neighbors.items()):
+                if cluster_id == new_id:
+                    continue
+                sim = sims_new[np.searchsorted(cluster_ids, cluster_id)]
+                # Skip the clusters whose neighbors are truncated and less similar.
+                if len(ids) >= self.n_neighbors and sim < sims[-1]:
+                    continue
+                self._neighbors[cluster_id] = _top(
+                    np.r_[ids, new_id], np.r_[sims, sim], self.n_neighbors)
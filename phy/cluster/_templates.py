@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Sparse count of the spikes of every cluster in every template."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import logging
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+def _count_templates(spike_clusters, spike_templates, n_templates):
+    """Return a dictionary `{cluster_id: (template_ids, counts)}` with the number of spikes of
+    every cluster in each of its templates."""
+    keys = (
+        np.asarray(spike_clusters, dtype=np.int64) * n_templates +
+        np.asarray(spike_templates, dtype=np.int64))
+    keys, counts = np.unique(keys, return_counts=True)
+    if not len(keys):
+        return {}
+    clusters, templates = np.divmod(keys, n_templates)
+    # The keys are sorted by cluster, then by template.
+    splits = np.nonzero(np.diff(clusters))[0] + 1
+    return dict(zip(
+        clusters[np.r_[0, splits]].tolist(),
+        zip(np.split(templates, splits), np.split(counts, splits))))
+
+
+#------------------------------------------------------------------------------
+# Cluster template counts
+#------------------------------------------------------------------------------
+
+class ClusterTemplateCounts(object):
+    """Sparse cluster × template matrix with the number of spikes of every cluster in each
+    template.
+
+    Every cluster is stored as a sparse row, a pair of arrays `(template_ids, counts)` sorted by
+    template. The rows are computed on the first request with a single pass over all spikes,
+    and then updated after every clustering action: the row of a merged cluster is the sum of
+    the rows of the merged clusters, and the rows of the other new clusters are recounted from
+    the spikes affected by the action.
+
+    Constructor
+    -----------
+
+    spike_templates : array-like
+        The template of every spike.
+    n_templates : int
+        The total number of templates.
+    get_spike_clusters : function
+        Return the current spike clusters assignment.
+
+    """
+    def __init__(self, spike_templates, n_templates, get_spike_clusters):
+        self.spike_templates = spike_templates
+        self.n_templates = n_templates
+        self.get_spike_clusters = get_spike_clusters
+        # Mapping {cluster_id: (template_ids, counts)}.
+        self._rows = None
+        # NOTE: the counts may be requested from the views' worker threads.
+        self._lock = threading.RLock()
+
+    @property
+    def rows(self):
+        """Mapping `{cluster_id: (template_ids, counts)}`, computed on the first access."""
+        with self._lock:
+            if self._rows is None:
+                self._rows = _count_templates(
+                    self.get_spike_clusters(), self.spike_templates, self.n_templates)
+            return self._rows
+
+    def _merged_row(self, cluster_ids):
+        """Return the sum of the rows of several clusters."""
+        template_ids = np.concatenate([self._rows[c][0] for c in cluster_ids])
+        counts = np.concatenate([self._rows[c][1] for c in cluster_ids])
+        template_ids, inverse = np.unique(template_ids, return_inverse=True)
+        return template_ids, np.bincount(inverse, weights=counts).astype(counts.dtype)
+
+    def update(self, up):
+        """Update the counts after a clustering action."""
+        if not (up.added or up.deleted):
+            return
+        with self._lock:
+            if self._rows is None:
+                return
+            rows = self._rows
+            if (up.description == 'merge' and len(up.added) == 1 and
+                    all(c in rows for c in up.deleted)):
+                new_rows = {up.added[0]: self._merged_row(up.deleted)}
+            else:
+                # Recount the spikes affected by the action, which contain all spikes of the
+                # new clusters.
+                spike_ids = np.asarray(up.spike_ids, dtype=np.int64)
+                new_rows = _count_templates(
+                    self.get_spike_clusters()[spike_ids], self.spike_templates[spike_ids],
+                    self.n_templates)
+            for cluster_id in up.deleted:
+                rows.pop(cluster_id, None)
+            for cluster_id in up.added:
+                rows[cluster_id] = new_rows[cluster_id]
+
+    def get(self, cluster_id):
+        """Return the pair `(template_ids, counts)` of a cluster."""
+        return self.rows[cluster_id]
+
+    def get_dense(self, cluster_id):
+        """Return the number of spikes of a cluster in every template."""
+        template_ids, counts = self.get(cluster_id)
+        out = np.zeros(self.n_templates, dtype=np.int64)
+        out[template_ids] = counts
+        return out
+
+    def best_template(self, cluster_id):
+        """Return the template with the largest number of spikes in a cluster."""
+        template_ids, counts = self.get(cluster_id)
+        return template_ids[np.argmax(counts)]
+
+    def to_csr(self, cluster_ids):
+        """Return the `(n_clusters, n_templates)` CSR matrix with the counts of some
+        clusters."""
+        rows = [self.get(c) for c in cluster_ids]
+        indptr = np.r_[0, np.cumsum([len(t) for t, _ in rows])]
+        indices = np.concatenate([t for t, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        data = np.concatenate([c for _, c in rows]) if rows else np.zeros(0, dtype=np.int64)
+        return csr_matrix((data, indices, indptr), shape=(len(rows), self.n_templates))
@@ -8,7 +8,7 @@
 
 import numpy as np
 
-from copy import deepcopy
+from contextlib import contextmanager
 import logging
 
 from ._history import History
@@ -29,6 +29,12 @@ def _update_cluster_selection(clusters, up):
     return clusters + [clu for clu in up.added if clu not in clusters]
 
 
+def _uniq(seq):
+    """Remove the duplicates of a list while keeping the order."""
+    seen = set()
+    return [x for x in seq if not (x in seen or seen.add(x))]
+
+
 def _join(clusters):
     return '[{}]'.format(', '.join(map(str, clusters)))
 
@@ -49,9 +55,25 @@ def create_cluster_meta(cluster_groups):
 # UpdateInfo class
 #------------------------------------------------------------------------------
 
-class UpdateInfo(Bunch):
+def _read_only_array(arr, dtype=np.int64):
+    """Return a read-only view of an array, with a given dtype (copy only if needed)."""
+    arr = np.asarray(arr, dtype=dtype)
+    if arr.ndim == 0:
+        arr = arr.reshape((1,))
+    arr = arr.view()
+    arr.flags.writeable = False
+    return arr
+
+
+class UpdateInfo(object):
     """Object created every time the dataset is modified via a clustering or cluster metadata
-    action. It is passed to event callbacks that react to these changes. Derive from Bunch.
+    action. It is passed to event callbacks that react to these changes.
+
+    This is a compact object with fixed slots. The per-spike fields (`spike_ids` and
+    `spike_clusters`) are stored as read-only int64 NumPy arrays, so that large actions do not
+    create Python lists with millions of items. For backward compatibility, it still supports
+    the `Bunch` interface (dot and item access, `get()`, `keys()`, `items()`, `update()`...),
+    including arbitrary extra fields.
 
     Parameters
     ----------
@@ -62,6 +84,8 @@ class UpdateInfo(Bunch):
         undo, redo, or None
     spike_ids : array-like
         All spike ids that were affected by the clustering action.
+    spike_clusters : array-like
+        The new cluster ids of the affected spikes (only for assign actions).
     added : list
         List of new cluster ids.
     deleted : list
@@ -79,30 +103,140 @@ class UpdateInfo(Bunch):
         when redoing the undone action.
 
     """
+    __slots__ = (
+        'description', 'history', '_spike_ids', '_spike_clusters', 'added', 'deleted',
+        'descendants', 'metadata_changed', 'metadata_value', 'undo_state',
+        'largest_old_cluster', 'all_cluster_ids', '_extra')
+
+    # Fields always present, in that order, with their default values.
+    _defaults = (
+        ('description', ''),
+        ('history', None),
+        ('spike_ids', ()),
+        ('added', []),
+        ('deleted', []),
+        ('descendants', []),
+        ('metadata_changed', []),
+        ('metadata_value', None),
+        ('undo_state', None),
+    )
+    # Fields only present when explicitly set.
+    _optional = ('spike_clusters', 'largest_old_cluster', 'all_cluster_ids')
+
     def __init__(self, **kwargs):
-        d = dict(
-            description='',
-            history=None,
-            spike_ids=[],
-            added=[],
-            deleted=[],
-            descendants=[],
-            metadata_changed=[],
-            metadata_value=None,
-            undo_state=None,
-        )
-        d.update(kwargs)
-        super(UpdateInfo, self).__init__(d)
-        # NOTE: we have to ensure we only use native types and not NumPy arrays so that
-        # the history stack works correctly.
-        assert all(not isinstance(v, np.ndarray) for v in self.values())
+        object.__setattr__(self, '_extra', {})
+        for name, default in self._defaults:
+            value = kwargs.pop(name, default)
+            # NOTE: do not share the mutable default values between instances.
+            setattr(self, name, [] if value is default and isinstance(value, list) else value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    # Per-spike fields
+    # -------------------------------------------------------------------------
+
+    @property
+    def spike_ids(self):
+        """Read-only int64 array of the spikes affected by the action."""
+        return self._spike_ids
+
+    @spike_ids.setter
+    def spike_ids(self, value):
+        self._spike_ids = _read_only_array(value)
+
+    @property
+    def spike_clusters(self):
+        """Read-only int64 array with the new clusters of the affected spikes."""
+        return self._spike_clusters
+
+    @spike_clusters.setter
+    def spike_clusters(self, value):
+        self._spike_clusters = _read_only_array(value)
+
+    # Bunch interface
+    # -------------------------------------------------------------------------
+
+    def __getattr__(self, name):
+        # Only called when the attribute was not found in the slots.
+        extra = object.__getattribute__(self, '_extra')
+        if name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__ or name in ('spike_ids', 'spike_clusters'):
+            object.__setattr__(self, name, value)
+        else:
+            self._extra[name] = value
+
+    def __delattr__(self, name):
+        if name in self._extra:
+            del self._extra[name]
+        else:
+            object.__delattr__(self, name)
+
+    def keys(self):
+        """List of all fields."""
+        keys = [name for name, _ in self._defaults]
+        keys += [name for name in self._optional if hasattr(self, name)]
+        return keys + list(self._extra)
+
+    def values(self):
+        return [getattr(self, k) for k in self.keys()]
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self else default
+
+    def update(self, other=None, **kwargs):
+        """Update the fields from another UpdateInfo instance or dictionary."""
+        for k, v in (other or {}).items():
+            setattr(self, k, v)
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def copy(self):
+        return UpdateInfo(**dict(self.items()))
+
+    def __eq__(self, other):
+        if not isinstance(other, (UpdateInfo, dict)) or set(self.keys()) != set(other.keys()):
+            return False
+        for k, v in self.items():
+            w = other[k]
+            if isinstance(v, np.ndarray) or isinstance(w, np.ndarray):
+                if not np.array_equal(v, w):
+                    return False
+            elif v != w:
+                return False
+        return True
+
+    __hash__ = None
 
     def __repr__(self):
         desc = self.description
         h = ' ({})'.format(self.history) if self.history else ''
         if not desc:
             return '<UpdateInfo>'
-        elif desc in ('merge', 'assign'):
+        elif desc in ('merge', 'assign', 'batch'):
             a, d = _join(self.added), _join(self.deleted)
             return '<{desc}{h} {d} => {a}>'.format(
                 desc=desc, a=a, d=d, h=h)
@@ -118,18 +252,70 @@ class UpdateInfo(Bunch):
 # ClusterMetadataUpdater class
 #------------------------------------------------------------------------------
 
+def _object_array(n, value=None):
+    """Return an object array of size n filled with a given (possibly sequence) value."""
+    arr = np.empty(n, dtype=object)
+    arr.fill(value)
+    return arr
+
+
 class ClusterMeta(object):
-    """Handle cluster metadata changes."""
+    """Handle cluster metadata changes.
+
+    The metadata is stored in columns: there is one object array per field, indexed by the
+    cluster id, along with a boolean mask of the clusters that have an explicit value.
+
+    """
     def __init__(self):
         self._fields = {}
         self._reset_data()
 
     def _reset_data(self):
-        self._data = {}
-        self._data_base = {}
-        # The stack contains (clusters, field, value, update_info, undo_state)
-        # tuples.
-        self._undo_stack = History((None, None, None, None, None))
+        # Mapping field => (values, mask), both arrays indexed by the cluster id.
+        self._columns = {}
+        # Number of cluster ids allocated in the columns.
+        self._size = 0
+        # The stack contains (changes, update_info, undo_state) tuples, where changes is a list
+        # of (field, clusters, value, old) tuples (a single one, except for batches), and old
+        # is a (values, mask) snapshot of the changed clusters before the change.
+        self._undo_stack = History((None, None, None))
+        # Pending changes, and the object yielded by the outermost block, inside a `batch()`
+        # block.
+        self._batch = None
+        self._batch_result = None
+
+    def _ensure_size(self, n):
+        """Grow the columns so that they can hold cluster ids up to n - 1."""
+        if n <= self._size:
+            return
+        size = max(n, 2 * self._size, 64)
+        for field, (values, mask) in self._columns.items():
+            new_values = _object_array(size, self._fields[field])
+            new_values[:self._size] = values
+            new_mask = np.zeros(size, dtype=bool)
+            new_mask[:self._size] = mask
+            self._columns[field] = (new_values, new_mask)
+        self._size = size
+
+    def _get_values(self, field, cluster_ids):
+        """Return the object array with the values of some clusters."""
+        values, _ = self._columns[field]
+        out = _object_array(len(cluster_ids), self._fields[field])
+        inside = cluster_ids < self._size
+        out[inside] = values[cluster_ids[inside]]
+        return out
+
+    def _set_values(self, field, cluster_ids, new_values, new_mask=True):
+        """Set the values of some clusters, return a (values, mask) snapshot of the old values."""
+        if len(cluster_ids):
+            self._ensure_size(int(cluster_ids.max()) + 1)
+        values, mask = self._columns[field]
+        old = (values[cluster_ids], mask[cluster_ids])
+        if not isinstance(new_values, np.ndarray):
+            new_values = _object_array(len(cluster_ids), new_values)
+        values[cluster_ids] = new_values
+        mask[cluster_ids] = new_mask
+        return old
 
     @property
     def fields(self):
@@ -139,6 +325,13 @@ class ClusterMeta(object):
     def add_field(self, name, default_value=None):
         """Add a field with an optional default value."""
         self._fields[name] = default_value
+        if name not in self._columns:
+            self._columns[name] = (
+                _object_array(self._size, default_value), np.zeros(self._size, dtype=bool))
+        else:
+            # Update the default value of the clusters that do not have an explicit value.
+            values, mask = self._columns[name]
+            values[~mask] = default_value
 
         def func(cluster):
             return self.get(name, cluster)
@@ -147,18 +340,22 @@ class ClusterMeta(object):
 
     def from_dict(self, dic):
         """Import data from a `{cluster_id: {field: value}}` dictionary."""
-        #self._reset_data()
         # Do not raise events here.
         with silent():
             for cluster, vals in dic.items():
                 for field, value in vals.items():
                     self.set(field, [cluster], value, add_to_stack=False)
-        self._data_base = deepcopy(self._data)
 
     def to_dict(self, field):
         """Export data to a `{cluster_id: value}` dictionary, for a particular field."""
         assert field in self._fields, "This field doesn't exist"
-        return {cluster: self.get(field, cluster) for cluster in self._data.keys()}
+        # All clusters with an explicit value for any field.
+        has_data = np.zeros(self._size, dtype=bool)
+        for _, mask in self._columns.values():
+            has_data |= mask
+        cluster_ids = np.nonzero(has_data)[0]
+        values = self._columns[field][0][cluster_ids]
+        return dict(zip(cluster_ids.tolist(), values.tolist()))
 
     def set(self, field, clusters, value, add_to_stack=True):
         """Set the value of one of several clusters.
@@ -187,29 +384,59 @@ class ClusterMeta(object):
         assert field in self._fields
 
         clusters = _as_list(clusters)
-        for cluster in clusters:
-            if cluster not in self._data:
-                self._data[cluster] = {}
-            self._data[cluster][field] = value
+        old = self._set_values(field, np.asarray(clusters, dtype=np.int64), value)
 
         up = UpdateInfo(description='metadata_' + field,
                         metadata_changed=clusters,
                         metadata_value=value,
                         )
-        undo_state = emit('request_undo_state', self, up)
 
-        if add_to_stack:
-            self._undo_stack.add((clusters, field, value, up, undo_state))
+        if add_to_stack and self._batch is not None:
+            # The change will be recorded and notified when the batch finishes.
+            self._batch.append((field, clusters, value, old))
+        elif add_to_stack:
+            undo_state = emit('request_undo_state', self, up)
+            self._undo_stack.add(([(field, clusters, value, old)], up, undo_state))
             emit('cluster', self, up)
 
         return up
 
+    @contextmanager
+    def batch(self):
+        """Context manager that records all changes made inside it as a single history item.
+
+        The changes are applied immediately, but no `cluster` event is raised. The yielded object
+        has an `up` attribute, set when the block exits, with the `UpdateInfo` of all changes
+        (None if nothing changed).
+
+        """
+        if self._batch is not None:
+            # Nested batches are part of the outer batch.
+            yield self._batch_result
+            return
+        self._batch = []
+        self._batch_result = result = Bunch(up=None)
+        try:
+            yield result
+        finally:
+            changes, self._batch = self._batch, None
+            self._batch_result = None
+            if changes:
+                clusters = _uniq([c for _, clusters, _, _ in changes for c in clusters])
+                result.up = UpdateInfo(
+                    description='batch', metadata_changed=clusters,
+                    metadata_value=changes[-1][2])
+                undo_state = emit('request_undo_state', self, result.up)
+                self._undo_stack.add((changes, result.up, undo_state))
+
     def get(self, field, cluster):
-        """Retrieve the value of one cluster for a given field."""
-        if _is_list(cluster):
-            return [self.get(field, c) for c in cluster]
+        """Retrieve the value of one or several clusters for a given field."""
         assert field in self._fields
-        return self._data.get(cluster, {}).get(field, self._fields[field])
+        if _is_list(cluster) or isinstance(cluster, np.ndarray):
+            return self._get_values(field, np.asarray(cluster, dtype=np.int64)).tolist()
+        if 0 <= cluster < self._size:
+            return self._columns[field][0][cluster]
+        return self._fields[field]
 
     def set_from_descendants(self, descendants, largest_old_cluster=None):
         """Update metadata of some clusters given the metadata of their ascendants.
@@ -223,17 +450,17 @@ class ClusterMeta(object):
             If available, the cluster id of the largest old cluster, used as a reference.
 
         """
+        if not len(descendants):
+            return
+        descendants = np.asarray(descendants, dtype=np.int64).reshape((-1, 2))
+        old_clusters = np.unique(descendants[:, 0])
+        new_clusters = np.unique(descendants[:, 1])
         for field in self.fields:
             # Consider the default value for the current field.
             default = self._fields[field]
-            # This maps old cluster ids to their values.
-            old_values = {old: self.get(field, old) for old, _ in descendants}
-            # This is the set of new clusters.
-            new_clusters = set(new for _, new in descendants)
             # This is the set of old non-default values.
-            old_values_set = set(old_values.values())
-            if default in old_values_set:
-                old_values_set.remove(default)
+            old_values = self._get_values(field, old_clusters)
+            old_values_set = set(old_values[old_values != default].tolist())
             # old_values_set contains all non-default values of the modified clusters.
             n = len(old_values_set)
             if n == 0:
@@ -248,11 +475,10 @@ class ClusterMeta(object):
                 # We ensure that the largest old cluster is specified.
                 assert largest_old_cluster is not None
                 # We choose this value.
-                new_value = old_values[largest_old_cluster]
+                new_value = self.get(field, largest_old_cluster)
             # Set the new value to all new clusters that don't already have a non-default value.
-            for new in new_clusters:
-                if self.get(field, new) == default:
-                    self.set(field, new, new_value, add_to_stack=False)
+            new_values = self._get_values(field, new_clusters)
+            self._set_values(field, new_clusters[new_values == default], new_value)
 
     def undo(self):
         """Undo the last metadata change.
@@ -266,13 +492,12 @@ class ClusterMeta(object):
         args = self._undo_stack.back()
         if args is None:
             return
-        self._data = deepcopy(self._data_base)
-        for clusters, field, value, up, undo_state in self._undo_stack:
-            if clusters is not None:
-                self.set(field, clusters, value, add_to_stack=False)
+        changes, up, undo_state = args
+        # Restore the snapshots of the old values, in reverse order.
+        for field, clusters, _, (values, mask) in reversed(changes):
+            self._set_values(field, np.asarray(clusters, dtype=np.int64), values, mask)
 
         # Return the UpdateInfo instance of the undo action.
-        up, undo_state = args[-2:]
         up.history = 'undo'
         up.undo_state = undo_state
 
@@ -291,8 +516,9 @@ class ClusterMeta(object):
         args = self._undo_stack.forward()
         if args is None:
             return
-        clusters, field, value, up, undo_state = args
-        self.set(field, clusters, value, add_to_stack=False)
+        changes, up, undo_state = args
+        for field, clusters, value, _ in changes:
+            self._set_values(field, np.asarray(clusters, dtype=np.int64), value)
 
         # Return the UpdateInfo instance of the redo action.
         up.history = 'redo'
@@ -6,12 +6,13 @@
 # Imports
 #------------------------------------------------------------------------------
 
+from contextlib import contextmanager
 import logging
 
 import numpy as np
 
-from phylib.utils._types import _as_array, _is_array_like
-from phylib.io.array import _unique, _spikes_in_clusters, _spikes_per_cluster
+from phylib.utils._types import Bunch, _as_array, _is_array_like
+from phylib.io.array import _unique, _index_of, _spikes_in_clusters, _spikes_per_cluster
 from ._utils import UpdateInfo
 from ._history import History
 from phylib.utils.event import emit
@@ -23,7 +24,19 @@ logger = logging.getLogger(__name__)
 # Clustering class
 #------------------------------------------------------------------------------
 
-def _extend_spikes(spike_ids, spike_clusters):
+def _spikes_in_clusters_index(spikes_per_cluster, clusters):
+    """Return the sorted ids of all spikes belonging to the specified clusters, using
+    a `{cluster_id: spike_ids}` dictionary instead of scanning the `spike_clusters` array."""
+    arrs = [spikes_per_cluster[clu] for clu in clusters if clu in spikes_per_cluster]
+    if not arrs:
+        return np.array([], dtype=np.int64)
+    if len(arrs) == 1:
+        return _as_array(arrs[0]).astype(np.int64)
+    # NOTE: the stable sort is much faster here as the arrays to merge are already sorted.
+    return np.sort(np.concatenate(arrs), kind='mergesort').astype(np.int64, copy=False)
+
+
+def _extend_spikes(spike_ids, spike_clusters, spikes_per_cluster=None):
     """Return all spikes belonging to the clusters containing the specified
     spikes."""
     # We find the spikes belonging to modified clusters.
@@ -31,7 +44,11 @@ def _extend_spikes(spike_ids, spike_clusters):
     old_spike_clusters = spike_clusters[spike_ids]
     unique_clusters = _unique(old_spike_clusters)
     # Now we take all spikes from these clusters.
-    changed_spike_ids = _spikes_in_clusters(spike_clusters, unique_clusters)
+    if spikes_per_cluster is not None:
+        # OPTIM: only look at the spikes of the modified clusters.
+        changed_spike_ids = _spikes_in_clusters_index(spikes_per_cluster, unique_clusters)
+    else:
+        changed_spike_ids = _spikes_in_clusters(spike_clusters, unique_clusters)
     # These are the new spikes that need to be reassigned.
     extended_spike_ids = np.setdiff1d(changed_spike_ids, spike_ids, assume_unique=True)
     return extended_spike_ids
@@ -46,7 +63,9 @@ def _concatenate_spike_clusters(*pairs):
     return concat[:, 0].astype(np.int64), concat[:, 1].astype(np.int64)
 
 
-def _extend_assignment(spike_ids, old_spike_clusters, spike_clusters_rel, new_cluster_id):
+def _extend_assignment(
+        spike_ids, old_spike_clusters, spike_clusters_rel, new_cluster_id,
+        spikes_per_cluster=None):
     # 1. Add spikes that belong to modified clusters.
     # 2. Find new cluster ids for all changed clusters.
 
@@ -61,7 +80,8 @@ def _extend_assignment(spike_ids, old_spike_clusters, spike_clusters_rel, new_cl
     new_spike_clusters = (spike_clusters_rel + (new_cluster_id - spike_clusters_rel.min()))
 
     # We find the spikes belonging to modified clusters.
-    extended_spike_ids = _extend_spikes(spike_ids, old_spike_clusters)
+    extended_spike_ids = _extend_spikes(
+        spike_ids, old_spike_clusters, spikes_per_cluster=spikes_per_cluster)
     if len(extended_spike_ids) == 0:
         return spike_ids, new_spike_clusters
 
@@ -78,15 +98,96 @@ def _extend_assignment(spike_ids, old_spike_clusters, spike_clusters_rel, new_cl
         (spike_ids, new_spike_clusters), (extended_spike_ids, extended_spike_clusters))
 
 
+def _smallest_uint(n):
+    """Smallest unsigned integer dtype that can store values from 0 to n - 1."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def _pack_spike_clusters(spike_clusters):
+    """Compact representation of a spike_clusters array: the pair `(clusters, indices)` where
+    `clusters` are the unique cluster ids, and `indices` the index of every spike's cluster in
+    that array, stored with the smallest possible integer type (or None if there is a single
+    cluster)."""
+    spike_clusters = _as_array(spike_clusters)
+    # NOTE: this is O(n_spikes + max_cluster_id) whereas np.unique() requires a sort.
+    clusters = _unique(spike_clusters)
+    if len(clusters) <= 1:
+        return clusters, None
+    indices = _index_of(spike_clusters, clusters)
+    return clusters, indices.astype(_smallest_uint(len(clusters)))
+
+
+def _unpack_spike_clusters(packed, n_spikes):
+    """Inverse of `_pack_spike_clusters()`."""
+    clusters, indices = packed
+    if indices is None:
+        return np.repeat(clusters, n_spikes)
+    return clusters[indices]
+
+
+def _spikes_per_cluster_to_csr(spikes_per_cluster):
+    """Compressed representation of a `{cluster_id: spike_ids}` dictionary: the triplet
+    `(cluster_ids, offsets, spike_ids)` where `spike_ids` contains the spikes of all clusters
+    sorted by cluster, the spikes of the i-th cluster being
+    `spike_ids[offsets[i]:offsets[i + 1]]`."""
+    cluster_ids = sorted(spikes_per_cluster)
+    offsets = np.zeros(len(cluster_ids) + 1, dtype=np.int64)
+    np.cumsum([len(spikes_per_cluster[clu]) for clu in cluster_ids], out=offsets[1:])
+    spike_ids = np.empty(offsets[-1], dtype=np.int64)
+    for i, clu in enumerate(cluster_ids):
+        spike_ids[offsets[i]:offsets[i + 1]] = spikes_per_cluster[clu]
+    return np.array(cluster_ids, dtype=np.int64), offsets, spike_ids
+
+
+def _spikes_per_cluster_from_csr(cluster_ids, offsets, spike_ids):
+    """Inverse of `_spikes_per_cluster_to_csr()`. The spikes of every cluster are views of the
+    `spike_ids` array, which may be memory-mapped."""
+    # NOTE: avoid propagating the np.memmap subclass to the views.
+    spike_ids = np.asarray(spike_ids)
+    offsets = np.asarray(offsets).tolist()
+    return {
+        clu: spike_ids[offsets[i]:offsets[i + 1]]
+        for i, clu in enumerate(np.asarray(cluster_ids).tolist())}
+
+
+def _spike_ranks(spike_ids):
+    """Return a pseudo-random 64-bit rank for every spike. The rank only depends on the spike id
+    (it is the splitmix64 finalizer, a bijection), so that it never needs to be stored."""
+    x = _as_array(spike_ids).astype(np.uint64)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xbf58476d1ce4e5b9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94d049bb133111eb)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def _random_order(spike_ids):
+    """Return the spike ids sorted by rank, a stable random order.
+
+    The concatenation of several arrays already sorted by rank is merged in linear time,
+    as the stable sort takes advantage of the sorted runs.
+
+    """
+    spike_ids = _as_array(spike_ids).astype(np.int64, copy=False)
+    return spike_ids[np.argsort(_spike_ranks(spike_ids), kind='stable')]
+
+
 def _assign_update_info(spike_ids, old_spike_clusters, new_spike_clusters):
     old_clusters = _unique(old_spike_clusters)
     new_clusters = _unique(new_spike_clusters)
     largest_old_cluster = np.bincount(old_spike_clusters).argmax()
-    descendants = list(set(zip(old_spike_clusters, new_spike_clusters)))
+    # OPTIM: find the unique (old, new) pairs without iterating over the spikes in Python.
+    k = int(new_clusters.max()) + 1
+    pairs = np.unique(old_spike_clusters.astype(np.int64) * k + new_spike_clusters)
+    descendants = [(int(p // k), int(p % k)) for p in pairs]
     update_info = UpdateInfo(
         description='assign',
-        spike_ids=list(spike_ids),
-        spike_clusters=list(new_spike_clusters),
+        spike_ids=spike_ids,
+        spike_clusters=new_spike_clusters,
         added=list(new_clusters),
         deleted=list(old_clusters),
         descendants=descendants,
@@ -109,23 +210,32 @@ class Clustering(object):
     spikes_per_cluster : dict
         Dictionary mapping each cluster id to the spike ids belonging to it. This is recomputed
         if not given. This object may take a while to compute, so it may be cached and passed
-        to the constructor.
+        to the constructor. It is then maintained incrementally: every action only updates the
+        entries of the clusters it modifies.
 
     Features
     --------
 
     * List of clusters appearing in a `spike_clusters` array
     * Dictionary of spikes per cluster
+    * Stable random order of the spikes of every cluster, used for subsampling
     * Merge
     * Split and assign
     * Undo/redo stack
+    * Batches of actions recorded as a single history item
 
     Notes
     -----
 
     The undo stack works by keeping the list of all spike cluster changes
-    made successively. Undoing consists of reapplying all changes from the
-    original `spike_clusters` array, except the last one.
+    made successively, as reversible deltas: every item contains the affected
+    spike ids, with their old and new cluster ids. Undoing or redoing an action
+    only consists of applying the old or new cluster ids of the affected spikes,
+    so that it costs O(n_affected_spikes) whatever the length of the history.
+
+    The spikes per cluster index is only updated by the methods of this class.
+    If `spike_clusters` is modified in place, `_update_cluster_ids()` must be
+    called afterwards to rebuild the index and the list of cluster ids.
 
     UpdateInfo
     ----------
@@ -135,22 +245,25 @@ class Clustering(object):
     This object is used throughout the `phy.cluster.manual` package to let
     different classes know about clustering changes.
 
-    `UpdateInfo` is a dictionary that also supports dot access (`Bunch` class).
+    `UpdateInfo` supports both dot access and item access, like a `Bunch`.
 
     """
 
     def __init__(self, spike_clusters, new_cluster_id=None,
                  spikes_per_cluster=None):
         super(Clustering, self).__init__()
-        self._undo_stack = History(base_item=(None, None, None))
+        # The history contains (spike_ids, old_spike_clusters, new_spike_clusters, undo_state)
+        # tuples, where the spike clusters are packed with _pack_spike_clusters().
+        self._undo_stack = History(base_item=(None, None, None, None))
+        # Pending batch of actions, when inside a `batch()` block.
+        self._batch = None
         # Spike -> cluster mapping.
         self._spike_clusters = _as_array(spike_clusters)
-        self._spikes_per_cluster = {}
         self._n_spikes = len(self._spike_clusters)
         self._spike_ids = np.arange(self._n_spikes).astype(np.int64)
         # We can pass the precomputed spikes_per_cluster dictionary for
         # performance reasons.
-        self._update_cluster_ids(to_add=spikes_per_cluster)
+        self._init_spikes_per_cluster(spikes_per_cluster)
         self._new_cluster_id_0 = int(new_cluster_id or self._spike_clusters.max() + 1)
         self._new_cluster_id = self._new_cluster_id_0
         assert self._new_cluster_id >= 0
@@ -165,7 +278,8 @@ class Clustering(object):
 
         """
         self._undo_stack.clear()
-        self._spike_clusters = self._spike_clusters_base
+        self._spike_clusters = self._spike_clusters_base.copy()
+        self._init_spikes_per_cluster()
         self._new_cluster_id = self._new_cluster_id_0
 
     @property
@@ -214,29 +328,95 @@ class Clustering(object):
 
     def spikes_in_clusters(self, clusters):
         """Return the array of spike ids belonging to a list of clusters."""
-        return _spikes_in_clusters(self.spike_clusters, clusters)
+        return _spikes_in_clusters_index(self._spikes_per_cluster, clusters)
+
+    def spike_order(self, cluster_id):
+        """Return the spikes of a cluster in a stable random order, so that the first n spikes
+        are a random subset of the cluster.
+
+        The order is computed on the first request, and the order of a merged cluster is
+        obtained from the orders of the merged clusters.
+
+        """
+        order = self._spike_orders.get(cluster_id, None)
+        if order is None:
+            spike_ids = self._spikes_per_cluster.get(cluster_id, None)
+            if spike_ids is None:
+                return np.array([], dtype=np.int64)
+            order = self._spike_orders[cluster_id] = _random_order(spike_ids)
+        return order
 
     # Actions
     #--------------------------------------------------------------------------
 
+    def _init_spikes_per_cluster(self, spikes_per_cluster=None):
+        """Build the spikes per cluster index, reusing the passed dictionary if it is
+        consistent with the spike clusters assignment.
+
+        This is the only place where the whole `spike_clusters` array is scanned. Afterwards,
+        the index is updated incrementally by `_update_cluster_ids()`.
+
+        """
+        cluster_ids = _unique(self._spike_clusters)
+        spc = spikes_per_cluster or {}
+        # The passed dictionary is only used if it contains all clusters and all spikes.
+        coherent = (
+            set(cluster_ids) <= set(spc) and
+            sum(len(spc[clu]) for clu in cluster_ids) == np.sum(self._spike_clusters >= 0))
+        if not coherent:
+            logger.debug("Recompute spikes_per_cluster manually: this might take a while.")
+            spc = _spikes_per_cluster(self._spike_clusters)
+        self._spikes_per_cluster = {
+            int(clu): _as_array(spc[clu]).astype(np.int64, copy=False) for clu in cluster_ids}
+        self._cluster_ids = cluster_ids
+        # Mapping {cluster_id: spike_ids} with the spikes in random order, computed on demand.
+        self._spike_orders = {}
+
     def _update_cluster_ids(self, to_remove=None, to_add=None):
-        # Update the list of non-empty cluster ids.
-        self._cluster_ids = _unique(self._spike_clusters)
+        """Update the spikes per cluster index and the list of non-empty cluster ids, given
+        the deleted clusters and the `{cluster_id: spike_ids}` dictionary of the new clusters.
+
+        This only costs O(n_affected_spikes + n_clusters). When called without arguments,
+        the whole index is rebuilt from the `spike_clusters` array.
+
+        """
+        if to_remove is None and to_add is None:
+            return self._init_spikes_per_cluster()
+        to_add = to_add or {}
         # Clusters to remove.
-        if to_remove is not None:
-            for clu in to_remove:
-                self._spikes_per_cluster.pop(clu, None)
+        orders = []
+        for clu in (to_remove if to_remove is not None else ()):
+            self._spikes_per_cluster.pop(clu, None)
+            orders.append(self._spike_orders.pop(clu, None))
         # Clusters to add.
-        if to_add:
-            for clu, spk in to_add.items():
-                self._spikes_per_cluster[clu] = spk
-        # If spikes_per_cluster is invalid, recompute the entire
-        # spikes_per_cluster array.
-        coherent = np.all(np.in1d(self._cluster_ids, sorted(self._spikes_per_cluster)))
-        if not coherent:
-            logger.debug("Recompute spikes_per_cluster manually: this might take a while.")
-            sc = self._spike_clusters
-            self._spikes_per_cluster = _spikes_per_cluster(sc)
+        for clu, spk in to_add.items():
+            if clu >= 0 and len(spk):
+                self._spikes_per_cluster[int(clu)] = _as_array(spk).astype(np.int64, copy=False)
+        # OPTIM: the random order of a merged cluster is obtained by merging the random orders
+        # of the merged clusters.
+        if len(to_add) == 1 and orders and all(order is not None for order in orders):
+            (clu, spk), = to_add.items()
+            if sum(len(order) for order in orders) == len(spk):
+                self._spike_orders[int(clu)] = _random_order(np.concatenate(orders))
+        # Update the list of non-empty cluster ids.
+        self._cluster_ids = np.array(sorted(self._spikes_per_cluster), dtype=np.int64)
+
+    def _add_to_stack(self, spike_ids, old_spike_clusters, new_spike_clusters, up):
+        """Add a reversible delta to the undo stack, or to the pending batch."""
+        spike_ids = _as_array(spike_ids)
+        if self._batch is not None:
+            self._batch.items.append((
+                spike_ids, _as_array(old_spike_clusters),
+                np.broadcast_to(new_spike_clusters, spike_ids.shape)))
+            return
+        undo_state = emit('request_undo_state', self, up)
+        # Spike ids are stored with 32-bit integers when possible.
+        dtype = np.uint32 if self._n_spikes <= np.iinfo(np.uint32).max else np.int64
+        self._undo_stack.add((
+            spike_ids.astype(dtype),
+            _pack_spike_clusters(old_spike_clusters),
+            _pack_spike_clusters(new_spike_clusters),
+            undo_state))
 
     def _do_assign(self, spike_ids, new_spike_clusters):
         """Make spike-cluster assignments after the spike selection has
@@ -273,7 +453,7 @@ class Clustering(object):
         # OPTIM: we update spikes_per_cluster manually.
         new_spc = _spikes_per_cluster(new_spike_clusters, spike_ids)
         self._update_cluster_ids(to_remove=old_clusters, to_add=new_spc)
-        up.all_cluster_ids = list(self.cluster_ids)
+        up.all_cluster_ids = self.cluster_ids.tolist()
         return up
 
     def _do_merge(self, spike_ids, cluster_ids, to):
@@ -283,7 +463,7 @@ class Clustering(object):
         largest_old_cluster = np.bincount(self.spike_clusters[spike_ids]).argmax()
         up = UpdateInfo(
             description='merge',
-            spike_ids=list(spike_ids),
+            spike_ids=spike_ids,
             added=[to],
             deleted=list(cluster_ids),
             descendants=descendants,
@@ -298,7 +478,7 @@ class Clustering(object):
         # Update the list of non-empty cluster ids.
         # OPTIM: we update spikes_per_cluster manually.
         self._update_cluster_ids(to_remove=cluster_ids, to_add={to: spike_ids})
-        up.all_cluster_ids = list(self.cluster_ids)
+        up.all_cluster_ids = self.cluster_ids.tolist()
         return up
 
     def merge(self, cluster_ids, to=None):
@@ -323,7 +503,7 @@ class Clustering(object):
             raise ValueError("The first argument should be a list or an array.")
 
         cluster_ids = sorted(cluster_ids)
-        if not set(cluster_ids) <= set(self.cluster_ids):
+        if not all(clu in self._spikes_per_cluster for clu in cluster_ids):
             raise ValueError("Some clusters do not exist.")
 
         # Find the new cluster number.
@@ -339,13 +519,13 @@ class Clustering(object):
         # cheaper operation.
 
         # Find all spikes in the specified clusters.
-        spike_ids = _spikes_in_clusters(self.spike_clusters, cluster_ids)
+        spike_ids = self.spikes_in_clusters(cluster_ids)
+        old_spike_clusters = self._spike_clusters[spike_ids]
 
         up = self._do_merge(spike_ids, cluster_ids, to)
-        undo_state = emit('request_undo_state', self, up)
 
         # Add to stack.
-        self._undo_stack.add((spike_ids, [to], undo_state))
+        self._add_to_stack(spike_ids, old_spike_clusters, [to], up)
 
         emit('cluster', self, up)
         return up
@@ -384,7 +564,7 @@ class Clustering(object):
 
         If a spike is assigned to a new cluster, then all other spikes
         belonging to the same cluster are assigned to a brand new cluster,
-        even if they were not changed explicitely by the `assign()` method.
+        even if they were not changed explicitly by the `assign()` method.
 
         In other words, the list of spikes affected by an `assign()` is almost
         always a strict superset of the `spike_ids` parameter. The only case
@@ -413,13 +593,14 @@ class Clustering(object):
         # belong to clusters affected by the operation, will be assigned
         # to brand new clusters.
         spike_ids, cluster_ids = _extend_assignment(
-            spike_ids, self._spike_clusters, spike_clusters_rel, self.new_cluster_id())
+            spike_ids, self._spike_clusters, spike_clusters_rel, self.new_cluster_id(),
+            spikes_per_cluster=self._spikes_per_cluster)
+        old_spike_clusters = self._spike_clusters[spike_ids]
 
         up = self._do_assign(spike_ids, cluster_ids)
-        undo_state = emit('request_undo_state', self, up)
 
         # Add the assignment to the undo stack.
-        self._undo_stack.add((spike_ids, cluster_ids, undo_state))
+        self._add_to_stack(spike_ids, old_spike_clusters, cluster_ids, up)
 
         emit('cluster', self, up)
         return up
@@ -453,6 +634,52 @@ class Clustering(object):
         # self.assign() accepts relative numbers as second argument.
         return self.assign(spike_ids, spike_clusters_rel)
 
+    @contextmanager
+    def batch(self):
+        """Context manager that records all actions made inside it as a single history item.
+
+        The actions are applied immediately and still raise individual `cluster` events, but
+        undoing or redoing the batch reverts or reapplies all of them at once. The yielded object
+        has an `up` attribute, set when the block exits, with the `UpdateInfo` of the net change
+        made by the batch (None if nothing changed).
+
+        """
+        if self._batch is not None:
+            # Nested batches are part of the outer batch.
+            yield self._batch
+            return
+        self._batch = Bunch(items=[], up=None)
+        try:
+            yield self._batch
+        finally:
+            batch, self._batch = self._batch, None
+            batch.up = self._finish_batch(batch.items)
+
+    def _finish_batch(self, items):
+        """Combine the deltas of a batch into a single history item."""
+        if not items:
+            return
+        spike_ids = np.concatenate([spk for spk, _, _ in items])
+        old = np.concatenate([old for _, old, _ in items])
+        new = np.concatenate([new for _, _, new in items])
+        # For every affected spike, we keep its cluster before the first action of the batch,
+        # and its cluster after the last one.
+        order = np.argsort(spike_ids, kind='mergesort')
+        spike_ids, old, new = spike_ids[order], old[order], new[order]
+        first = np.r_[True, np.diff(spike_ids) != 0]
+        last = np.r_[first[1:], True]
+        spike_ids, old, new = spike_ids[first], old[first], new[last]
+        changed = old != new
+        spike_ids, old, new = spike_ids[changed], old[changed], new[changed]
+        if not len(spike_ids):
+            return
+
+        up = _assign_update_info(spike_ids, old, new)
+        up.description = 'batch'
+        up.all_cluster_ids = self.cluster_ids.tolist()
+        self._add_to_stack(spike_ids, old, new, up)
+        return up
+
     def undo(self):
         """Undo the last cluster assignment operation.
 
@@ -462,22 +689,17 @@ class Clustering(object):
         up : UpdateInfo instance of the changes done by this operation.
 
         """
-        _, _, undo_state = self._undo_stack.back()
-
-        # Retrieve the initial spike_cluster structure.
-        spike_clusters_new = self._spike_clusters_base.copy()
-
-        # Loop over the history (except the last item because we undo).
-        for spike_ids, cluster_ids, _ in self._undo_stack:
-            # We update the spike clusters accordingly.
-            if spike_ids is not None:
-                spike_clusters_new[spike_ids] = cluster_ids
-
-        # What are the spikes affected by the last changes?
-        changed = np.nonzero(self._spike_clusters != spike_clusters_new)[0]
-        clusters_changed = spike_clusters_new[changed]
+        assert self._batch is None, "Cannot undo inside a batch."
+        item = self._undo_stack.back()
+        if item is None:
+            # No undo has been performed: abort.
+            return
+        spike_ids, old_spike_clusters, _, undo_state = item
 
-        up = self._do_assign(changed, clusters_changed)
+        # We restore the old assignment of the spikes affected by the last change.
+        spike_ids = spike_ids.astype(np.int64)
+        up = self._do_assign(
+            spike_ids, _unpack_spike_clusters(old_spike_clusters, len(spike_ids)))
         up.history = 'undo'
         # Add the undo_state object from the undone object.
         up.undo_state = undo_state
@@ -494,6 +716,7 @@ class Clustering(object):
         up : UpdateInfo instance of the changes done by this operation.
 
         """
+        assert self._batch is None, "Cannot redo inside a batch."
         # Go forward in the stack, and retrieve the new assignment.
         item = self._undo_stack.forward()
         if item is None:
@@ -504,11 +727,13 @@ class Clustering(object):
         # It represents data associated to the state
         # *before* the action. What might be more useful would be the
         # undo_state object of the next item in the list (if it exists).
-        spike_ids, cluster_ids, undo_state = item
+        spike_ids, _, new_spike_clusters, undo_state = item
         assert spike_ids is not None
 
         # We apply the new assignment.
-        up = self._do_assign(spike_ids, cluster_ids)
+        spike_ids = spike_ids.astype(np.int64)
+        up = self._do_assign(
+            spike_ids, _unpack_spike_clusters(new_spike_clusters, len(spike_ids)))
         up.history = 'redo'
 
         emit('cluster', self, up)
@@ -7,20 +7,28 @@
 # Imports
 # -----------------------------------------------------------------------------
 
+from contextlib import contextmanager
 from functools import partial
+import hashlib
 import inspect
 import logging
+import os
 
 import numpy as np
 
 from ._history import GlobalHistory
-from ._utils import create_cluster_meta
-from .clustering import Clustering
+from ._journal import Journal, _checksum
+from ._metrics import ClusterMetrics
+from ._utils import create_cluster_meta, _uniq
+from .clustering import (
+    Clustering, _spikes_per_cluster_to_csr, _spikes_per_cluster_from_csr)
 
+from phylib.io.array import read_array, write_array
 from phylib.utils import Bunch, emit, connect, unconnect
-from phy.gui.actions import Actions
-from phy.gui.qt import _block, set_busy, _wait
-from phy.gui.widgets import Table, HTMLWidget, _uniq, Barrier
+from phy.utils.context import _function_key
+
+# NOTE: the GUI components depend on Qt, they are only imported when a GUI is attached, so that
+# the Supervisor can be used without GUI (for example, in `phy template-curate`).
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +37,13 @@ logger = logging.getLogger(__name__)
 # Utility functions
 # -----------------------------------------------------------------------------
 
+def _is_set(value):
+    """Whether an UpdateInfo field is set, without taking the truth value of arrays."""
+    if value is None:
+        return False
+    return len(value) > 0 if hasattr(value, '__len__') else bool(value)
+
+
 def _process_ups(ups):  # pragma: no cover
     """This function processes the UpdateInfo instances of the two
     undo stacks (clustering and cluster metadata) and concatenates them
@@ -38,8 +53,10 @@ def _process_ups(ups):  # pragma: no cover
     elif len(ups) == 1:
         return ups[0]
     elif len(ups) == 2:
+        # NOTE: only keep the non-empty fields of the second UpdateInfo instance, so that the
+        # default values of the cluster meta UpdateInfo do not erase the clustering changes.
         up = ups[0]
-        up.update(ups[1])
+        up.update({k: v for k, v in ups[1].items() if k != 'description' and _is_set(v)})
         return up
     else:
         raise NotImplementedError()
@@ -153,7 +170,7 @@ class TaskLogger(object):
     def _get_clusters(self, which):
         cluster_ids, next_cluster, similar, next_similar = self.last_state()
         if which == 'all':
-            return _uniq(cluster_ids + similar)
+            return _uniq([int(c) for c in cluster_ids + similar])
         elif which == 'best':
             return cluster_ids
         elif which == 'similar':
@@ -253,139 +270,6 @@ class TaskLogger(object):
         return len(self._queue) == 0 and not self._processing
 
 
-# -----------------------------------------------------------------------------
-# Cluster view and similarity view
-# -----------------------------------------------------------------------------
-
-_CLUSTER_VIEW_STYLES = '''
-table tr[data-group='good'] {
-    color: #86D16D;
-}
-
-table tr[data-group='mua'] {
-    color: #afafaf;
-}
-
-table tr[data-group='noise'] {
-    color: #777;
-}
-'''
-
-
-class ClusterView(Table):
-    """Display a table of all clusters with metrics and labels as columns. Derive from Table.
-
-    Constructor
-    -----------
-
-    parent : Qt widget
-    data : list
-        List of dictionaries mapping fields to values.
-    columns : list
-        List of columns in the table.
-    sort : 2-tuple
-        Initial sort of the table as a pair (column_name, order), where order is
-        either `asc` or `desc`.
-
-    """
-
-    _required_columns = ('n_spikes',)
-    _view_name = 'cluster_view'
-    _styles = _CLUSTER_VIEW_STYLES
-
-    def __init__(self, *args, data=None, columns=(), sort=None):
-        # NOTE: debounce select events.
-        HTMLWidget.__init__(
-            self, *args, title=self.__class__.__name__, debounce_events=('select',))
-        self._set_styles()
-        self._reset_table(data=data, columns=columns, sort=sort)
-
-    def _reset_table(self, data=None, columns=(), sort=None):
-        """Recreate the table with specified columns, data, and sort."""
-        emit(self._view_name + '_init', self)
-        # Ensure 'id' is the first column.
-        if 'id' in columns:
-            columns.remove('id')
-        columns = ['id'] + list(columns)
-        # Add required columns if needed.
-        for col in self._required_columns:
-            if col not in columns:
-                columns += [col]
-            assert col in columns
-        assert columns[0] == 'id'
-
-        # Allow to have <tr data_group="good"> etc. which allows for CSS styling.
-        value_names = columns + [{'data': ['group']}]
-        # Default sort.
-        sort = sort or ('n_spikes', 'desc')
-        self._init_table(columns=columns, value_names=value_names, data=data, sort=sort)
-
-    def _set_styles(self):
-        self.builder.add_style(self._styles)
-
-    @property
-    def state(self):
-        """Return the cluster view state, with the current sort and selection."""
-
-        b = Barrier()
-        self.get_current_sort(b('current_sort'))
-        self.get_selected(b('selected'))
-        b.wait()
-
-        current_sort = tuple(b.result('current_sort')[0][0] or (None, None))
-        selected = b.result('selected')[0][0]
-
-        return {
-            'current_sort': current_sort,
-            'selected': selected,
-        }
-
-    def set_state(self, state):
-        """Set the cluster view state, with a specified sort."""
-        sort_by, sort_dir = state.get('current_sort', (None, None))
-        if sort_by:
-            self.sort_by(sort_by, sort_dir)
-        selected = state.get('selected', [])
-        if selected:
-            self.select(selected)
-
-
-class SimilarityView(ClusterView):
-    """Display a table of clusters with metrics and labels as columns, and an additional
-    similarity column.
-
-    This view displays clusters similar to the clusters currently selected
-    in the cluster view.
-
-    Events
-    ------
-
-    * request_similar_clusters(cluster_id)
-
-    """
-
-    _required_columns = ('n_spikes', 'similarity')
-    _view_name = 'similarity_view'
-
-    def set_selected_index_offset(self, n):
-        """Set the index of the selected cluster, used for correct coloring in the similarity
-        view."""
-        self.eval_js('table._setSelectedIndexOffset(%d);' % n)
-
-    def reset(self, cluster_ids):
-        """Recreate the similarity view, given the selected clusters in the cluster view."""
-        if not len(cluster_ids):
-            return
-        similar = emit('request_similar_clusters', self, cluster_ids[-1])
-        # Clear the table.
-        if similar:
-            self.remove_all_and_add(
-                [cl for cl in similar[0] if cl['id'] not in cluster_ids])
-        else:  # pragma: no cover
-            self.remove_all()
-        return similar
-
-
 # -----------------------------------------------------------------------------
 # ActionCreator
 # -----------------------------------------------------------------------------
@@ -460,6 +344,7 @@ class ActionCreator(object):
 
     def attach(self, gui):
         """Attach the GUI and create the menus."""
+        from phy.gui.actions import Actions
         # Create the menus.
         ds = self.default_shortcuts
         dsp = self.default_snippets
@@ -567,7 +452,7 @@ class Supervisor(object):
     * `ClusterMeta` instance: change cluster metadata (e.g. group).
     * Cluster selection.
     * Many manual clustering-related actions, snippets, shortcuts, etc.
-    * Two HTML tables : `ClusterView` and `SimilarityView`.
+    * Two tables : `ClusterView` and `SimilarityView`.
 
     Constructor
     -----------
@@ -586,7 +471,8 @@ class Supervisor(object):
     sort : 2-tuple
         Initial sort as a pair `(column_name, order)` where `order` is either `asc` or `desc`
     context : Context
-        Handles the cache.
+        Handles the cache. When specified, all clustering actions are also recorded in a journal
+        in the cache directory, and the unsaved actions of a previous session are recovered.
 
     Events
     ------
@@ -602,6 +488,8 @@ class Supervisor(object):
         When the Supervisor instance is attached to the GUI.
     * `request_split()`
         When the user requests to split (typically, a lasso has been drawn before).
+        Within a `batch()` block, a single `cluster(up)` event is emitted at the end, with
+        `up.description == 'batch'`.
     * `save_clustering(spike_clusters, cluster_groups, *cluster_labels)`
         When the user wants to save the spike cluster assignments and the cluster metadata.
 
@@ -615,12 +503,15 @@ class Supervisor(object):
         self.similarity = similarity  # function cluster => [(cl, sim), ...]
         self.actions = None  # will be set when attaching the GUI
         self._is_dirty = None
+        self._is_batch = False  # whether we are in a batch() block
         self._sort = sort  # Initial sort requested in the constructor
 
         # Cluster metrics.
         # This is a dict {name: func cluster_id => value}.
         self.cluster_metrics = cluster_metrics or {}
         self.cluster_metrics['n_spikes'] = self.n_spikes
+        # Compute the metrics in batch, and cache them per cluster id across sessions.
+        self.metrics = ClusterMetrics(self.cluster_metrics)
 
         # Cluster labels.
         # This is a dict {name: {cl: value}}
@@ -632,14 +523,27 @@ class Supervisor(object):
             label for label in self.cluster_labels.keys()
             if label not in self.columns + ['group']]
 
+        # Recover the unsaved actions of a previous session from the journal.
+        self.journal = Journal(context.cache_dir) if context else None
+        recovered_meta = []
+        if self.journal:
+            saved_spike_clusters = np.asarray(spike_clusters)
+            spike_clusters, recovered_meta = self.journal.recover(saved_spike_clusters)
+            if spike_clusters is not saved_spike_clusters or recovered_meta:
+                self._is_dirty = True
+
         # Create Clustering and ClusterMeta.
-        # Load the cached spikes_per_cluster array.
-        spc = context.load('spikes_per_cluster') if context else None
+        # Load the cached spikes_per_cluster array, unless the clustering has been recovered.
+        spc = self._load_spikes_per_cluster(spike_clusters) if not self._is_dirty else None
         self.clustering = Clustering(
             spike_clusters, spikes_per_cluster=spc, new_cluster_id=new_cluster_id)
 
         # Cache the spikes_per_cluster array.
-        self._save_spikes_per_cluster()
+        if spc is None:
+            self._save_spikes_per_cluster()
+
+        # Load the cluster metrics cached with the same spike clusters assignment.
+        self._load_cluster_metrics()
 
         # Create the ClusterMeta instance.
         self.cluster_meta = create_cluster_meta(cluster_groups or {})
@@ -650,6 +554,13 @@ class Supervisor(object):
             self.cluster_meta.add_field(label)
             for cl, v in values.items():
                 self.cluster_meta.set(label, [cl], v, add_to_stack=False)
+        # Apply the recovered metadata.
+        for cluster_ids, values in recovered_meta:
+            for field, field_values in values.items():
+                for cl, v in zip(cluster_ids, field_values):
+                    self.cluster_meta.set(field, [cl], v, add_to_stack=False)
+                if field != 'group' and field not in self.columns:
+                    self.columns.append(field)
 
         # Create the GlobalHistory instance.
         self._global_history = GlobalHistory(process_ups=_process_ups)
@@ -662,7 +573,6 @@ class Supervisor(object):
         connect(self._log_action, event='cluster', sender=self.clustering)
         connect(self._log_action_meta, event='cluster', sender=self.cluster_meta)
 
-        # Raise supervisor.cluster
         @connect(sender=self.clustering)
         def on_cluster(sender, up):
             # NOTE: update the cluster meta of new clusters, depending on the values of the
@@ -671,7 +581,16 @@ class Supervisor(object):
             if up.added:
                 self.cluster_meta.set_from_descendants(
                     up.descendants, largest_old_cluster=up.largest_old_cluster)
-            emit('cluster', self, up)
+
+        # Raise supervisor.cluster
+        # NOTE: this is done after all other callbacks of the clustering's cluster event, so that
+        # the indexes updated after every action (including the actions made within a batch)
+        # are up-to-date when the views and tables are refreshed.
+        @connect(event='cluster', sender=self.clustering, last=True)
+        def on_clustering_cluster(sender, up):
+            # Within a batch, a single event is raised at the end.
+            if not self._is_batch:
+                emit('cluster', self, up)
 
         @connect(sender=self.cluster_meta)  # noqa
         def on_cluster(sender, up):  # noqa
@@ -679,16 +598,63 @@ class Supervisor(object):
 
         connect(self._save_new_cluster_id, event='cluster', sender=self)
 
+        # Record all changes in the journal, after the metadata of the new clusters is set.
+        if self.journal:
+            self.journal.rotate(self.clustering.spike_clusters)
+            connect(self._journal_action, event='cluster', sender=self.clustering)
+            connect(self._journal_action_meta, event='cluster', sender=self.cluster_meta)
+
         self._is_busy = False
 
     # Internal methods
     # -------------------------------------------------------------------------
 
+    def _load_spikes_per_cluster(self, spike_clusters):
+        """Load from the disk the dictionary with the spikes belonging to each cluster, if it
+        was saved with the same spike clusters assignment. The spike ids are memory-mapped."""
+        if not self.context:
+            return
+        path = self.context.cache_dir / 'spikes_per_cluster'
+        # Remove the cache of older versions, where the dictionary was pickled.
+        legacy_path = path.with_suffix('.pkl')
+        if legacy_path.exists():
+            logger.debug("Remove the obsolete file %s.", legacy_path)
+            legacy_path.unlink()
+        meta = self.context.load('spikes_per_cluster/meta')
+        if meta.get('checksum', None) != [len(spike_clusters), _checksum(spike_clusters)]:
+            return
+        try:
+            return _spikes_per_cluster_from_csr(*(
+                read_array(path / (name + '.npy'), mmap_mode='r')
+                for name in ('cluster_ids', 'offsets', 'spike_ids')))
+        except (OSError, ValueError) as e:  # pragma: no cover
+            logger.debug("Could not load the spikes_per_cluster cache: %s.", e)
+
     def _save_spikes_per_cluster(self):
-        """Cache on the disk the dictionary with the spikes belonging to each cluster."""
+        """Cache on the disk the dictionary with the spikes belonging to each cluster, in a
+        compressed sparse row format."""
         if not self.context:
             return
-        self.context.save('spikes_per_cluster', self.clustering.spikes_per_cluster, kind='pickle')
+        path = self.context.cache_dir / 'spikes_per_cluster'
+        spike_clusters = self.clustering.spike_clusters
+        checksum = [len(spike_clusters), _checksum(spike_clusters)]
+        meta_path = path / 'meta.json'
+        if self.context.load('spikes_per_cluster/meta').get('checksum', None) == checksum:
+            return
+        if meta_path.exists():
+            meta_path.unlink()
+        arrays = _spikes_per_cluster_to_csr(self.clustering.spikes_per_cluster)
+        path.mkdir(exist_ok=True)
+        try:
+            for name, arr in zip(('cluster_ids', 'offsets', 'spike_ids'), arrays):
+                # NOTE: the previous file may still be memory-mapped, so it is replaced instead
+                # of being overwritten.
+                write_array(path / (name + '.tmp.npy'), arr)
+                os.replace(str(path / (name + '.tmp.npy')), str(path / (name + '.npy')))
+        except OSError as e:  # pragma: no cover
+            logger.debug("Could not save the spikes_per_cluster cache: %s.", e)
+            return
+        self.context.save('spikes_per_cluster/meta', {'checksum': checksum})
 
     def _log_action(self, sender, up):
         """Log the clustering action (merge, split)."""
@@ -716,6 +682,74 @@ class Supervisor(object):
         if up.description != 'metadata_group':
             return
 
+    def _journal_action(self, sender, up):
+        """Record a clustering action (merge, split, undo, redo) in the journal."""
+        if sender != self.clustering:
+            return
+        spike_clusters = up.get('spike_clusters')
+        if spike_clusters is None:
+            # In a merge, all spikes are assigned to the single new cluster.
+            spike_clusters = np.repeat(up.added, len(up.spike_ids))
+        self.journal.add_assign(up.spike_ids, spike_clusters)
+        # Also record the metadata inherited by the new clusters.
+        if up.added:
+            self._journal_meta(up.added)
+
+    def _journal_action_meta(self, sender, up):
+        """Record a cluster meta action (move, label, undo, redo) in the journal."""
+        if sender != self.cluster_meta:
+            return
+        self._journal_meta(up.metadata_changed)
+
+    def _journal_meta(self, cluster_ids):
+        """Record the current metadata of some clusters in the journal."""
+        cluster_ids = list(cluster_ids)
+        self.journal.add_meta(cluster_ids, {
+            field: self.cluster_meta.get(field, cluster_ids)
+            for field in self.cluster_meta.fields})
+
+    def _cluster_metrics_meta(self):
+        """Return the spike clusters checksum and the hashes of the metric functions on which
+        the cached cluster metrics depend."""
+        spike_clusters = self.clustering.spike_clusters
+        return {
+            'checksum': [len(spike_clusters), _checksum(spike_clusters)],
+            'functions': {
+                name: hashlib.sha1(_function_key(getattr(f, 'batch', f)).encode()).hexdigest()
+                for name, f in self.cluster_metrics.items() if name != 'n_spikes'},
+        }
+
+    def _load_cluster_metrics(self):
+        """Load the cached cluster metrics, if they were saved with the same spike clusters
+        assignment. The metrics whose function has changed are discarded."""
+        if not self.context:
+            return
+        cached = self.context.load('cluster_metrics')
+        meta = self._cluster_metrics_meta()
+        if cached.get('checksum', None) != meta['checksum']:
+            if cached:
+                logger.debug("Discard the cluster metrics cache of another spike clustering.")
+            return
+        functions = cached.get('functions', {})
+        self.metrics.from_dict({
+            name: values for name, values in cached.get('values', {}).items()
+            if name in meta['functions'] and functions.get(name, None) == meta['functions'][name]})
+        # The number of spikes is not cached, it is fast to compute.
+        self.metrics.from_dict({'n_spikes': {
+            c: self.n_spikes(c) for c in self.clustering.cluster_ids.tolist()}})
+
+    def _save_cluster_metrics(self):
+        """Cache on the disk the metrics of the existing clusters, except the number of spikes,
+        together with the spike clusters assignment checksum and the hashes of the metric
+        functions."""
+        if not self.context:
+            return
+        meta = self._cluster_metrics_meta()
+        values = self.metrics.to_dict(self.clustering.cluster_ids.tolist())
+        meta['values'] = {
+            name: vals for name, vals in values.items() if name in meta['functions']}
+        self.context.save('cluster_metrics', meta, kind='pickle')
+
     def _save_new_cluster_id(self, sender, up):
         """Save the new cluster id on disk, knowing that cluster ids are unique for
         easier cache consistency."""
@@ -740,10 +774,15 @@ class Supervisor(object):
 
     def get_cluster_info(self, cluster_id, exclude=()):
         """Return the data associated to a given cluster."""
+        return self._get_cluster_info(cluster_id, exclude=exclude)
+
+    def _get_cluster_info(self, cluster_id, exclude=(), compute=True):
         out = {'id': cluster_id}
-        # Cluster metrics.
-        for key, func in self.cluster_metrics.items():
-            out[key] = func(cluster_id)
+        # Cluster metrics. If compute is False, the metrics not computed yet are None.
+        for key in self.cluster_metrics:
+            out[key] = (
+                self.metrics.get(key, cluster_id) if compute else
+                self.metrics.get_cached(key, cluster_id))
         # Cluster meta.
         for key in self.cluster_meta.fields:
             # includes group
@@ -754,11 +793,26 @@ class Supervisor(object):
     def _create_views(self, gui=None, sort=None):
         """Create the cluster view and similarity view."""
 
+        from .tables import ClusterView, SimilarityView
         sort = sort or self._sort  # comes from either the GUI state or constructor
 
+        # The cluster metrics that are not cached yet are computed in the background once the
+        # cluster view is loaded.
+        cluster_ids = self.clustering.cluster_ids.tolist()
+        missing = self.metrics.missing(cluster_ids)
+        if missing and getattr(gui, '_enable_threading', True):
+            data = [self._get_cluster_info(c, compute=False) for c in cluster_ids]
+        else:
+            missing = []
+            data = self.cluster_info
+
         # Create the cluster view.
-        self.cluster_view = ClusterView(
-            gui, data=self.cluster_info, columns=self.columns, sort=sort)
+        self.cluster_view = ClusterView(gui, data=data, columns=self.columns, sort=sort)
+        if missing:
+            @connect(sender=self.cluster_view)
+            def on_ready(sender):
+                unconnect(on_ready)
+                self._fill_cluster_view(missing)
         # Update the action flow and similarity view when selection changes.
         connect(self._clusters_selected, event='select', sender=self.cluster_view)
 
@@ -773,33 +827,51 @@ class Supervisor(object):
         # Change the state after every clustering action, according to the action flow.
         connect(self._after_action, event='cluster', sender=self)
 
+    def _fill_cluster_view(self, cluster_ids, chunk_size=100):
+        """Compute the missing metrics of some clusters in the background, and update the
+        cluster view progressively, one chunk of clusters at a time."""
+        from phy.gui.qt import Worker, thread_pool
+        chunks = [cluster_ids[i:i + chunk_size] for i in range(0, len(cluster_ids), chunk_size)]
+
+        def _next_chunk():
+            if not chunks:
+                logger.debug("The metrics of %d clusters have been computed.", len(cluster_ids))
+                return
+            chunk = chunks.pop(0)
+            worker = Worker(self.metrics.compute, chunk)
+
+            @worker.signals.finished.connect
+            def finished():
+                # Skip the clusters that have been deleted in the meantime.
+                spc = self.clustering.spikes_per_cluster
+                self.cluster_view.change([self.get_cluster_info(c) for c in chunk if c in spc])
+                _next_chunk()
+
+            thread_pool().start(worker)
+
+        _next_chunk()
+
     def _reset_cluster_view(self):
         """Recreate the cluster view."""
         logger.debug("Reset the cluster view.")
         self.cluster_view._reset_table(
             data=self.cluster_info, columns=self.columns, sort=self._sort)
 
-    def _clusters_added(self, cluster_ids):
-        """Update the cluster and similarity views when new clusters are created."""
-        logger.log(5, "Clusters added: %s", cluster_ids)
-        data = [self.get_cluster_info(cluster_id) for cluster_id in cluster_ids]
-        self.cluster_view.add(data)
-        self.similarity_view.add(data)
-
-    def _clusters_removed(self, cluster_ids):
-        """Update the cluster and similarity views when clusters are removed."""
-        logger.log(5, "Clusters removed: %s", cluster_ids)
-        self.cluster_view.remove(cluster_ids)
-        self.similarity_view.remove(cluster_ids)
-
-    def _cluster_metadata_changed(self, field, cluster_ids, value):
-        """Update the cluster and similarity views when clusters metadata is updated."""
+    def _update_views(self, added=(), removed=(), changed=()):
+        """Update the cluster and similarity views with the added clusters, the removed
+        clusters, and the changed fields of existing clusters, in a single update per view."""
+        logger.log(5, "Clusters added: %s, removed: %s", added, removed)
+        added = [self.get_cluster_info(cluster_id) for cluster_id in added]
+        for view in (self.cluster_view, self.similarity_view):
+            view.apply_changes(added=added, removed=removed, changed=changed)
+
+    def _metadata_changed(self, field, cluster_ids, value):
+        """Return the changed fields of the clusters whose metadata is updated."""
         logger.log(5, "%s changed for %s to %s", field, cluster_ids, value)
-        data = [{'id': cluster_id, field: value} for cluster_id in cluster_ids]
-        for _ in data:
-            _['is_masked'] = _is_group_masked(_.get('group', None))
-        self.cluster_view.change(data)
-        self.similarity_view.change(data)
+        return [
+            {'id': cluster_id, field: value, 'is_masked': _is_group_masked(value)}
+            if field == 'group' else {'id': cluster_id, field: value}
+            for cluster_id in cluster_ids]
 
     def _clusters_selected(self, sender, obj, **kwargs):
         """When clusters are selected in the cluster view, register the action in the history
@@ -845,6 +917,7 @@ class Supervisor(object):
         # The GUI should not be busy when calling a new action.
         if 'select' not in name and self._is_busy:
             logger.log(5, "The GUI is busy, waiting before calling the action.")
+            from phy.gui.qt import _block
             try:
                 _block(lambda: not self._is_busy)
             except Exception:
@@ -859,11 +932,15 @@ class Supervisor(object):
         """Called after an action: update the cluster and similarity views and update
         the selection."""
         # This is called once the action has completed. We update the tables.
+        if up.description == 'batch':
+            # The metadata of the existing clusters may have changed for several fields.
+            clusters = set(self.clustering.cluster_ids) - set(up.added)
+            changed = [self.get_cluster_info(c) for c in up.metadata_changed if c in clusters]
+        else:
+            changed = self._metadata_changed(
+                up.description.replace('metadata_', ''), up.metadata_changed, up.metadata_value)
         # Update the views with the old and new clusters.
-        self._clusters_added(up.added)
-        self._clusters_removed(up.deleted)
-        self._cluster_metadata_changed(
-            up.description.replace('metadata_', ''), up.metadata_changed, up.metadata_value)
+        self._update_views(added=up.added, removed=up.deleted, changed=changed)
         # After the action has finished, we process the pending actions,
         # like selection of new clusters in the tables.
         self.task_logger.process()
@@ -875,6 +952,7 @@ class Supervisor(object):
         self._is_busy = busy
         # Set the busy cursor.
         logger.log(5, "GUI is %sbusy" % ('' if busy else 'not '))
+        from phy.gui.qt import set_busy
         set_busy(busy)
         # Let the cluster views know that the GUI is busy.
         self.cluster_view.set_busy(busy)
@@ -906,7 +984,7 @@ class Supervisor(object):
         self.cluster_view.sort_by(column, sort_dir=sort_dir)
 
     def filter(self, text):
-        """Filter the clusters using a Javascript expression on the column names."""
+        """Filter the clusters using a boolean expression on the column names."""
         self.cluster_view.filter(text)
 
     def clear_filter(self):
@@ -918,11 +996,14 @@ class Supervisor(object):
     @property
     def cluster_info(self):
         """The cluster view table as a list of per-cluster dictionaries."""
-        return [self.get_cluster_info(cluster_id) for cluster_id in self.clustering.cluster_ids]
+        cluster_ids = self.clustering.cluster_ids.tolist()
+        self.metrics.compute(cluster_ids)
+        return [self.get_cluster_info(cluster_id) for cluster_id in cluster_ids]
 
     @property
     def shown_cluster_ids(self):
         """The sorted list of cluster ids as they are currently shown in the cluster view."""
+        from phy.gui.widgets import Barrier
         b = Barrier()
         self.cluster_view.get_ids(callback=b(1))
         b.wait()
@@ -983,6 +1064,7 @@ class Supervisor(object):
         @connect(sender=gui)
         def on_close(e):
             unconnect(on_is_busy, self)
+            self._save_cluster_metrics()
 
         @connect(sender=self.cluster_view)
         def on_ready(sender):
@@ -1006,7 +1088,7 @@ class Supervisor(object):
     @property
     def selected(self):
         """Selected clusters in the cluster and similarity views."""
-        return _uniq(self.selected_clusters + self.selected_similar)
+        return _uniq([int(c) for c in self.selected_clusters + self.selected_similar])
 
     def n_spikes(self, cluster_id):
         """Number of spikes in a given cluster."""
@@ -1022,7 +1104,8 @@ class Supervisor(object):
         if len(cluster_ids or []) <= 1:
             return
         out = self.clustering.merge(cluster_ids, to=to)
-        self._global_history.action(self.clustering)
+        if not self._is_batch:
+            self._global_history.action(self.clustering)
         return out
 
     def split(self, spike_ids=None, spike_clusters_rel=0):
@@ -1039,7 +1122,8 @@ class Supervisor(object):
             return
         out = self.clustering.split(
             spike_ids, spike_clusters_rel=spike_clusters_rel)
-        self._global_history.action(self.clustering)
+        if not self._is_batch:
+            self._global_history.action(self.clustering)
         return out
 
     # Move actions
@@ -1052,8 +1136,8 @@ class Supervisor(object):
 
     def get_labels(self, field):
         """Return the labels of all clusters, for a given label name."""
-        return {c: self.cluster_meta.get(field, c)
-                for c in self.clustering.cluster_ids}
+        cluster_ids = self.clustering.cluster_ids
+        return dict(zip(cluster_ids.tolist(), self.cluster_meta.get(field, cluster_ids)))
 
     def label(self, name, value, cluster_ids=None):
         """Assign a label to some clusters."""
@@ -1064,12 +1148,15 @@ class Supervisor(object):
         if len(cluster_ids) == 0:
             return
         self.cluster_meta.set(name, cluster_ids, value)
-        self._global_history.action(self.cluster_meta)
+        if not self._is_batch:
+            self._global_history.action(self.cluster_meta)
         # Add column if needed.
         if name != 'group' and name not in self.columns:
             logger.debug("Add column %s.", name)
             self.columns.append(name)
-            self._reset_cluster_view()
+            # The cluster view only exists when the supervisor is attached to a GUI.
+            if getattr(self, 'cluster_view', None) is not None:
+                self._reset_cluster_view()
 
     def move(self, group, which):
         """Assign a cluster group to some clusters."""
@@ -1091,8 +1178,7 @@ class Supervisor(object):
     # Wizard actions
     # -------------------------------------------------------------------------
 
-    # There are callbacks because these functions call Javascript functions that return
-    # asynchronously in Qt5.
+    # The callback functions are called with the new selection.
 
     def reset_wizard(self, callback=None):
         """Reset the wizard."""
@@ -1137,6 +1223,54 @@ class Supervisor(object):
         """Return whether there are any pending changes."""
         return self._is_dirty if self._is_dirty in (False, True) else len(self._global_history) > 1
 
+    @contextmanager
+    def batch(self):
+        """Context manager to make many clustering actions (merge, split, label, move) at once.
+
+        All actions made inside the block are recorded as a single undoable action, and a single
+        `cluster` event is raised at the end, with the combined `UpdateInfo`. This avoids
+        refreshing the tables and views after every action, for example in scripts or plugins.
+
+        Example
+        -------
+
+        ```python
+        with supervisor.batch():
+            for cluster_ids in pairs:
+                supervisor.merge(cluster_ids)
+        ```
+
+        """
+        if self._is_batch:
+            yield
+            return
+        self._is_batch = True
+        bc = bm = None
+        try:
+            with self.clustering.batch() as bc, self.cluster_meta.batch() as bm:
+                yield
+        finally:
+            self._is_batch = False
+            # NOTE: the actions made before a possible exception are kept, and notified.
+            self._finish_batch(bc, bm)
+
+    def _finish_batch(self, bc, bm):
+        """Register a single action in the global history, and raise a single cluster event
+        with the combined clustering and cluster meta changes."""
+        up_c, up_m = (bc.up if bc else None), (bm.up if bm else None)
+        controllers = [c for c, up in ((self.clustering, up_c), (self.cluster_meta, up_m)) if up]
+        if not controllers:
+            return
+        self._global_history.action(*controllers)
+        # The metadata changes of a batch do not raise individual events.
+        if up_m and self.journal:
+            self._journal_meta(up_m.metadata_changed)
+        up = up_c or up_m
+        if up_c and up_m:
+            up.metadata_changed = up_m.metadata_changed
+            up.metadata_value = up_m.metadata_value
+        emit('cluster', self, up)
+
     def undo(self):
         """Undo the last action."""
         self._global_history.undo()
@@ -1151,18 +1285,22 @@ class Supervisor(object):
         This method emits the `save_clustering(spike_clusters, groups, *labels)` event.
         It is up to the caller to react to this event and save the data to disk.
 
+        The journal of the clustering actions is restarted on top of the saved state, while the
+        previous journal files are kept until the next session, in case the saving is interrupted.
+
         """
         spike_clusters = self.clustering.spike_clusters
-        groups = {
-            c: self.cluster_meta.get('group', c) or 'unsorted'
-            for c in self.clustering.cluster_ids}
+        groups = {c: g or 'unsorted' for c, g in self.get_labels('group').items()}
         # List of tuples (field_name, dictionary).
         labels = [
             (field, self.get_labels(field)) for field in self.cluster_meta.fields
             if field not in ('next_cluster')]
+        if self.journal:
+            self.journal.rotate(spike_clusters)
         emit('save_clustering', self, spike_clusters, groups, *labels)
-        # Cache the spikes_per_cluster array.
+        # Cache the spikes_per_cluster array and the cluster metrics.
         self._save_spikes_per_cluster()
+        self._save_cluster_metrics()
         self._is_dirty = False
 
     def block(self):
@@ -1171,6 +1309,15 @@ class Supervisor(object):
         Only used in the automated testing suite.
 
         """
+        from phy.gui.qt import _block, _wait
         _block(lambda: self.task_logger.has_finished() and not self._is_busy)
         assert not self._is_busy
         _wait(50)
+
+
+def __getattr__(name):
+    # The tables depend on Qt, they are only imported when they are first used.
+    if name in ('ClusterView', 'SimilarityView'):
+        from . import tables
+        return getattr(tables, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""Cluster view and similarity view, the tables of the manual clustering GUI."""
+
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+from phylib.utils import emit
+from phy.gui.qt import QWidget
+from phy.gui.widgets import Table, Barrier
+
+
+# -----------------------------------------------------------------------------
+# Cluster view and similarity view
+# -----------------------------------------------------------------------------
+
+class ClusterView(Table):
+    """Display a table of all clusters with metrics and labels as columns. Derive from Table.
+
+    Constructor
+    -----------
+
+    parent : Qt widget
+    data : list
+        List of dictionaries mapping fields to values.
+    columns : list
+        List of columns in the table.
+    sort : 2-tuple
+        Initial sort of the table as a pair (column_name, order), where order is
+        either `asc` or `desc`.
+
+    """
+
+    _required_columns = ('n_spikes',)
+    _view_name = 'cluster_view'
+    # Text color of the rows depending on the cluster group.
+    _group_colors = {
+        'good': '#86D16D',
+        'mua': '#afafaf',
+        'noise': '#777',
+    }
+
+    def __init__(self, *args, data=None, columns=(), sort=None):
+        QWidget.__init__(self, *args)
+        # NOTE: debounce select events.
+        self._init_widget(title=self.__class__.__name__, debounce_events=('select',))
+        self._reset_table(data=data, columns=columns, sort=sort)
+
+    def _reset_table(self, data=None, columns=(), sort=None):
+        """Recreate the table with specified columns, data, and sort."""
+        emit(self._view_name + '_init', self)
+        # Ensure 'id' is the first column.
+        if 'id' in columns:
+            columns.remove('id')
+        columns = ['id'] + list(columns)
+        # Add required columns if needed.
+        for col in self._required_columns:
+            if col not in columns:
+                columns += [col]
+            assert col in columns
+        assert columns[0] == 'id'
+
+        # Default sort.
+        sort = sort or ('n_spikes', 'desc')
+        self._init_table(columns=columns, data=data, sort=sort)
+
+    def _row_color(self, row):
+        """Text color of the rows depending on the cluster group."""
+        return self._group_colors.get(row.get('group', None), None) or super(
+            ClusterView, self)._row_color(row)
+
+    @property
+    def state(self):
+        """Return the cluster view state, with the current sort and selection."""
+
+        b = Barrier()
+        self.get_current_sort(b('current_sort'))
+        self.get_selected(b('selected'))
+        b.wait()
+
+        current_sort = tuple(b.result('current_sort')[0][0] or (None, None))
+        selected = b.result('selected')[0][0]
+
+        return {
+            'current_sort': current_sort,
+            'selected': selected,
+        }
+
+    def set_state(self, state):
+        """Set the cluster view state, with a specified sort."""
+        sort_by, sort_dir = state.get('current_sort', (None, None))
+        if sort_by:
+            self.sort_by(sort_by, sort_dir)
+        selected = state.get('selected', [])
+        if selected:
+            self.select(selected)
+
+
+class SimilarityView(ClusterView):
+    """Display a table of clusters with metrics and labels as columns, and an additional
+    similarity column.
+
+    This view displays clusters similar to the clusters currently selected
+    in the cluster view.
+
+    Events
+    ------
+
+    * request_similar_clusters(cluster_id)
+
+    """
+
+    _required_columns = ('n_spikes', 'similarity')
+    _view_name = 'similarity_view'
+
+    def reset(self, cluster_ids):
+        """Recreate the similarity view, given the selected clusters in the cluster view."""
+        if not len(cluster_ids):
+            return
+        similar = emit('request_similar_clusters', self, cluster_ids[-1])
+        # Clear the table.
+        if similar:
+            self.remove_all_and_add(
+                [cl for cl in similar[0] if cl['id'] not in cluster_ids])
+        else:  # pragma: no cover
+            self.remove_all()
+        return similar
@@ -8,14 +8,19 @@
 
 import numpy as np
 from numpy.testing import assert_array_equal as ae
-from pytest import raises
+from pytest import raises, mark
 
 from phylib.io.mock import artificial_spike_clusters
-from phylib.io.array import (_spikes_in_clusters,)
+from phylib.io.array import _spikes_in_clusters, _spikes_per_cluster
 from phylib.utils import connect
+from phy.utils.profiling import benchmark
 from ..clustering import (_extend_spikes,
                           _concatenate_spike_clusters,
                           _extend_assignment,
+                          _pack_spike_clusters,
+                          _unpack_spike_clusters,
+                          _spikes_per_cluster_to_csr,
+                          _spikes_per_cluster_from_csr,
                           Clustering)
 
 
@@ -101,6 +106,36 @@ def test_extend_assignment():
     ae(new_cluster_ids, [10, 11, 12])
 
 
+def test_pack_spike_clusters():
+    clusters, indices = _pack_spike_clusters([7, 7, 7])
+    ae(clusters, [7])
+    assert indices is None
+    ae(_unpack_spike_clusters((clusters, indices), 3), [7, 7, 7])
+
+    spike_clusters = np.random.randint(size=1000, low=10, high=1010)
+    clusters, indices = _pack_spike_clusters(spike_clusters)
+    assert indices.dtype == np.uint16
+    ae(_unpack_spike_clusters((clusters, indices), 1000), spike_clusters)
+
+
+def test_spikes_per_cluster_csr():
+    cluster_ids, offsets, spike_ids = _spikes_per_cluster_to_csr({})
+    assert _spikes_per_cluster_from_csr(cluster_ids, offsets, spike_ids) == {}
+
+    spike_clusters = np.random.randint(size=1000, low=10, high=100)
+    spc = _spikes_per_cluster(spike_clusters)
+    cluster_ids, offsets, spike_ids = _spikes_per_cluster_to_csr(spc)
+    ae(cluster_ids, np.unique(spike_clusters))
+    assert len(offsets) == len(cluster_ids) + 1
+    ae(np.sort(spike_ids), np.arange(1000))
+
+    spc_ = _spikes_per_cluster_from_csr(cluster_ids, offsets, spike_ids)
+    assert sorted(spc_) == sorted(spc)
+    for clu, spikes in spc.items():
+        ae(spc_[clu], spikes)
+        assert spc_[clu].base is spike_ids
+
+
 #------------------------------------------------------------------------------
 # Test clustering
 #------------------------------------------------------------------------------
@@ -447,7 +482,7 @@ def test_clustering_long():
     spike_clusters_new = spike_clusters.copy()
     spike_clusters_new[:10] = 100
     clustering.spike_clusters[:] = spike_clusters_new[:]
-    # Need to update explicitely.
+    # Need to update explicitly.
     clustering._new_cluster_id = 101
     clustering._update_cluster_ids()
     ae(clustering.cluster_ids, np.r_[np.arange(n_clusters), 100])
@@ -476,6 +511,8 @@ def test_clustering_long():
     # Merge to a given cluster.
     clustering.spike_clusters[:] = spike_clusters_base[:]
     clustering._new_cluster_id = 11
+    # Need to update the spikes per cluster index explicitly.
+    clustering._update_cluster_ids()
 
     my_spikes_0 = np.nonzero(np.in1d(clustering.spike_clusters, [4, 6]))[0]
     info = clustering.merge([4, 6], 11)
@@ -494,3 +531,186 @@ def test_clustering_long():
     clustering.assign(my_spikes, clusters)
     clu = clustering.spike_clusters[my_spikes]
     ae(clu - clu[0], clusters)
+
+
+def _assert_spikes_per_cluster(clustering):
+    spc = _spikes_per_cluster(clustering.spike_clusters)
+    ae(clustering.cluster_ids, sorted(spc))
+    assert sorted(clustering.spikes_per_cluster) == sorted(spc)
+    for clu, spikes in spc.items():
+        ae(clustering.spikes_per_cluster[clu], spikes)
+
+
+def test_clustering_spikes_per_cluster_index():
+    n_spikes = 1000
+    n_clusters = 10
+    spike_clusters = artificial_spike_clusters(n_spikes, n_clusters)
+
+    # Inconsistent spikes_per_cluster dictionaries are ignored.
+    clustering = Clustering(spike_clusters.copy(), spikes_per_cluster={0: [0, 1]})
+    _assert_spikes_per_cluster(clustering)
+
+    clustering.merge([0, 1])
+    _assert_spikes_per_cluster(clustering)
+
+    clustering.split(np.arange(0, n_spikes, 7))
+    _assert_spikes_per_cluster(clustering)
+
+    clustering.assign(np.arange(100, 200), np.arange(100) % 3)
+    _assert_spikes_per_cluster(clustering)
+
+    for _ in range(3):
+        clustering.undo()
+        _assert_spikes_per_cluster(clustering)
+
+    for _ in range(3):
+        clustering.redo()
+        _assert_spikes_per_cluster(clustering)
+
+    clustering.reset()
+    _assert_spikes_per_cluster(clustering)
+    ae(clustering.spike_clusters, spike_clusters)
+
+
+def test_clustering_spike_order():
+    spike_clusters = np.random.randint(size=1000, low=0, high=10)
+    clustering = Clustering(spike_clusters)
+    spc = clustering.spikes_per_cluster
+
+    order = clustering.spike_order(0)
+    ae(np.sort(order), spc[0])
+    assert np.any(order != spc[0])
+    assert clustering.spike_order(0) is order
+    assert len(clustering.spike_order(100)) == 0
+
+    # The order of the merged cluster is the merge of the orders of its parents.
+    clustering.spike_order(1)
+    up = clustering.merge([0, 1])
+    merged = clustering._spike_orders[up.added[0]]
+    ae(np.sort(merged), spc[up.added[0]])
+    ae(merged[np.isin(merged, order)], order)
+
+    # The order does not depend on the history of the cluster.
+    clustering.split(spc[2][::2])
+    for clu in clustering.cluster_ids:
+        ae(clustering.spike_order(clu), Clustering(
+            clustering.spike_clusters.copy()).spike_order(clu))
+
+
+@mark.benchmark
+def test_clustering_merge_benchmark():
+    n_spikes = 2_000_000
+    n_clusters = 1000
+    spike_clusters = artificial_spike_clusters(n_spikes, n_clusters)
+    clustering = Clustering(spike_clusters)
+
+    # Merging small clusters should only cost O(n_affected_spikes), not O(n_spikes).
+    with benchmark("Merge", repeats=100):
+        for i in range(0, 200, 2):
+            clustering.merge([i, i + 1])
+    with benchmark("Split", repeats=10):
+        for i in range(200, 210):
+            clustering.split(clustering.spikes_per_cluster[i][:5])
+    with benchmark("Undo", repeats=10):
+        for i in range(10):
+            clustering.undo()
+    with benchmark("Redo", repeats=10):
+        for i in range(10):
+            clustering.redo()
+    assert clustering.n_clusters == n_clusters - 100 + 10
+
+
+def test_clustering_undo_long():
+    n_spikes = 1000
+    n_clusters = 10
+    spike_clusters = artificial_spike_clusters(n_spikes, n_clusters)
+    clustering = Clustering(spike_clusters.copy())
+
+    checkpoints = [clustering.spike_clusters.copy()]
+    ups = []
+    for i in range(20):
+        if i % 2 == 0:
+            up = clustering.merge(clustering.cluster_ids[:2])
+        else:
+            up = clustering.split(np.unique(np.random.randint(size=10, low=0, high=n_spikes)))
+        ups.append(up)
+        checkpoints.append(clustering.spike_clusters.copy())
+
+    # Undo everything, only using the deltas stored in the history.
+    for i in range(19, -1, -1):
+        up = clustering.undo()
+        assert up.history == 'undo'
+        assert up.added == ups[i].deleted
+        assert up.deleted == ups[i].added
+        ae(clustering.spike_clusters, checkpoints[i])
+        _assert_spikes_per_cluster(clustering)
+    assert clustering.undo() is None
+    ae(clustering.spike_clusters, spike_clusters)
+
+    # Redo everything.
+    for i in range(20):
+        up = clustering.redo()
+        assert up.history == 'redo'
+        assert up.added == ups[i].added
+        ae(clustering.spike_clusters, checkpoints[i + 1])
+    assert clustering.redo() is None
+
+
+@mark.benchmark
+def test_clustering_merge_large_benchmark():
+    n_spikes = 4_000_000
+    spike_clusters = np.repeat([0, 1], n_spikes // 2)
+    clustering = Clustering(spike_clusters)
+
+    # The UpdateInfo should not convert the spike ids to Python objects.
+    with benchmark("Merge of two 2M-spike clusters"):
+        up = clustering.merge([0, 1])
+    assert isinstance(up.spike_ids, np.ndarray)
+    assert len(up.spike_ids) == n_spikes
+    with benchmark("Undo of the merge"):
+        up = clustering.undo()
+    assert up.added == [0, 1]
+
+
+def test_clustering_batch():
+    spike_clusters = np.array([2, 5, 3, 2, 7, 5, 2])
+    clustering = Clustering(spike_clusters.copy())
+
+    _l = []
+
+    @connect(sender=clustering)
+    def on_request_undo_state(sender, up):
+        _l.append(up)
+        return 'hello'
+
+    with clustering.batch() as batch:
+        clustering.merge([2, 3])  # 8
+        clustering.merge([8, 5])  # 9
+        clustering.split([4])  # 7 => 10
+    ae(clustering.spike_clusters, [9, 9, 9, 9, 10, 9, 9])
+    _assert_spikes_per_cluster(clustering)
+
+    # The net change of the batch.
+    up = batch.up
+    assert up.description == 'batch'
+    assert up.deleted == [2, 3, 5, 7]
+    assert up.added == [9, 10]
+    assert set(up.descendants) == set([(2, 9), (3, 9), (5, 9), (7, 10)])
+    # The undo state is only requested once.
+    assert _l == [up]
+
+    # A single undo reverts the whole batch.
+    up = clustering.undo()
+    assert up.undo_state == ['hello']
+    ae(clustering.spike_clusters, spike_clusters)
+    _assert_spikes_per_cluster(clustering)
+    assert clustering.undo() is None
+
+    up = clustering.redo()
+    assert up.added == [9, 10]
+    ae(clustering.spike_clusters, [9, 9, 9, 9, 10, 9, 9])
+
+    # Empty batch.
+    with clustering.batch() as batch:
+        pass
+    assert batch.up is None
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the pairwise correlograms."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import numpy as np
+from numpy.testing import assert_array_equal as ae
+from pytest import mark
+
+from phylib.stats import correlograms, firing_rate
+from phylib.utils import connect
+from phy.utils.profiling import benchmark
+from .. import _correlograms
+from ..clustering import Clustering
+from .._correlograms import PairwiseCorrelograms, sweep_correlograms
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+SAMPLE_RATE = 10000.
+BIN_SIZE = .001
+WINDOW_SIZE = .05
+
+
+def _create_store(n_spikes=5000, n_clusters=10, duration=10.):
+    rng = np.random.RandomState(0)
+    spike_times = np.sort(rng.randint(0, int(duration * SAMPLE_RATE), n_spikes)) / SAMPLE_RATE
+    clustering = Clustering(rng.randint(0, n_clusters, n_spikes))
+
+    def get_spike_ids(cluster_id, n):
+        return clustering.spike_order(cluster_id)[:n]
+
+    store = PairwiseCorrelograms(
+        spike_times, get_spike_ids, sample_rate=SAMPLE_RATE, duration=duration)
+    connect(lambda sender, up: store.update(up), event='cluster', sender=clustering)
+    _calls = []
+    _compute = store._compute
+
+    def compute(cluster_ids, params):
+        _calls.append(cluster_ids)
+        return _compute(cluster_ids, params)
+    store._compute = compute
+    return clustering, spike_times, store, _calls
+
+
+def _expected(clustering, spike_times, cluster_ids, spike_ids=None):
+    """Correlograms computed directly on a set of spikes."""
+    if spike_ids is None:
+        spike_ids = clustering.spikes_in_clusters(cluster_ids)
+    sc = clustering.spike_clusters[spike_ids]
+    return correlograms(
+        spike_times[spike_ids], sc, cluster_ids=cluster_ids, sample_rate=SAMPLE_RATE,
+        bin_size=BIN_SIZE, window_size=WINDOW_SIZE)
+
+
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+
+def _random_spikes(n_spikes, n_clusters, duration):
+    rng = np.random.RandomState(0)
+    spike_times = np.sort(rng.randint(0, int(duration * SAMPLE_RATE), n_spikes)) / SAMPLE_RATE
+    return spike_times, rng.randint(0, n_clusters, n_spikes)
+
+
+def test_sweep_correlograms(monkeypatch):
+    spike_times, spike_clusters = _random_spikes(20000, 5, 10.)
+    kwargs = dict(sample_rate=SAMPLE_RATE, bin_size=BIN_SIZE, window_size=WINDOW_SIZE)
+    for symmetrize in (True, False):
+        expected = correlograms(spike_times, spike_clusters, symmetrize=symmetrize, **kwargs)
+        for n_threads in (1, 3):
+            ccg = sweep_correlograms(
+                spike_times, spike_clusters, symmetrize=symmetrize, n_threads=n_threads,
+                **kwargs)
+            ae(ccg, expected)
+
+    # Blocks smaller than the window.
+    monkeypatch.setattr(_correlograms, '_SWEEP_BLOCK_SIZE', 7)
+    ae(sweep_correlograms(spike_times, spike_clusters, n_threads=2, **kwargs),
+       correlograms(spike_times, spike_clusters, **kwargs))
+    monkeypatch.undo()
+
+    # Subset of the clusters, in a different order.
+    spike_ids = np.nonzero(np.isin(spike_clusters, [3, 1]))[0]
+    ae(sweep_correlograms(
+        spike_times[spike_ids], spike_clusters[spike_ids], cluster_ids=[3, 1], **kwargs),
+       correlograms(
+        spike_times[spike_ids], spike_clusters[spike_ids], cluster_ids=[3, 1], **kwargs))
+
+    # Spikes at the same time, and no spike.
+    ae(sweep_correlograms([0., 0., .0015], [0, 1, 0], **kwargs),
+       correlograms(np.array([0., 0., .0015]), np.array([0, 1, 0]), **kwargs))
+    assert sweep_correlograms([], [], cluster_ids=[0], **kwargs).shape == (1, 1, 51)
+
+
+@mark.benchmark
+def test_sweep_correlograms_benchmark():
+    kwargs = dict(sample_rate=SAMPLE_RATE, bin_size=BIN_SIZE, window_size=WINDOW_SIZE)
+    for n_spikes in (1000000, 10000000):
+        spike_times, spike_clusters = _random_spikes(n_spikes, 10, n_spikes / 1000.)
+        with benchmark("phylib correlograms with %d spikes" % n_spikes, repeats=1):
+            expected = correlograms(spike_times, spike_clusters, **kwargs)
+        with benchmark("Sorted-sweep correlograms with %d spikes" % n_spikes, repeats=1):
+            ccg = sweep_correlograms(spike_times, spike_clusters, **kwargs)
+        ae(ccg, expected)
+
+
+def test_pairwise_correlograms_all_spikes():
+    clustering, spike_times, store, _calls = _create_store()
+    # With no maximum number of spikes, all spikes of the clusters are used.
+    ae(store.correlograms([0, 1], BIN_SIZE, WINDOW_SIZE, n_spikes=None),
+       _expected(clustering, spike_times, [0, 1]))
+
+
+def test_pairwise_correlograms_1():
+    clustering, spike_times, store, _calls = _create_store()
+
+    ccg = store.correlograms([0, 1, 2], BIN_SIZE, WINDOW_SIZE)
+    assert ccg.shape == (3, 3, 51)
+    ae(ccg, _expected(clustering, spike_times, [0, 1, 2]))
+    assert len(_calls) == 1
+
+    # The pairs are reused.
+    ae(store.correlograms([2, 0], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [2, 0]))
+    assert len(_calls) == 1
+
+    # Missing pairs are computed.
+    ae(store.correlograms([0, 3], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [0, 3]))
+    assert len(_calls) == 2
+
+    spike_clusters = clustering.spike_clusters[clustering.spikes_in_clusters([0, 3])]
+    ae(store.firing_rate([0, 3], BIN_SIZE),
+       firing_rate(spike_clusters, cluster_ids=[0, 3], bin_size=BIN_SIZE, duration=10.))
+
+
+def test_pairwise_correlograms_merge():
+    clustering, spike_times, store, _calls = _create_store()
+    store.correlograms([0, 1, 2, 3], BIN_SIZE, WINDOW_SIZE)
+    assert len(_calls) == 1
+
+    # The correlograms of the merged cluster are derived from those of the merged clusters.
+    up = clustering.merge([0, 1])
+    new = up.added[0]
+    ae(store.correlograms([new, 2, 3], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [new, 2, 3]))
+    assert len(_calls) == 1
+
+    up = clustering.merge([new, 2])
+    ae(store.correlograms([3, up.added[0]], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [3, up.added[0]]))
+    assert len(_calls) == 1
+
+    # After an undo, the restored clusters are recomputed.
+    clustering.undo()
+    ae(store.correlograms([new, 2, 4], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [new, 2, 4]))
+    assert len(_calls) == 2
+
+    # Split.
+    up = clustering.split(np.arange(0, 5000, 3))
+    cluster_ids = up.added[:3]
+    ae(store.correlograms(cluster_ids, BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, cluster_ids))
+
+
+def test_pairwise_correlograms_subset():
+    clustering, spike_times, store, _calls = _create_store()
+    n = 100
+    store.correlograms([0, 1, 2], BIN_SIZE, WINDOW_SIZE, n_spikes=n)
+    up = clustering.merge([0, 1])
+    new = up.added[0]
+
+    # The merged cluster is subsampled again, and its correlograms are recomputed.
+    assert (n, new) not in store._spikes
+    subset = np.r_[clustering.spike_order(2)[:n], clustering.spike_order(new)[:n]]
+    ae(store.correlograms([new, 2], BIN_SIZE, WINDOW_SIZE, n_spikes=n),
+       _expected(clustering, spike_times, [new, 2], spike_ids=np.sort(subset)))
+    ae(store.firing_rate([new, 2], BIN_SIZE, n_spikes=n),
+       np.ones((2, 2)) * n * n * BIN_SIZE / 10.)
+    assert len(_calls) == 2
+    assert len(store._spikes[n, new]) == n
+
+    # The parameters are part of the key.
+    store.correlograms([new, 2], BIN_SIZE, WINDOW_SIZE)
+    assert len(_calls) == 3
+
+    # When the subsets contain all spikes of the merged clusters, the correlograms are derived
+    # from those of the merged clusters.
+    n = 10000
+    store.correlograms([new, 2, 3], BIN_SIZE, WINDOW_SIZE, n_spikes=n)
+    up = clustering.merge([new, 2])
+    ae(store.correlograms([up.added[0], 3], BIN_SIZE, WINDOW_SIZE, n_spikes=n),
+       _expected(clustering, spike_times, [up.added[0], 3]))
+    assert len(_calls) == 4
+
+
+def test_pairwise_correlograms_max_spikes():
+    clustering, spike_times, store, _calls = _create_store()
+    store.max_spikes = 1000
+    for cluster_ids in ([0, 1], [2, 3], [4, 5]):
+        store.correlograms(cluster_ids, BIN_SIZE, WINDOW_SIZE)
+        assert store._n_stored <= store.max_spikes
+        assert store._n_stored == sum(len(s) for s in store._spikes.values())
+    assert (None, 0) not in store._spikes
+    assert (None, 5) in store._spikes
+
+    # The discarded subsets are requested again if needed.
+    ae(store.correlograms([0, 1], BIN_SIZE, WINDOW_SIZE),
+       _expected(clustering, spike_times, [0, 1]))
+    ae(store.firing_rate([0, 4], BIN_SIZE)[0, 0],
+       len(clustering.spikes_per_cluster[0]) ** 2 * BIN_SIZE / 10.)
+
+
+def test_pairwise_correlograms_benchmark():
+    clustering, spike_times, store, _calls = _create_store(
+        n_spikes=1000000, n_clusters=100, duration=1000.)
+    cluster_ids = list(range(10))
+    with benchmark("Compute the correlograms of 10 clusters"):
+        store.correlograms(cluster_ids, BIN_SIZE, WINDOW_SIZE)
+    with benchmark("Merge and assemble the correlograms", repeats=5):
+        for i in range(5):
+            up = clustering.merge([cluster_ids[0], cluster_ids[1]])
+            cluster_ids = up.added + cluster_ids[2:]
+            store.correlograms(cluster_ids, BIN_SIZE, WINDOW_SIZE)
+    assert len(_calls) == 1
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the clustering journal."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import numpy as np
+from numpy.testing import assert_array_equal as ae
+
+from .._journal import Journal, _encode_assign, _decode_assign
+
+
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+
+def test_journal_encode_assign():
+    for spike_ids, spike_clusters in (
+            ([], []), ([3, 1], [7, 7]), (np.arange(1000), np.arange(1000) % 300 + 1000)):
+        s, c = _decode_assign(_encode_assign(spike_ids, spike_clusters))
+        ae(s, spike_ids)
+        ae(c, spike_clusters)
+
+
+def test_journal_1(tempdir):
+    spike_clusters = np.array([2, 3, 5, 2, 7, 5])
+
+    journal = Journal(tempdir)
+    sc, meta = journal.recover(spike_clusters)
+    assert sc is spike_clusters
+    assert meta == []
+
+    journal.rotate(spike_clusters)
+    journal.add_assign([0, 1, 3], [8, 8, 8])
+    journal.add_meta([8], {'group': ['good'], 'n': [np.int64(3)]})
+    journal.add_assign([4], [9])
+    journal.close()
+
+    # Replay the journal.
+    journal = Journal(tempdir)
+    sc, meta = journal.recover(spike_clusters)
+    ae(sc, [8, 8, 5, 8, 9, 5])
+    # The passed array is not modified.
+    ae(spike_clusters, [2, 3, 5, 2, 7, 5])
+    assert meta == [([8], {'group': ['good'], 'n': [3]})]
+
+    # The journal only applies to the data it was created with.
+    assert journal.recover(spike_clusters[::-1].copy())[1] == []
+    assert not list(tempdir.glob('journal.*'))
+
+
+def test_journal_generations(tempdir):
+    spike_clusters = np.array([2, 3, 5, 2, 7, 5])
+
+    journal = Journal(tempdir)
+    journal.rotate(spike_clusters)
+    journal.add_assign([0, 1, 3], [8, 8, 8])
+
+    # Start a new generation upon saving.
+    saved = np.array([8, 8, 5, 8, 7, 5])
+    journal.rotate(saved)
+    journal.add_assign([2, 5], [9, 9])
+    journal.close()
+
+    # The save was interrupted: the model files are still the original ones.
+    sc, _ = Journal(tempdir).recover(spike_clusters)
+    ae(sc, [8, 8, 9, 8, 7, 9])
+
+    # The save has completed: the first generation is obsolete and is deleted.
+    sc, _ = Journal(tempdir).recover(saved)
+    ae(sc, [8, 8, 9, 8, 7, 9])
+    assert len(list(tempdir.glob('journal.*'))) == 1
+
+    Journal(tempdir).clear()
+    assert not list(tempdir.glob('journal.*'))
+
+
+def test_journal_truncated(tempdir):
+    spike_clusters = np.array([2, 3, 5, 2, 7, 5])
+
+    journal = Journal(tempdir)
+    journal.rotate(spike_clusters)
+    journal.add_assign([0, 1], [8, 8])
+    journal.add_assign([2, 4], [9, 9])
+    journal.close()
+
+    # Simulate a crash in the middle of the last write.
+    path = next(tempdir.glob('journal.*'))
+    path.write_bytes(path.read_bytes()[:-3])
+
+    sc, _ = Journal(tempdir).recover(spike_clusters)
+    ae(sc, [8, 8, 5, 2, 7, 5])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the cluster metrics engine."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import time
+
+from .._metrics import ClusterMetrics, batch_metric
+from phy.utils.profiling import benchmark
+
+
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+
+def test_batch_metric():
+    @batch_metric
+    def double(cluster_ids):
+        return [2 * c for c in cluster_ids]
+
+    assert double(3) == 6
+    assert double.batch([1, 2]) == [2, 4]
+    assert double.__name__ == 'double'
+
+
+def test_cluster_metrics_1():
+    _calls = []
+
+    def square(cluster_id):
+        _calls.append(cluster_id)
+        return cluster_id ** 2
+
+    def triple(cluster_ids):
+        _calls.append(tuple(cluster_ids))
+        return [3 * c for c in cluster_ids]
+
+    functions = {'square': square}
+    metrics = ClusterMetrics(functions)
+    # Metrics added later are taken into account.
+    functions['triple'] = batch_metric(triple)
+
+    assert metrics.missing([1, 2]) == [1, 2]
+    assert metrics.get('square', 3) == 9
+    assert metrics.get('square', 3) == 9
+    assert _calls == [3]
+    assert metrics.get_cached('square', 4) is None
+
+    out = metrics.compute([1, 2, 3])
+    assert out == {'square': [1, 4, 9], 'triple': [3, 6, 9]}
+    # The batch function is called once, and cached values are not recomputed.
+    assert sorted(_calls[1:3]) == [1, 2]
+    assert _calls[3:] == [(1, 2, 3)]
+    assert metrics.missing([1, 2, 3, 4]) == [4]
+
+    # Persist the cache of some clusters.
+    d = metrics.to_dict([2, 3])
+    assert d == {'square': {2: 4, 3: 9}, 'triple': {2: 6, 3: 9}}
+    metrics = ClusterMetrics(functions)
+    metrics.from_dict(d)
+    assert metrics.missing([1, 2, 3]) == [1]
+
+
+def test_cluster_metrics_benchmark():
+    def slow(cluster_id):
+        time.sleep(.001)
+        return cluster_id
+
+    metrics = ClusterMetrics({'slow': slow}, n_workers=8)
+    with benchmark("Compute a slow metric on 400 clusters"):
+        metrics.compute(range(400))
+    with benchmark("Get 400 cached values"):
+        metrics.compute(range(400))
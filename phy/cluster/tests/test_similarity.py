@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the template similarity index."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import numpy as np
+from numpy.testing import assert_array_equal as ae
+
+from phylib.utils import connect
+from phy.utils.profiling import benchmark
+from ..clustering import Clustering
+from .._similarity import TemplateSimilarityIndex, _cluster_templates
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+def _similar_templates(n_templates, seed=0):
+    rng = np.random.RandomState(seed)
+    s = rng.rand(n_templates, n_templates)
+    return (s + s.T) / 2
+
+
+def _brute_force(clustering, spike_templates, similar_templates, cluster_id, k):
+    """Reference implementation of the cluster similarity."""
+    spc = clustering.spikes_per_cluster
+    temp_i = np.unique(spike_templates[spc[cluster_id]])
+    out = []
+    for cj in clustering.cluster_ids:
+        if cj == cluster_id:
+            continue
+        temp_j = np.unique(spike_templates[spc[cj]])
+        out.append((int(cj), similar_templates[np.ix_(temp_i, temp_j)].max()))
+    return sorted(out, key=lambda x: (-x[1], x[0]))[:k]
+
+
+def _create_index(n_spikes=1000, n_templates=50, n_neighbors=5):
+    rng = np.random.RandomState(0)
+    spike_templates = rng.randint(0, n_templates, n_spikes)
+    spike_clusters = spike_templates.copy()
+    clustering = Clustering(spike_clusters)
+    similar_templates = _similar_templates(n_templates)
+
+    index = TemplateSimilarityIndex(similar_templates, n_neighbors=n_neighbors)
+    index.set_spike_clusters(clustering.spike_clusters, spike_templates)
+
+    @connect(sender=clustering)
+    def on_cluster(sender, up):
+        spc = clustering.spikes_per_cluster
+        index.update(
+            added={c: spike_templates[spc[c]] for c in up.added}, deleted=up.deleted)
+
+    return clustering, spike_templates, similar_templates, index
+
+
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+
+def test_cluster_templates():
+    assert _cluster_templates([], [], 3) == {}
+    d = _cluster_templates([5, 2, 5, 5, 2], [1, 0, 2, 1, 0], 3)
+    assert sorted(d) == [2, 5]
+    ae(d[2], [0])
+    ae(d[5], [1, 2])
+
+
+def test_similarity_index_1():
+    similar_templates = np.array([
+        [1., .5, .2],
+        [.5, 1., .8],
+        [.2, .8, 1.]])
+    index = TemplateSimilarityIndex(similar_templates, n_neighbors=10)
+    index.set_spike_clusters([0, 1, 2, 2], [0, 1, 1, 2])
+    ae(index.cluster_ids, [0, 1, 2])
+
+    ids, sims = index.similarity(0)
+    ae(ids, [0, 1, 2])
+    ae(sims, [1., .5, .5])
+
+    assert index.similar(0) == [(1, .5), (2, .5)]
+    assert index.similar(2) == [(1, 1.), (0, .5)]
+    assert index.similar(3) == []
+
+    index.update(added={3: [0, 1, 2]}, deleted=[0, 1, 2])
+    assert index.similar(3) == []
+    ae(index.cluster_ids, [3])
+
+
+def test_similarity_index_actions(n_neighbors=5):
+    clustering, spike_templates, similar_templates, index = _create_index(
+        n_neighbors=n_neighbors)
+
+    def _check():
+        for cluster_id in clustering.cluster_ids:
+            expected = _brute_force(
+                clustering, spike_templates, similar_templates, cluster_id, n_neighbors)
+            actual = index.similar(cluster_id)
+            assert [c for c, _ in actual] == [c for c, _ in expected]
+            assert np.allclose([s for _, s in actual], [s for _, s in expected])
+
+    # Fill the index.
+    _check()
+
+    clustering.merge([0, 1, 2])
+    _check()
+
+    clustering.split([3, 4, 5, 6, 7])
+    _check()
+
+    clustering.undo()
+    clustering.undo()
+    _check()
+
+    clustering.redo()
+    _check()
+
+
+def test_similarity_index_benchmark():
+    n_templates = 2000
+    clustering, _, _, index = _create_index(
+        n_spikes=200000, n_templates=n_templates, n_neighbors=100)
+
+    with benchmark("First similarity request"):
+        index.similar(0)
+
+    with benchmark("Similarity request", repeats=100):
+        for cluster_id in range(100):
+            index.similar(cluster_id)
+
+    with benchmark("Similarity index update after a merge"):
+        clustering.merge([0, 1])
+    assert len(index.similar(n_templates)) == 100
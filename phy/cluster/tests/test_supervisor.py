@@ -8,18 +8,20 @@
 
 #from contextlib import contextmanager
 
-from pytest import yield_fixture, fixture
+from pytest import yield_fixture, fixture, mark
 import numpy as np
 from numpy.testing import assert_array_equal as ae
 
 from .. import supervisor as _supervisor
+from .._utils import UpdateInfo
 from ..supervisor import (
-    Supervisor, TaskLogger, ClusterView, SimilarityView, ActionCreator)
+    Supervisor, TaskLogger, ClusterView, SimilarityView, ActionCreator, _process_ups)
 from phy.gui import GUI
 from phy.gui.widgets import Barrier
 from phy.gui.qt import qInstallMessageHandler
 from phy.gui.tests.test_widgets import _assert, _wait_until_table_ready
 from phy.utils.context import Context
+from phy.utils.profiling import benchmark
 from phylib.utils import connect, Bunch, emit
 
 
@@ -114,6 +116,22 @@ def tl():
     return out
 
 
+def test_process_ups():
+    up = _process_ups([
+        UpdateInfo(description='merge', spike_ids=[1, 2, 3], added=[10], deleted=[1, 2]),
+        UpdateInfo(description='metadata_group', metadata_changed=[10], metadata_value='good',
+                   spike_ids=np.array([], dtype=np.int64))])
+    assert up.description == 'merge'
+    ae(up.spike_ids, [1, 2, 3])
+    assert up.added == [10]
+    assert up.metadata_changed == [10]
+    assert up.metadata_value == 'good'
+
+    # Non-empty arrays in the second UpdateInfo are kept.
+    up = _process_ups([UpdateInfo(), UpdateInfo(spike_ids=[4, 5])])
+    ae(up.spike_ids, [4, 5])
+
+
 def test_task_1(tl):
     assert tl.last_state(None) is None
 
@@ -525,6 +543,242 @@ def test_supervisor_split_2(gui, similarity):
     _assert_selected(supervisor, [2, 3])
 
 
+def test_supervisor_batch_1(cluster_ids, cluster_groups, cluster_labels):
+    spike_clusters = np.repeat(cluster_ids, 2)
+    supervisor = Supervisor(
+        spike_clusters, cluster_groups=cluster_groups, cluster_labels=cluster_labels)
+
+    _l = []
+
+    @connect(sender=supervisor)
+    def on_cluster(sender, up):
+        _l.append(up)
+
+    with supervisor.batch():
+        supervisor.merge([0, 1])
+        supervisor.merge([31, 2])
+        supervisor.split([0, 1])
+        supervisor.label('group', 'good', cluster_ids=[10])
+        supervisor.label('test_label', 1, cluster_ids=[20, 30])
+
+    # A single cluster event with all changes.
+    assert len(_l) == 1
+    up = _l[0]
+    assert up.description == 'batch'
+    assert up.deleted == [0, 1, 2]
+    assert up.added == [33, 34]
+    assert up.metadata_changed == [10, 20, 30]
+    assert supervisor.cluster_meta.get('group', 10) == 'good'
+
+    # A single undo reverts everything.
+    supervisor.undo()
+    ae(supervisor.clustering.spike_clusters, spike_clusters)
+    assert supervisor.cluster_meta.get('group', 10) == 'mua'
+    assert supervisor.cluster_meta.get('test_label', 20) is None
+
+    # A single redo reapplies everything.
+    supervisor.redo()
+    assert supervisor.clustering.cluster_ids.tolist() == [10, 11, 20, 30, 33, 34]
+    assert supervisor.cluster_meta.get('group', 10) == 'good'
+    assert supervisor.cluster_meta.get('test_label', 30) == 1
+
+
+def test_supervisor_clustering_events(cluster_ids):
+    supervisor = Supervisor(np.repeat(cluster_ids, 2))
+
+    _l = []
+
+    @connect(sender=supervisor.clustering)
+    def on_cluster(sender, up):
+        _l.append(('clustering', up.added))
+
+    @connect(sender=supervisor)  # noqa
+    def on_cluster(sender, up):  # noqa
+        _l.append(('supervisor', up.added))
+
+    # The clustering callbacks are called before the supervisor's cluster event.
+    supervisor.merge([0, 1])
+    assert _l == [('clustering', [31]), ('supervisor', [31])]
+
+    # The clustering raises one event per action within a batch.
+    del _l[:]
+    with supervisor.batch():
+        supervisor.merge([2, 10])
+        supervisor.merge([31, 32])
+        assert _l == [('clustering', [32]), ('clustering', [33])]
+    assert _l[2:] == [('supervisor', [33])]
+
+
+@mark.benchmark
+def test_supervisor_batch_benchmark():
+    n_clusters = 2000
+    spike_clusters = np.repeat(np.arange(n_clusters), 100)
+    supervisor = Supervisor(spike_clusters)
+
+    _l = []
+
+    @connect(sender=supervisor)
+    def on_cluster(sender, up):
+        _l.append(up)
+
+    with benchmark("1000 merges in a batch"):
+        with supervisor.batch():
+            for i in range(0, n_clusters, 2):
+                supervisor.merge([i, i + 1])
+    assert len(_l) == 1
+    assert len(_l[0].added) == n_clusters // 2
+    assert supervisor.clustering.n_clusters == n_clusters // 2
+
+    supervisor.undo()
+    assert supervisor.clustering.n_clusters == n_clusters
+
+
+def test_supervisor_merge_table_benchmark(qtbot, gui):
+    n_clusters = 5000
+    spike_clusters = np.repeat(np.arange(n_clusters), 10)
+    supervisor = Supervisor(
+        spike_clusters, similarity=lambda c: [(c + 1, 1.)], sort=('n_spikes', 'desc'))
+    supervisor.attach(gui)
+    b = Barrier()
+    connect(b('cluster_view'), event='ready', sender=supervisor.cluster_view)
+    b.wait()
+
+    n_merges = 20
+    with benchmark("Merge and update the tables with %d clusters" % n_clusters, repeats=n_merges):
+        for i in range(n_merges):
+            supervisor.merge([2 * i, 2 * i + 1])
+            # Wait until the cluster view has been updated.
+            ids = supervisor.cluster_view.get_ids()
+    assert len(ids) == n_clusters - n_merges
+    assert sorted(ids[:n_merges]) == list(range(n_clusters, n_clusters + n_merges))
+
+
+def test_supervisor_journal(tempdir, cluster_ids, cluster_groups, cluster_labels):
+    spike_clusters = np.repeat(cluster_ids, 2)
+
+    def _supervisor():
+        return Supervisor(
+            spike_clusters.copy(), cluster_groups=cluster_groups, cluster_labels=cluster_labels,
+            context=Context(tempdir))
+
+    supervisor = _supervisor()
+    assert not supervisor.is_dirty()
+    supervisor.merge([0, 1])
+    supervisor.label('group', 'good', cluster_ids=[10])
+    supervisor.label('test_label', 3, cluster_ids=[2])
+    with supervisor.batch():
+        supervisor.label('test_label', 4, cluster_ids=[30])
+    supervisor.split([0])
+    supervisor.undo()
+    expected = supervisor.clustering.spike_clusters.copy()
+    test_label = supervisor.get_labels('test_label')
+    assert supervisor.cluster_meta.get('group', 32) == 'noise'
+    supervisor.journal.close()
+
+    # Simulate a crash: the session is recovered from the journal.
+    supervisor = _supervisor()
+    assert supervisor.is_dirty()
+    ae(supervisor.clustering.spike_clusters, expected)
+    assert supervisor.cluster_meta.get('group', 10) == 'good'
+    assert supervisor.cluster_meta.get('group', 32) == 'noise'
+    assert supervisor.get_labels('test_label') == test_label
+
+    # The recovered session can be saved.
+    _l = []
+
+    @connect(sender=supervisor)
+    def on_save_clustering(sender, spike_clusters, groups, *labels):
+        _l.append(spike_clusters.copy())
+
+    supervisor.save()
+    ae(_l[0], expected)
+    supervisor.journal.clear()
+
+    supervisor = _supervisor()
+    assert not supervisor.is_dirty()
+    ae(supervisor.clustering.spike_clusters, spike_clusters)
+
+
+def test_supervisor_metrics_cache(tempdir, cluster_ids):
+    spike_clusters = np.repeat(cluster_ids, 2)
+    _calls = []
+
+    def metric(cluster_id):
+        _calls.append(cluster_id)
+        return cluster_id * 10
+
+    def _supervisor(spike_clusters, metric=metric):
+        return Supervisor(
+            spike_clusters.copy(), cluster_metrics={'m': metric}, context=Context(tempdir))
+
+    supervisor = _supervisor(spike_clusters)
+    info = supervisor.cluster_info
+    assert [d['m'] for d in info] == [10 * c for c in cluster_ids]
+    assert sorted(_calls) == cluster_ids
+    supervisor.merge([0, 1])
+    assert supervisor.get_cluster_info(31)['m'] == 310
+    supervisor.save()
+    supervisor.journal.clear()
+    spike_clusters = supervisor.clustering.spike_clusters.copy()
+
+    # The metrics are cached across sessions.
+    del _calls[:]
+    supervisor = _supervisor(spike_clusters)
+    assert supervisor.get_cluster_info(2)['m'] == 20
+    assert supervisor.get_cluster_info(31)['n_spikes'] == 4
+    assert not _calls
+
+    # The metrics of a function that has changed are recomputed.
+    def other_metric(cluster_id):
+        _calls.append(cluster_id)
+        return cluster_id * 100
+
+    supervisor = _supervisor(spike_clusters, metric=other_metric)
+    assert supervisor.get_cluster_info(2)['m'] == 200
+    assert _calls == [2]
+    supervisor.save()
+
+    # The cache is discarded with another spike clustering reusing the same cluster ids.
+    del _calls[:]
+    spike_clusters = np.repeat(cluster_ids, np.arange(1, len(cluster_ids) + 1))
+    supervisor = _supervisor(spike_clusters)
+    assert supervisor.get_cluster_info(2)['m'] == 20
+    assert _calls == [2]
+    assert [supervisor.get_cluster_info(c)['n_spikes'] for c in cluster_ids] == list(
+        range(1, len(cluster_ids) + 1))
+
+
+def test_supervisor_spikes_per_cluster_cache(tempdir, cluster_ids):
+    spike_clusters = np.repeat(cluster_ids, 2)
+
+    def _supervisor():
+        return Supervisor(spike_clusters.copy(), context=Context(tempdir))
+
+    supervisor = _supervisor()
+    path = tempdir / 'spikes_per_cluster'
+    assert (path / 'spike_ids.npy').exists()
+
+    # The cached spike ids are memory-mapped.
+    supervisor = _supervisor()
+    spc = supervisor.clustering.spikes_per_cluster
+    assert isinstance(spc[0].base.base, np.memmap)
+    ae(spc[1], [2, 3])
+
+    supervisor.merge([0, 1])
+    supervisor.save()
+    supervisor.journal.clear()
+    mtime = (path / 'spike_ids.npy').stat().st_mtime_ns
+
+    # Saving again without any change does not rewrite the cache.
+    supervisor.save()
+    assert (path / 'spike_ids.npy').stat().st_mtime_ns == mtime
+
+    # The cache is not used if the spike clusters do not match.
+    supervisor = _supervisor()
+    assert supervisor.clustering.spikes_per_cluster[0].flags.writeable
+    ae(supervisor.clustering.spikes_per_cluster[1], [2, 3])
+
+
 def test_supervisor_state(tempdir, qtbot, gui, supervisor):
 
     supervisor.select(1)
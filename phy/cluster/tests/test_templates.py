@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the cluster template counts."""
+
+#------------------------------------------------------------------------------
+# Imports
+#------------------------------------------------------------------------------
+
+import numpy as np
+from numpy.testing import assert_array_equal as ae
+from pytest import mark
+
+from phylib.utils import connect
+from phy.utils.profiling import benchmark
+from ..clustering import Clustering
+from .._templates import ClusterTemplateCounts, _count_templates
+
+
+#------------------------------------------------------------------------------
+# Utils
+#------------------------------------------------------------------------------
+
+def _create_counts(n_spikes=1000, n_templates=20, n_clusters=20):
+    rng = np.random.RandomState(0)
+    spike_templates = rng.randint(0, n_templates, n_spikes)
+    spike_clusters = (spike_templates + rng.randint(0, 2, n_spikes)) % n_clusters
+    clustering = Clustering(spike_clusters)
+    counts = ClusterTemplateCounts(
+        spike_templates, n_templates, lambda: clustering.spike_clusters)
+    connect(lambda sender, up: counts.update(up), event='cluster', sender=clustering)
+    return clustering, spike_templates, counts
+
+
+def _check(clustering, spike_templates, counts):
+    n_templates = counts.n_templates
+    assert sorted(counts.rows) == clustering.cluster_ids.tolist()
+    for cluster_id, spike_ids in clustering.spikes_per_cluster.items():
+        expected = np.bincount(spike_templates[spike_ids], minlength=n_templates)
+        ae(counts.get_dense(cluster_id), expected)
+        assert counts.best_template(cluster_id) == np.argmax(expected)
+
+
+#------------------------------------------------------------------------------
+# Tests
+#------------------------------------------------------------------------------
+
+def test_count_templates():
+    assert _count_templates([], [], 3) == {}
+    d = _count_templates([5, 2, 5, 5, 2], [1, 0, 2, 1, 0], 3)
+    assert sorted(d) == [2, 5]
+    ae(d[2][0], [0])
+    ae(d[2][1], [2])
+    ae(d[5][0], [1, 2])
+    ae(d[5][1], [2, 1])
+
+
+def test_cluster_template_counts_actions():
+    clustering, spike_templates, counts = _create_counts()
+
+    # The counts are only computed when requested.
+    clustering.merge([0, 1])
+    assert counts._rows is None
+    _check(clustering, spike_templates, counts)
+
+    clustering.merge([2, 3, 4])
+    _check(clustering, spike_templates, counts)
+
+    clustering.split(np.arange(0, 1000, 3))
+    _check(clustering, spike_templates, counts)
+
+    clustering.assign(np.arange(100, 200), np.arange(100) % 3)
+    _check(clustering, spike_templates, counts)
+
+    for _ in range(3):
+        clustering.undo()
+        _check(clustering, spike_templates, counts)
+
+    for _ in range(3):
+        clustering.redo()
+        _check(clustering, spike_templates, counts)
+
+
+def test_cluster_template_counts_csr():
+    clustering, spike_templates, counts = _create_counts()
+    cluster_ids = clustering.cluster_ids[::2]
+    m = counts.to_csr(cluster_ids)
+    assert m.shape == (len(cluster_ids), counts.n_templates)
+    ae(m.toarray(), [counts.get_dense(c) for c in cluster_ids])
+    assert counts.to_csr([]).shape == (0, counts.n_templates)
+
+
+@mark.benchmark
+def test_cluster_template_counts_benchmark():
+    n_spikes = 2_000_000
+    clustering, spike_templates, counts = _create_counts(
+        n_spikes=n_spikes, n_templates=1000, n_clusters=1000)
+
+    with benchmark("Count the templates of all clusters"):
+        counts.rows
+
+    with benchmark("Merge with template counts", repeats=100):
+        for i in range(0, 200, 2):
+            clustering.merge([i, i + 1])
+    with benchmark("Split with template counts", repeats=10):
+        for i in range(200, 210):
+            clustering.split(clustering.spikes_per_cluster[i][:5])
+    with benchmark("Template counts", repeats=100):
+        for cluster_id in clustering.cluster_ids[:100]:
+            counts.get_dense(cluster_id)
+    assert len(counts.rows) == clustering.n_clusters
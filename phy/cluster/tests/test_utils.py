@@ -8,7 +8,11 @@
 
 import logging
 
-from pytest import raises
+import numpy as np
+from pytest import raises, mark
+
+from phylib.utils import connect
+from phy.utils.profiling import benchmark
 
 from .._utils import (ClusterMeta, UpdateInfo, RotatingProperty,
                       _update_cluster_selection, create_cluster_meta)
@@ -140,6 +144,46 @@ def test_metadata_history_complex():
     assert info is None
 
 
+def test_metadata_batch():
+    meta = ClusterMeta()
+    meta.add_field('group')
+    meta.set('group', 1, 'mua')
+
+    _l = []
+
+    @connect(sender=meta)
+    def on_cluster(sender, up):
+        _l.append(up)
+
+    with meta.batch() as batch:
+        meta.set('group', [1, 2], 'good')
+        meta.set('quality', [3], 10)
+        meta.set('group', [3], 'noise')
+    assert not _l
+    assert batch.up.description == 'batch'
+    assert batch.up.metadata_changed == [1, 2, 3]
+    assert meta.get('group', 1) == 'good'
+
+    meta.undo()
+    assert meta.get('group', 1) == 'mua'
+    assert meta.get('group', 3) is None
+    assert meta.get('quality', 3) is None
+
+    meta.redo()
+    assert meta.get('group', 2) == 'good'
+    assert meta.get('quality', 3) == 10
+    assert meta.get('group', 3) == 'noise'
+    assert len(_l) == 2
+
+    # Nested batches yield the object of the outer batch.
+    with meta.batch() as outer:
+        with meta.batch() as inner:
+            meta.set('group', [4], 'good')
+        assert inner is outer
+        assert inner.up is None
+    assert outer.up.metadata_changed == [4]
+
+
 def test_metadata_descendants():
     """Test ClusterMeta history."""
 
@@ -180,6 +224,59 @@ def test_metadata_descendants():
     assert meta.group(2) == 2
 
 
+def test_metadata_columns():
+    meta = ClusterMeta()
+    meta.add_field('group')
+
+    # Bulk set and get.
+    meta.set('group', np.arange(1000, 1010), 'good')
+    assert meta.get('group', np.arange(1008, 1012)) == ['good', 'good', None, None]
+    assert meta.get('group', 100000) is None
+    assert meta.to_dict('group') == {c: 'good' for c in range(1000, 1010)}
+
+    # Sequence values are stored as is.
+    meta.set('pos', [1, 2], (3, 4))
+    assert meta.get('pos', [1, 2, 3]) == [(3, 4), (3, 4), None]
+
+    # Changing the default value of an existing field.
+    meta.add_field('group', 'unsorted')
+    assert meta.get('group', [2, 1000]) == ['unsorted', 'good']
+
+    # Undo restores the values that were not set through the undo stack.
+    meta.set_from_descendants([(1000, 5000), (1001, 5000)])
+    assert meta.group(5000) == 'good'
+    meta.set('group', 5000, 'noise')
+    meta.undo()
+    assert meta.group(5000) == 'good'
+    meta.redo()
+    assert meta.group(5000) == 'noise'
+
+
+@mark.benchmark
+def test_metadata_benchmark():
+    n_clusters, n_fields = 5000, 12
+    cluster_ids = np.arange(n_clusters)
+    meta = ClusterMeta()
+    for i in range(n_fields):
+        meta.add_field('label_%d' % i)
+        meta.from_dict({c: {'label_%d' % i: c % 7} for c in range(0, n_clusters, 3)})
+
+    # Merge all clusters into a new one.
+    descendants = list(zip(cluster_ids, [n_clusters] * n_clusters))
+    with benchmark("set_from_descendants", repeats=10):
+        meta.set_from_descendants(descendants, largest_old_cluster=0)
+    assert meta.label_0(n_clusters) == 0
+
+    with benchmark("Bulk get", repeats=10):
+        for field in meta.fields:
+            meta.get(field, cluster_ids)
+
+    with benchmark("Label", repeats=100):
+        meta.set('label_1', cluster_ids[::2], 'good')
+    with benchmark("Undo", repeats=10):
+        meta.undo()
+
+
 def test_update_cluster_selection():
     clusters = [1, 2, 3]
     up = UpdateInfo(deleted=[2], added=[4, 0])
@@ -196,6 +293,44 @@ def test_update_info():
     logger.debug(UpdateInfo(metadata_changed=[2, 3], description='metadata'))
 
 
+def test_update_info_bunch():
+    up = UpdateInfo(description='merge', spike_ids=[3, 1, 2], added=[5], deleted=[1, 2])
+
+    # The spike ids are stored as a read-only int64 array.
+    assert isinstance(up.spike_ids, np.ndarray)
+    assert up.spike_ids.dtype == np.int64
+    with raises(ValueError):
+        up.spike_ids[0] = 0
+
+    # Bunch-style access.
+    assert up['added'] == up.added == [5]
+    assert up.get('history') is None
+    assert up.get('spike_clusters', 0) == 0
+    assert 'spike_clusters' not in up
+    assert 'spike_ids' in up.keys()
+    with raises(AttributeError):
+        up.largest_old_cluster
+    with raises(KeyError):
+        up['unknown']
+
+    # Extra fields.
+    up.my_field = 'hello'
+    assert up['my_field'] == 'hello'
+    up['other'] = 1
+    assert up.other == 1
+    assert dict(up.items())['other'] == 1
+
+    # Update and equality.
+    up2 = UpdateInfo()
+    assert up2 != up
+    assert up2.added == [] and up2.added is not UpdateInfo().added
+    up2.update(up)
+    assert up2 == up
+    assert up.copy() == up
+    up2.spike_ids = [0]
+    assert up2 != up
+
+
 def test_rotating_property():
     rp = RotatingProperty()
     rp.add('f1', 1)
@@ -34,9 +34,12 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
 
     correlograms : function
         Maps `(cluster_ids, bin_size, window_size)` to an `(n_clusters, n_clusters, n_bins) array`.
+        When all spikes are requested with `toggle_all_spikes()`, it is called with the
+        additional keyword argument `all_spikes=True`.
 
     firing_rate : function
-        Maps `(cluster_ids, bin_size)` to an `(n_clusters, n_clusters) array`
+        Maps `(cluster_ids, bin_size)` to an `(n_clusters, n_clusters) array`. It is also called
+        with `all_spikes=True` when all spikes are requested.
 
     """
 
@@ -58,6 +61,9 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
     # Whether the normalization is uniform across entire rows or not.
     uniform_normalization = False
 
+    # Whether to compute the correlograms on all spikes instead of a subset of the spikes.
+    all_spikes = False
+
     default_shortcuts = {
         'change_window_size': 'ctrl+wheel',
         'change_bin_size': 'alt+wheel',
@@ -72,7 +78,8 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
     def __init__(self, correlograms=None, firing_rate=None, sample_rate=None, **kwargs):
         super(CorrelogramView, self).__init__(**kwargs)
         self.state_attrs += (
-            'bin_size', 'window_size', 'refractory_period', 'uniform_normalization')
+            'bin_size', 'window_size', 'refractory_period', 'uniform_normalization',
+            'all_spikes')
         self.local_state_attrs += ()
         self.canvas.set_layout(layout='grid')
 
@@ -110,8 +117,11 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
                 yield i, j
 
     def get_clusters_data(self, load_all=None):
-        ccg = self.correlograms(self.cluster_ids, self.bin_size, self.window_size)
-        fr = self.firing_rate(self.cluster_ids, self.bin_size) if self.firing_rate else None
+        kwargs = dict(all_spikes=True) if self.all_spikes else {}
+        ccg = self.correlograms(self.cluster_ids, self.bin_size, self.window_size, **kwargs)
+        fr = (
+            self.firing_rate(self.cluster_ids, self.bin_size, **kwargs)
+            if self.firing_rate else None)
         assert ccg.ndim == 3
         n_bins = ccg.shape[2]
         bunchs = []
@@ -218,6 +228,12 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
         self.uniform_normalization = checked
         self.plot()
 
+    def toggle_all_spikes(self, checked):
+        """Compute the correlograms on all spikes of the selected clusters, instead of a
+        subset of the spikes."""
+        self.all_spikes = checked
+        self.plot()
+
     def toggle_labels(self, checked):
         """Show or hide all labels."""
         if checked:
@@ -231,6 +247,9 @@ class CorrelogramView(ScalingMixin, ManualClusteringView):
         super(CorrelogramView, self).attach(gui)
 
         self.actions.add(self.toggle_normalization, shortcut='n', checkable=True)
+        self.actions.add(
+            self.toggle_all_spikes, checkable=True, checked=self.all_spikes,
+            show_shortcut=False)
         self.actions.add(self.toggle_labels, checkable=True, checked=True)
         self.actions.separator()
 
@@ -20,10 +20,13 @@ from . import _stop_and_close
 
 def test_correlogram_view(qtbot, gui):
 
-    def get_correlograms(cluster_ids, bin_size, window_size):
+    _all_spikes = []
+
+    def get_correlograms(cluster_ids, bin_size, window_size, all_spikes=False):
+        _all_spikes.append(all_spikes)
         return artificial_correlograms(len(cluster_ids), int(window_size / bin_size))
 
-    def get_firing_rate(cluster_ids, bin_size):
+    def get_firing_rate(cluster_ids, bin_size, all_spikes=False):
         return .5 * np.ones((len(cluster_ids), len(cluster_ids)))
 
     v = CorrelogramView(correlograms=get_correlograms,
@@ -43,6 +46,11 @@ def test_correlogram_view(qtbot, gui):
     v.toggle_labels(False)
     v.toggle_labels(True)
 
+    v.toggle_all_spikes(True)
+    assert _all_spikes[-1] is True
+    v.toggle_all_spikes(False)
+    assert _all_spikes[-1] is False
+
     v.set_bin(1)
     v.set_window(100)
     v.set_refractory_period(3)
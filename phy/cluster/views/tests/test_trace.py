@@ -8,13 +8,18 @@
 
 import numpy as np
 from numpy.testing import assert_allclose as ac
+from numpy.testing import assert_array_equal as ae
+from pytest import mark
 
 from phylib.io.mock import artificial_traces, artificial_spike_clusters
 from phylib.utils import Bunch, connect
 from phylib.utils.geometry import linear_positions
 from phy.plot.tests import mouse_click
 
-from ..trace import TraceView, TraceImageView, select_traces, _iter_spike_waveforms
+from phy.utils.profiling import benchmark
+from ..trace import (
+    TraceView, TraceImageView, select_traces, _iter_spike_waveforms, _extract_spike_waveforms,
+    _trace_spike_index)
 from . import _stop_and_close
 
 
@@ -47,6 +52,104 @@ def test_iter_spike_waveforms():
         assert w
 
 
+def test_extract_spike_waveforms():
+    nc = 5
+    ns = 20
+    sr = 2000.
+    duration = 1.
+    st = np.r_[0.001, np.linspace(0.1, .9, 30), .999]
+    sc = artificial_spike_clusters(len(st), 4)
+    traces = 10 * artificial_traces(int(round(duration * sr)), nc)
+
+    m = Bunch(spike_times=st, spike_clusters=sc, sample_rate=sr)
+    selected = [2, 0]
+
+    def get_best_channels(cluster_id):
+        ch = np.arange(cluster_id, cluster_id + 2) % nc
+        return ch, np.linspace(1, .5, len(ch))
+
+    kwargs = dict(
+        interval=[0., 1.], traces_interval=traces, model=m, supervisor=Bunch(selected=selected),
+        n_samples_waveforms=ns, get_best_channels=get_best_channels)
+
+    w = _extract_spike_waveforms(show_all_spikes=True, **kwargs)
+    # The partial spikes at the edges are skipped.
+    assert 0 not in w.spike_ids
+    assert len(st) - 1 not in w.spike_ids
+    assert len(w.spike_ids) == len(st) - 2
+    # Selected spikes come last.
+    is_selected = w.select_index >= 0
+    assert np.all(np.diff(is_selected.astype(int)) >= 0)
+    for i, (spike_id, c) in enumerate(zip(w.spike_ids, w.spike_clusters)):
+        assert c == sc[spike_id]
+        assert w.select_index[i] == (selected.index(c) if c in selected else -1)
+        s = int(round(st[spike_id] * sr))
+        ch, amps = get_best_channels(c)
+        rows = w.spike_index == i
+        ae(w.channel_ids[rows], ch)
+        ac(w.channel_amps[rows], amps)
+        ac(w.data[rows], traces[s - ns // 2:s + ns // 2, ch].T)
+        ac(w.start_times[i], (s - ns // 2) / sr)
+
+    # Only selected spikes.
+    w = _extract_spike_waveforms(show_all_spikes=False, **kwargs)
+    assert np.all(w.select_index >= 0)
+    assert np.all(np.isin(w.spike_clusters, selected))
+
+    # Same waveforms as one bunch per spike.
+    waveforms = list(_iter_spike_waveforms(show_all_spikes=False, **kwargs))
+    assert [wave.spike_id for wave in waveforms] == list(w.spike_ids)
+    ac(np.concatenate([wave.data.T for wave in waveforms]), w.data)
+    assert all(wave.select_index is not None for wave in waveforms)
+
+    # The spikes of the window can be kept while the selection changes.
+    spike_index = _trace_spike_index(interval=[0., 1.], model=m, n_samples_waveforms=ns)
+    ae(spike_index.spike_ids, np.arange(1, len(st) - 1))
+    for show_all_spikes in (False, True):
+        w0 = _extract_spike_waveforms(show_all_spikes=show_all_spikes, **kwargs)
+        w1 = _extract_spike_waveforms(
+            show_all_spikes=show_all_spikes, spike_index=spike_index, **kwargs)
+        for name in ('spike_ids', 'select_index', 'start_times', 'spike_index', 'channel_ids'):
+            ae(w0[name], w1[name])
+        ac(w0.data, w1.data)
+
+    # No spike.
+    w = _extract_spike_waveforms(
+        show_all_spikes=True, **dict(kwargs, interval=[.91, .99]))
+    assert w.data.shape == (0, ns)
+
+
+@mark.benchmark
+def test_extract_spike_waveforms_benchmark():
+    nc = 64
+    ns = 41
+    sr = 25000.
+    duration = 10.
+    n_spikes = 10000
+    n_clusters = 100
+    n_best = 12
+
+    st = np.sort(np.random.uniform(.01, duration - .01, n_spikes))
+    sc = np.random.randint(0, n_clusters, n_spikes)
+    traces = np.random.normal(size=(int(duration * sr), nc)).astype(np.float32)
+    m = Bunch(spike_times=st, spike_clusters=sc, sample_rate=sr)
+    best = {c: (np.random.choice(nc, n_best, replace=False), np.ones(n_best))
+            for c in range(n_clusters)}
+
+    kwargs = dict(
+        interval=[0., duration], traces_interval=traces, model=m,
+        supervisor=Bunch(selected=[0, 1]), n_samples_waveforms=ns,
+        get_best_channels=best.__getitem__, show_all_spikes=True)
+
+    with benchmark("Extract %d spike waveforms" % n_spikes, repeats=5):
+        w = _extract_spike_waveforms(**kwargs)
+    assert w.data.shape == (n_spikes * n_best, ns)
+
+    with benchmark("Iterate through %d spike waveforms" % n_spikes, repeats=5):
+        waveforms = list(_iter_spike_waveforms(**kwargs))
+    assert len(waveforms) == n_spikes
+
+
 def test_trace_view_1(qtbot, tempdir, gui):
     nc = 5
     ns = 20
@@ -221,6 +324,105 @@ def test_trace_view_1(qtbot, tempdir, gui):
     _stop_and_close(qtbot, v)
 
 
+def test_trace_view_batched_waveforms(qtbot, tempdir, gui):
+    nc = 5
+    ns = 20
+    sr = 2000.
+    duration = 1.
+    st = np.linspace(0.1, .9, ns)
+    sc = artificial_spike_clusters(ns, nc)
+    traces = 10 * artificial_traces(int(round(duration * sr)), nc)
+    m = Bunch(spike_times=st, spike_clusters=sc, sample_rate=sr)
+    selected = []
+
+    _loaded = []
+
+    def get_spike_waveforms(interval, traces_interval):
+        return _extract_spike_waveforms(
+            interval=interval, traces_interval=traces_interval, model=m,
+            supervisor=Bunch(selected=selected), n_samples_waveforms=ns,
+            get_best_channels=lambda cluster_id: (np.arange(nc), np.ones(nc)),
+            show_all_spikes=True)
+
+    def get_traces(interval):
+        _loaded.append(interval)
+        data = select_traces(traces, interval, sample_rate=sr)
+        return Bunch(data=data, waveforms=get_spike_waveforms(interval, data))
+
+    v = TraceView(
+        traces=get_traces,
+        spike_waveforms=get_spike_waveforms,
+        spike_times=lambda: st,
+        n_channels=nc,
+        sample_rate=sr,
+        duration=duration,
+        channel_positions=linear_positions(nc),
+    )
+    v.show()
+    qtbot.waitForWindowShown(v.canvas)
+    v.attach(gui)
+
+    selected[:] = [0, 2]
+    v.on_select(cluster_ids=selected)
+    v.set_interval((0., duration))
+    qtbot.wait(1)
+    assert _loaded[-1] == (0., duration)
+
+    # Changing the selection only updates the spike waveforms.
+    n = len(_loaded)
+    selected[:] = [1]
+    v.on_select(cluster_ids=selected)
+    v.toggle_highlighted_spikes(True)
+    qtbot.wait(1)
+    assert len(_loaded) == n
+    ae(v._waveform_times.select_index, np.where(v._waveform_times.spike_clusters == 1, 0, -1))
+
+    _clicked = []
+
+    @connect(sender=v)
+    def on_select_spike(sender, channel_id=None, spike_id=None, cluster_id=None, key=None):
+        _clicked.append((spike_id, cluster_id))
+
+    mouse_click(qtbot, v.canvas, pos=(0., 0.), button='Left', modifiers=('Control',))
+    assert len(_clicked) == 1
+    assert sc[_clicked[0][0]] == _clicked[0][1]
+
+    _stop_and_close(qtbot, v)
+
+
+def test_trace_view_decimated(qtbot, tempdir, gui):
+    nc = 5
+    sr = 2000.
+    duration = 100.
+    n_bins = 1000
+
+    def get_traces(interval):
+        # Minima and maxima of bins of 200 samples.
+        data = np.random.normal(size=(n_bins, 2, nc))
+        data.sort(axis=1)
+        times = np.repeat(np.linspace(interval[0], interval[1], n_bins), 2)
+        return Bunch(data=data.reshape((-1, nc)), times=times, waveforms=[])
+
+    v = TraceView(
+        traces=get_traces,
+        n_channels=nc,
+        sample_rate=sr,
+        duration=duration,
+        channel_positions=linear_positions(nc),
+    )
+    v.show()
+    qtbot.waitForWindowShown(v.canvas)
+    v.attach(gui)
+    assert v.n_pixels > 0
+
+    v.set_interval((0., 100.))
+    v.widen()
+    v.narrow()
+    qtbot.wait(1)
+
+    _stop_and_close(qtbot, v)
+
+
 #------------------------------------------------------------------------------
 # Test trace imageview
 #------------------------------------------------------------------------------
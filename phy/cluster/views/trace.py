@@ -35,47 +35,132 @@ def select_traces(traces, interval, sample_rate=None):
     return traces
 
 
-def _iter_spike_waveforms(
-        interval=None, traces_interval=None, model=None, supervisor=None,
-        n_samples_waveforms=None, get_best_channels=None, show_all_spikes=False):
-    """Iterate through the spike waveforms belonging in the current trace view."""
+def _trace_spike_index(interval=None, model=None, n_samples_waveforms=None):
+    """Return the spikes whose waveform fits entirely in a trace window.
+
+    Return a Bunch with the `(n_spikes,)` arrays `spike_ids`, `spike_times`, `spike_clusters`,
+    and `samples` (relative to the start of the window). This only depends on the interval, so
+    that it can be kept while the cluster selection changes.
+
+    """
     m = model
-    p = supervisor
     sr = m.sample_rate
     a, b = m.spike_times.searchsorted(interval)
     s0, s1 = int(round(interval[0] * sr)), int(round(interval[1] * sr))
+    k = n_samples_waveforms // 2
+
+    spike_ids = np.arange(a, b)
+    spike_times = np.asarray(m.spike_times[a:b])
+    samples = np.round(spike_times * sr).astype(np.int64) - s0
+    # Skip partial spikes.
+    keep = (samples - k >= 0) & (samples + k < s1 - s0)
+    return Bunch(
+        spike_ids=spike_ids[keep],
+        spike_times=spike_times[keep],
+        spike_clusters=np.asarray(m.spike_clusters[a:b])[keep],
+        samples=samples[keep],
+    )
+
+
+def _extract_spike_waveforms(
+        interval=None, traces_interval=None, model=None, supervisor=None,
+        n_samples_waveforms=None, get_best_channels=None, show_all_spikes=False,
+        spike_index=None):
+    """Extract all spike waveforms belonging in the current trace view at once.
+
+    The best channels are requested once per cluster, and the waveforms of all spikes of a
+    cluster are gathered with a single fancy indexing operation. The spikes of the window can be
+    passed as `spike_index`, as returned by `_trace_spike_index()`. Return a Bunch with the
+    following attributes, where the spikes from the selected clusters come last so that they
+    appear on top:
+
+    * `spike_ids`, `spike_times`, `spike_clusters`, `start_times`: `(n_spikes,)` arrays
+    * `select_index`: `(n_spikes,)` array with the index of the spike cluster in the selection,
+      or -1 for non-selected clusters
+    * `data`: `(n_signals, n_samples_waveforms)` array with one waveform per spike and channel
+    * `spike_index`, `channel_ids`, `channel_amps`: `(n_signals,)` arrays with the index of the
+      spike, the channel, and the relative amplitude of the spike on the channel, of every
+      waveform
+
+    """
+    selected = list(supervisor.selected)
+    sr = model.sample_rate
+    s0 = int(round(interval[0] * sr))
     ns = n_samples_waveforms
     k = ns // 2
-    for show_selected in (False, True):
-        for i in range(a, b):
-            t = m.spike_times[i]
-            c = m.spike_clusters[i]
-            is_selected = c in p.selected
-            # Show non selected spikes first, then selected spikes so that they appear on top.
-            if is_selected is not show_selected:
-                continue
-            # Skip non-selected spikes if requested.
-            if (not show_all_spikes and c not in supervisor.selected):
-                continue
-            # cg = p.cluster_meta.get('group', c)
-            channel_ids, channel_amps = get_best_channels(c)
-            s = int(round(t * sr)) - s0
-            # Skip partial spikes.
-            if s - k < 0 or s + k >= (s1 - s0):  # pragma: no cover
-                continue
-            # Extract the waveform.
-            wave = Bunch(
-                data=traces_interval[s - k:s + ns - k, channel_ids],
-                channel_ids=channel_ids,
-                start_time=(s + s0 - k) / sr,
-                spike_id=i,
-                spike_time=t,
-                spike_cluster=c,
-                channel_amps=channel_amps,  # for each of the channel_ids, the relative amp
-                select_index=p.selected.index(c) if c in p.selected else None,
-            )
-            assert wave.data.shape == (ns, len(channel_ids))
-            yield wave
+    if spike_index is None:
+        spike_index = _trace_spike_index(
+            interval=interval, model=model, n_samples_waveforms=n_samples_waveforms)
+
+    spike_clusters = spike_index.spike_clusters
+    select_index = np.full(len(spike_clusters), -1, dtype=np.int64)
+    for i, cluster_id in enumerate(selected):
+        select_index[spike_clusters == cluster_id] = i
+    # Skip non-selected spikes if requested.
+    keep = np.arange(len(spike_clusters)) if show_all_spikes else np.nonzero(select_index >= 0)[0]
+    # Show non selected spikes first, then selected spikes so that they appear on top.
+    keep = keep[np.argsort(select_index[keep] >= 0, kind='stable')]
+    spike_ids, spike_times, spike_clusters, samples = (
+        spike_index[name][keep]
+        for name in ('spike_ids', 'spike_times', 'spike_clusters', 'samples'))
+    select_index = select_index[keep]
+
+    # Best channels of every cluster.
+    clusters, cluster_index = np.unique(spike_clusters, return_inverse=True)
+    cluster_index = cluster_index.ravel()
+    channels = [get_best_channels(cluster_id) for cluster_id in clusters]
+    n_channels = np.array([len(ch) for ch, _ in channels], dtype=np.int64)
+    # Offset of the first waveform of every spike.
+    counts = n_channels[cluster_index]
+    offsets = np.r_[0, np.cumsum(counts)[:-1]].astype(np.int64)
+    n_signals = int(counts.sum())
+
+    data = np.zeros((n_signals, ns), dtype=traces_interval.dtype)
+    channel_ids = np.zeros(n_signals, dtype=np.int64)
+    channel_amps = np.zeros(n_signals, dtype=np.float64)
+    spike_index = np.repeat(np.arange(len(spike_ids)), counts)
+    time_idx = np.arange(ns) - k
+    for i, (ch, amps) in enumerate(channels):
+        idx = np.nonzero(cluster_index == i)[0]
+        ch = np.asarray(ch, dtype=np.int64)
+        # Waveforms of all spikes of the cluster on its best channels.
+        waveforms = traces_interval[
+            (samples[idx, np.newaxis] + time_idx)[:, :, np.newaxis], ch]
+        assert waveforms.shape == (len(idx), ns, len(ch))
+        rows = (offsets[idx, np.newaxis] + np.arange(len(ch))).ravel()
+        data[rows] = waveforms.transpose((0, 2, 1)).reshape((-1, ns))
+        channel_ids[rows] = np.tile(ch, len(idx))
+        channel_amps[rows] = np.tile(np.asarray(amps, dtype=np.float64), len(idx))
+
+    return Bunch(
+        spike_ids=spike_ids,
+        spike_times=spike_times,
+        spike_clusters=spike_clusters,
+        start_times=(samples + s0 - k) / sr,
+        select_index=select_index,
+        data=data,
+        spike_index=spike_index,
+        channel_ids=channel_ids,
+        channel_amps=channel_amps,
+    )
+
+
+def _iter_spike_waveforms(**kwargs):
+    """Iterate through the spike waveforms belonging in the current trace view."""
+    w = _extract_spike_waveforms(**kwargs)
+    offsets = np.r_[0, np.cumsum(np.bincount(w.spike_index, minlength=len(w.spike_ids)))]
+    for i in range(len(w.spike_ids)):
+        rows = slice(offsets[i], offsets[i + 1])
+        yield Bunch(
+            data=w.data[rows].T,
+            channel_ids=w.channel_ids[rows],
+            start_time=w.start_times[i],
+            spike_id=w.spike_ids[i],
+            spike_time=w.spike_times[i],
+            spike_cluster=w.spike_clusters[i],
+            channel_amps=w.channel_amps[rows],  # for each of the channel_ids, the relative amp
+            select_index=w.select_index[i] if w.select_index[i] >= 0 else None,
+        )
 
 
 class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
@@ -87,6 +172,9 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
     traces : function
         Maps a time interval `(t0, t1)` to a `Bunch(data, color, waveforms)` where
         * `data` is an `(n_samples, n_channels)` array
+        * `times` is an optional `(n_samples,)` array with the times of the samples, when the
+          traces are decimated (by default, the samples are regularly spaced at the sampling
+          rate from the start of the interval)
         * `waveforms` is a list of bunchs with the following attributes:
             * `data`
             * `color`
@@ -94,9 +182,14 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
             * `start_time`
             * `spike_id`
             * `spike_cluster`
+          or a single Bunch with all waveforms, as returned by `_extract_spike_waveforms()`
 
     spike_times : function
         Teturns the list of relevant spike times.
+    spike_waveforms : function
+        Maps `(interval, traces_interval)` to the spike waveforms of the current cluster selection
+        in a window, with the same format as `waveforms` above. When it is provided, the spike
+        waveforms are updated without reloading the traces when the selection changes.
     sample_rate : float
     duration : float
     n_channels : int
@@ -147,7 +240,8 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
 
     def __init__(
             self, traces=None, sample_rate=None, spike_times=None, duration=None,
-            n_channels=None, channel_positions=None, channel_labels=None, **kwargs):
+            n_channels=None, channel_positions=None, channel_labels=None,
+            spike_waveforms=None, **kwargs):
 
         self.do_show_labels = True
         self.show_all_spikes = False
@@ -162,7 +256,9 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
         # Traces and spikes.
         assert hasattr(traces, '__call__')
         self.traces = traces
-        # self.waveforms = None
+        self.spike_waveforms = spike_waveforms
+        # Last traces loaded in the current interval.
+        self._traces = None
 
         assert duration >= 0
         self.duration = duration
@@ -196,7 +292,7 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
         self._interval = None
         self.go_to(duration / 2.)
 
-        self._waveform_times = []
+        self._waveform_times = None
         self.canvas.panzoom.set_constrain_bounds((-1, -2, +1, +2))
 
     def _create_visuals(self):
@@ -227,17 +323,22 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
     def stacked(self):
         return self.canvas.stacked
 
+    @property
+    def n_pixels(self):
+        """Width of the view in pixels, used to choose the resolution of the traces."""
+        return self.canvas.get_size()[0]
+
     # Internal methods
     # -------------------------------------------------------------------------
 
-    def _plot_traces(self, traces, color=None):
+    def _plot_traces(self, traces, color=None, times=None):
         traces = traces.T
         n_samples = traces.shape[1]
         n_ch = self.n_channels
         assert traces.shape == (n_ch, n_samples)
         color = color or self.default_trace_color
 
-        t = self._interval[0] + np.arange(n_samples) * self.dt
+        t = self._interval[0] + np.arange(n_samples) * self.dt if times is None else times
         t = np.tile(t, (n_ch, 1))
 
         box_index = self.channel_y_ranks
@@ -290,17 +391,54 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
     def _plot_waveforms(self, waveforms, **kwargs):
         """Plot the waveforms."""
         # waveforms = self.waveforms
-        assert isinstance(waveforms, list)
-        if waveforms:
-            self.waveform_visual.show()
-            self.waveform_visual.reset_batch()
-            for w in waveforms:
-                self._plot_spike(w)
-                self._waveform_times.append(
-                    (w.start_time, w.spike_id, w.spike_cluster, w.get('channel_ids', None)))
-            self.canvas.update_visual(self.waveform_visual)
-        else:  # pragma: no cover
+        if isinstance(waveforms, list):
+            # List of waveforms, one per spike.
+            self._waveform_times = Bunch(
+                start_times=np.array([w.start_time for w in waveforms]),
+                spike_ids=np.array([w.spike_id for w in waveforms], dtype=np.int64),
+                spike_clusters=np.array([w.spike_cluster for w in waveforms], dtype=np.int64),
+                spike_index=np.repeat(
+                    np.arange(len(waveforms)), [len(w.channel_ids) for w in waveforms]),
+                channel_ids=np.concatenate(
+                    [w.channel_ids for w in waveforms]) if waveforms else np.array([]),
+            )
+            if waveforms:
+                self.waveform_visual.show()
+                self.waveform_visual.reset_batch()
+                for w in waveforms:
+                    self._plot_spike(w)
+                self.canvas.update_visual(self.waveform_visual)
+            else:  # pragma: no cover
+                self.waveform_visual.hide()
+            return
+        # All waveforms at once, uploaded in a single batch.
+        self._waveform_times = waveforms
+        if not len(waveforms.spike_ids):
             self.waveform_visual.hide()
+            return
+        n_signals, n_samples = waveforms.data.shape
+
+        # The spike time corresponds to the first sample of the waveform.
+        t = waveforms.start_times[waveforms.spike_index, np.newaxis] + (
+            self.dt * np.arange(n_samples))
+
+        # Determine the spike colors, once per cluster.
+        cs = self.color_schemes.get()
+        keys, inverse = np.unique(
+            np.c_[waveforms.select_index, waveforms.spike_clusters], axis=0, return_inverse=True)
+        colors = np.array([
+            selected_cluster_color(i, alpha=1) if i >= 0 else cs.get(c, alpha=1)
+            for i, c in keys])
+        color = colors[inverse.ravel()][waveforms.spike_index]
+
+        # The box index depends on the channel.
+        box_index = np.repeat(self.channel_y_ranks[waveforms.channel_ids], n_samples)
+
+        self.waveform_visual.show()
+        self.waveform_visual.reset_batch()
+        self.canvas.update_visual(
+            self.waveform_visual, x=t, y=waveforms.data, color=color,
+            data_bounds=self.data_bounds, box_index=box_index)
 
     def _plot_labels(self, traces):
         self.text_visual.reset_batch()
@@ -338,9 +476,14 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
         return start, end
 
     def plot(self, update_traces=True, update_waveforms=True):
-        if update_waveforms:
+        traces = self._traces
+        if update_traces or traces is None or (
+                update_waveforms and self.spike_waveforms is None):
             # Load the traces in the interval.
-            traces = self.traces(self._interval)
+            traces = self._traces = self.traces(self._interval)
+        elif update_waveforms and traces.get('times', None) is None:
+            # Only update the spike waveforms on top of the last loaded traces.
+            traces = Bunch(traces, waveforms=self.spike_waveforms(self._interval, traces.data))
 
         if update_traces:
             logger.log(5, "Redraw the entire trace view.")
@@ -355,11 +498,11 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
             self.data_bounds = (start, ymin, end, ymax)
 
             # Used for spike click.
-            self._waveform_times = []
+            self._waveform_times = None
 
             # Plot the traces.
             self._plot_traces(
-                traces.data, color=traces.get('color', None))
+                traces.data, color=traces.get('color', None), times=traces.get('times', None))
 
             # Plot the labels.
             if self.do_show_labels:
@@ -392,7 +535,7 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
         self.cluster_ids = cluster_ids
         if not cluster_ids:
             return
-        # Make sure we call again self.traces() when the cluster selection changes.
+        # Update the spike waveforms when the cluster selection changes.
         self.set_interval()
 
     def attach(self, gui):
@@ -608,18 +751,20 @@ class TraceView(ScalingMixin, BaseColorView, ManualClusteringView):
             # Find the spike and cluster closest to the mouse.
             db = self.data_bounds
             # Get the information about the displayed spikes.
-            wt = [(t, s, c, ch) for t, s, c, ch in self._waveform_times if channel_id in ch]
-            if not wt:
+            wt = self._waveform_times
+            if wt is None:
+                return
+            on_channel = np.unique(wt.spike_index[np.isin(wt.channel_ids, channel_id)])
+            if not len(on_channel):
                 return
             # Get the time coordinate of the mouse position.
             mouse_pos = self.canvas.panzoom.window_to_ndc(e.pos)
             mouse_time = Range(NDC, db).apply(mouse_pos)[0][0]
             # Get the closest spike id.
-            times, spike_ids, spike_clusters, channel_ids = zip(*wt)
-            i = np.argmin(np.abs(np.array(times) - mouse_time))
+            i = on_channel[np.argmin(np.abs(wt.start_times[on_channel] - mouse_time))]
             # Raise the select_spike event.
-            spike_id = spike_ids[i]
-            cluster_id = spike_clusters[i]
+            spike_id = int(wt.spike_ids[i])
+            cluster_id = int(wt.spike_clusters[i])
             emit('select_spike', self, channel_id=channel_id,
                  spike_id=spike_id, cluster_id=cluster_id)
 
@@ -703,7 +848,7 @@ class TraceImageView(TraceView):
     # Internal methods
     # -------------------------------------------------------------------------
 
-    def _plot_traces(self, traces, color=None):
+    def _plot_traces(self, traces, color=None, times=None):
         traces = traces.T
         n_samples = traces.shape[1]
         n_ch = self.n_channels
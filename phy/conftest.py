@@ -11,6 +11,7 @@ import numpy as np
 import warnings
 
 import matplotlib
+import pytest
 
 from phylib import add_default_handler
 from phylib.conftest import *  # noqa
@@ -33,8 +34,26 @@ warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
 
 
 def pytest_addoption(parser):
-    """Repeat option."""
+    """Repeat and benchmark options."""
     parser.addoption('--repeat', action='store', help='Number of times to repeat each test')
+    parser.addoption(
+        '--benchmark', action='store_true', default=False,
+        help='Also run the long benchmarks marked with `@mark.benchmark`')
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'benchmark: long benchmark, only run with the --benchmark option')
+
+
+def pytest_collection_modifyitems(config, items):
+    # Skip the long benchmarks by default.
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason="use the --benchmark option to run the long benchmarks")
+    for item in items:
+        if item.get_closest_marker('benchmark'):
+            item.add_marker(skip)
 
 
 def pytest_generate_tests(metafunc):  # pragma: no cover
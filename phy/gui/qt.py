@@ -30,13 +30,13 @@ from OpenGL import GL  # noqa
 
 from PyQt5.QtCore import (Qt, QByteArray, QMetaObject, QObject,  # noqa
                           QVariant, QEventLoop, QTimer, QPoint, QTimer,
-                          QThreadPool, QRunnable,
+                          QThreadPool, QRunnable, QAbstractTableModel, QModelIndex,
                           pyqtSignal, pyqtSlot, QSize, QUrl,
                           QEvent, QCoreApplication,
                           qInstallMessageHandler,
                           )
 from PyQt5.QtGui import (  # noqa
-    QKeySequence, QIcon, QColor, QMouseEvent, QGuiApplication,
+    QKeySequence, QIcon, QColor, QBrush, QFont, QMouseEvent, QGuiApplication,
     QFontDatabase, QWindow, QOpenGLWindow)
 from PyQt5.QtWebEngineWidgets import (QWebEngineView,  # noqa
                                       QWebEnginePage,
@@ -49,7 +49,7 @@ from PyQt5.QtWidgets import (# noqa
     QPushButton, QLabel, QCheckBox, QPlainTextEdit,
     QLineEdit, QSlider, QSpinBox, QDoubleSpinBox,
     QMessageBox, QApplication, QMenu, QMenuBar,
-    QInputDialog, QOpenGLWidget)
+    QInputDialog, QOpenGLWidget, QTableView, QHeaderView, QAbstractItemView)
 
 # Enable high DPI support.
 # BUG: uncommenting this create scaling bugs on high DPI screens
@@ -14,7 +14,9 @@ from phylib.utils import connect, unconnect
 from phylib.utils.testing import captured_logging
 import phy
 from .test_qt import _block
-from ..widgets import HTMLWidget, Table, Barrier, IPythonView, KeyValueWidget
+from ..qt import Qt
+from ..widgets import (
+    HTMLWidget, Table, TableChanges, Barrier, IPythonView, KeyValueWidget, _filter_expression)
 
 
 #------------------------------------------------------------------------------
@@ -45,10 +47,7 @@ def table(qtbot):
              "float": float(i),
              "is_masked": True if i in (2, 3, 5) else False,
              } for i in range(10)]
-    table = Table(
-        columns=columns,
-        value_names=['id', 'count', {'data': ['is_masked']}],
-        data=data)
+    table = Table(columns=columns, data=data)
     _wait_until_table_ready(qtbot, table)
 
     yield table
@@ -221,17 +220,22 @@ def test_barrier_1(qtbot, table):
     table.select([1])
 
     b = Barrier()
-    table.get_selected(b(1))
-    table.get_next_id(b(2))
+    callback_1, callback_2 = b(1), b(2)
     assert not b.have_all_finished()
 
+    _l = []
+
     @b.after_all_finished
     def after():
         assert b.result(1)[0][0] == [1]
         assert b.result(2)[0][0] == 4
+        _l.append(0)
 
+    table.get_selected(callback_1)
+    table.get_next_id(callback_2)
     b.wait()
     assert b.result(1) and b.result(2)
+    assert _l == [0]
 
 
 def test_table_empty_1(qtbot):
@@ -270,14 +274,9 @@ def test_table_scroll(qtbot, table):
 def test_table_busy(qtbot, table):
     table.select([1, 2])
     table.set_busy(True)
-    _l = []
-
-    def callback(out):
-        _l.append(out)
-
-    table.eval_js('table.debouncer.isBusy', callback=callback)
-    _block(lambda: _l == [True])
+    assert table._is_busy
     table.set_busy(False)
+    assert not table._is_busy
 
 
 def test_table_duplicates(qtbot, table):
@@ -319,18 +318,35 @@ def test_table_nav_0(qtbot, table):
     _assert(table.get_selected, [4])
 
 
-def test_table_nav_1(qtbot, table):
+def test_table_nav_end(qtbot, table):
+    table.select([9])
+    assert table.next() is None
+    _assert(table.get_selected, [9])
+
+    table.select([0])
+    assert table.previous() is None
+    _assert(table.get_selected, [0])
+
+
+def test_table_click(qtbot, table):
     _sel = []
 
     @connect(sender=table)
-    def on_some_event(sender, items, **kwargs):
-        _sel.append(items)
+    def on_select(sender, obj):
+        _sel.append(obj['selected'])
 
-    table.eval_js('table.emit("some_event", 123);')
+    def _click(id, modifier=Qt.NoModifier):
+        rect = table.view.visualRect(table.model.index(table.model.row(id), 0))
+        qtbot.mouseClick(table.view.viewport(), Qt.LeftButton, modifier, rect.center())
 
-    _block(lambda: _sel == [123])
+    _click(1)
+    _click(4, Qt.ControlModifier)
+    _click(6, Qt.ShiftModifier)
+    _click(1, Qt.ControlModifier)
+    _block(lambda: _sel[-1:] == [[4, 5, 6]])
+    assert _sel[:3] == [[1], [1, 4], [1, 4, 5, 6]]
 
-    unconnect(on_some_event)
+    unconnect(on_select)
 
 
 def test_table_sort(qtbot, table):
@@ -391,6 +407,48 @@ def test_table_add_change_remove(qtbot, table):
     _assert(partial(table.get, 100), {'id': 100, 'count': 2000})
 
 
+def test_table_changes():
+    changes = TableChanges()
+    assert not changes
+
+    changes.add([{'id': 10, 'count': 1}])
+    changes.change([{'id': 10, 'count': 2}, {'id': 3, 'count': 4, 'is_masked': True}])
+    assert changes.added == {10: {'id': 10, 'count': 2}}
+    assert changes.changed == {'count': {3: 4}, 'is_masked': {3: True}}
+
+    changes.remove([3, 10])
+    assert not changes.added
+    assert not changes.changed_ids
+    assert changes.removed == {3, 10}
+
+    # A removed row can be added again.
+    changes.add([{'id': 3}])
+    assert changes.added == {3: {'id': 3}}
+
+
+def test_table_changes_coalesced(qtbot, table):
+    _resets = []
+    table.model.modelReset.connect(lambda: _resets.append(0))
+
+    table.add({'id': 100, 'count': 1000})
+    table.remove([0, 1])
+    table.change([{'id': 100, 'count': 2000}, {'id': 2, 'is_masked': False}])
+    table.add([{'id': 101, 'count': 0}])
+    # The changes are not applied yet.
+    assert table.model.ids == list(range(10))
+
+    # The changes are applied in a single pass at the next iteration of the event loop.
+    _block(lambda: _resets == [0])
+    assert table.model.ids == list(range(2, 10)) + [100, 101]
+    assert table.get(100)['count'] == 2000
+    assert not table.model.is_masked(2)
+
+    # Changing cells that do not affect the sort only repaints the changed rows.
+    table.change([{'id': 3, 'count': 0}])
+    _assert(table.get_ids, list(range(2, 10)) + [100, 101])
+    assert _resets == [0]
+
+
 def test_table_change_and_sort_1(qtbot, table):
     table.change([{'id': 5, 'count': 1000}])
     _assert(table.get_ids, list(range(10)))
@@ -405,6 +463,15 @@ def test_table_change_and_sort_2(qtbot, table):
     _assert(table.get_ids, [9, 8, 7, 6, 4, 3, 2, 1, 0, 5])
 
 
+def test_filter_expression():
+    assert _filter_expression("id >= 2 && !(id === 4)") == "id >= 2  and   not (id == 4)"
+    # The string literals are not translated.
+    assert _filter_expression('label == "bad!" || x != \'a && b\'') == (
+        'label == "bad!"  or  x != \'a && b\'')
+    assert _filter_expression(r'label == "say \"no!\"" && true') == (
+        r'label == "say \"no!\""  and  True')
+
+
 def test_table_filter(qtbot, table):
     table.filter("id == 5")
     _assert(table.get_ids, [5])
@@ -414,3 +481,43 @@ def test_table_filter(qtbot, table):
 
     table.filter()
     _assert(table.get_ids, list(range(10)))
+
+
+def test_table_filter_js(qtbot, table):
+    _l = []
+
+    @connect(sender=table)
+    def on_table_filter(sender, row_ids):
+        _l.append(row_ids)
+
+    # Javascript operators are supported.
+    table.filter("id >= 2 && (count > 50 || is_masked === true) && !(id == 4)")
+    _assert(table.get_ids, [2, 3, 5])
+
+    # Missing values do not match the filter.
+    table.add({'id': 10})
+    _assert(table.get_ids, [2, 3, 5])
+
+    # Invalid expressions are ignored.
+    table.filter("id >")
+    _assert(table.get_ids, [2, 3, 5])
+
+    table.filter()
+    assert _l == [[2, 3, 5], list(range(11))]
+
+    unconnect(on_table_filter)
+
+
+def test_table_sort_strings(qtbot):
+    table = Table(columns=['id', 'group'], data=[
+        {'id': 0, 'group': 'mua'}, {'id': 1, 'group': None}, {'id': 2, 'group': 'good'},
+        {'id': 3, 'group': 'noise'}], sort=('group', 'asc'))
+    _wait_until_table_ready(qtbot, table)
+    _assert(table.get_ids, [1, 2, 0, 3])
+
+    # Sort by clicking on the column header.
+    table.view.horizontalHeader().setSortIndicator(1, Qt.DescendingOrder)
+    _assert(table.get_current_sort, ['group', 'desc'])
+    _assert(table.get_ids, [3, 0, 2, 1])
+
+    table.close()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-"""HTML widgets for GUIs."""
+"""HTML and table widgets for GUIs."""
 
 
 # -----------------------------------------------------------------------------
@@ -10,17 +10,21 @@
 import json
 import logging
 from functools import partial
+import re
+
+import numpy as np
 
 from qtconsole.rich_jupyter_widget import RichJupyterWidget
 from qtconsole.inprocess import QtInProcessKernelManager
 
 from .qt import (
-    WebView, QObject, QWebChannel, QWidget, QGridLayout, QPlainTextEdit,
-    QLabel, QLineEdit, QCheckBox, QSpinBox, QDoubleSpinBox,
+    WebView, QObject, QWebChannel, QWidget, QGridLayout, QVBoxLayout, QPlainTextEdit,
+    QLabel, QLineEdit, QCheckBox, QSpinBox, QDoubleSpinBox, QTableView, QAbstractItemView,
+    QAbstractTableModel, QModelIndex, QApplication, QColor, QBrush, QFont, QTimer, Qt,
     pyqtSlot, _static_abs_path, _block, Debouncer)
 from phylib.utils import emit, connect
 from phy.utils.color import colormaps, _is_bright
-from phylib.utils._misc import _CustomEncoder, read_text, _pretty_floats
+from phylib.utils._misc import read_text
 from phylib.utils._types import _is_integer
 
 logger = logging.getLogger(__name__)
@@ -165,6 +169,18 @@ def _uniq(seq):
     return [int(x) for x in seq if not (x in seen or seen_add(x))]
 
 
+def _as_list(objects):
+    """Accept a single object or a list of objects."""
+    return [objects] if isinstance(objects, dict) else list(objects)
+
+
+def _call(callback, output):
+    """Call a callback function with the output of a table method, and return the output."""
+    if callback:
+        callback(output)
+    return output
+
+
 class Barrier(object):
     """Implement a synchronization barrier."""
 
@@ -336,216 +352,731 @@ class HTMLWidget(WebView):
 
 
 # -----------------------------------------------------------------------------
-# HTML table
+# Table
 # -----------------------------------------------------------------------------
 
-def dumps(o):
-    """Dump a JSON object into a string, with pretty floats."""
-    return json.dumps(_pretty_floats(o), cls=_CustomEncoder)
+# Javascript operators supported in filter expressions, for backward compatibility.
+_JS_OPERATORS = (
+    (r'!==', '!='), (r'===', '=='), (r'&&', ' and '), (r'\|\|', ' or '), (r'!(?!=)', ' not '),
+    (r'\btrue\b', 'True'), (r'\bfalse\b', 'False'), (r'\bnull\b', 'None'),
+)
+
+# Functions that can be used in filter expressions.
+_FILTER_BUILTINS = {'abs': abs, 'min': min, 'max': max, 'len': len, 'round': round}
+
+
+# String literals in filter expressions, where the Javascript operators are not translated.
+_STRING_LITERAL = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+
+
+def _filter_expression(text):
+    """Convert a filter expression, possibly using Javascript operators, into a Python
+    expression. The string literals are left unchanged."""
+    # The odd items are the string literals.
+    parts = _STRING_LITERAL.split(text)
+    for i in range(0, len(parts), 2):
+        for js, py in _JS_OPERATORS:
+            parts[i] = re.sub(js, py, parts[i])
+    return ''.join(parts).strip()
+
+
+def _compile_filter(text):
+    """Compile a filter expression, or return None if the expression is invalid."""
+    try:
+        return compile(_filter_expression(text), '<filter>', 'eval')
+    except SyntaxError:
+        logger.warning("Invalid filter expression `%s`.", text)
+
+
+def _sort_keys(values):
+    """Return an array of sortable keys: the values if they are all numbers (missing values are
+    NaN), or the ranks of their string representations otherwise."""
+    try:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        strings = np.array(['' if v is None else str(v) for v in values])
+        return np.unique(strings, return_inverse=True)[1].astype(np.float64)
+
+
+def _format_value(value):
+    """Format a value in a table cell."""
+    if value is None:
+        return ''
+    elif isinstance(value, (float, np.floating)):
+        return '%.2f' % value
+    return str(value)
 
 
-def _color_styles():
-    """Use colormap colors in table widget."""
-    return '\n'.join(
-        '''
-        #table .color-%d > td[class='id'] {
-            background-color: rgb(%d, %d, %d);
-            %s
-        }
-        ''' % (i, r, g, b, 'color: #000 !important;' if _is_bright((r, g, b)) else '')
-        for i, (r, g, b) in enumerate(colormaps.default * 255))
+def _qcolor(color):
+    """Return a QColor from a color name or a RGB tuple with values in [0, 1]."""
+    if isinstance(color, str):
+        return QColor(color)
+    return QColor(*(int(round(255 * c)) for c in color[:3]))
 
 
-class Table(HTMLWidget):
-    """A sortable table with support for selection. Derives from HTMLWidget.
+class TableChanges(object):
+    """Changes of the rows of a table, coalesced so that they can be applied in a single pass.
 
-    This table uses the following Javascript implementation: https://github.com/kwikteam/tablejs
-    This Javascript class builds upon ListJS: https://listjs.com/
+    The changed cells are stored per column, as `{column: {id: value}}`.
 
     """
+    __slots__ = ('added', 'removed', 'changed')
 
-    _ready = False
+    def __init__(self):
+        self.added = {}  # mapping {id: row}
+        self.removed = set()  # removed ids
+        self.changed = {}  # mapping {column: {id: value}}
+
+    def add(self, rows):
+        """Add new rows."""
+        for row in rows:
+            self.added[row['id']] = dict(row)
+
+    def change(self, rows):
+        """Change some fields of existing or added rows."""
+        for row in rows:
+            id = row['id']
+            if id in self.added:
+                self.added[id].update(row)
+                continue
+            for column, value in row.items():
+                if column != 'id':
+                    self.changed.setdefault(column, {})[id] = value
 
-    def __init__(
-            self, *args, columns=None, value_names=None, data=None, sort=None, title='',
-            debounce_events=()):
-        super(Table, self).__init__(*args, title=title, debounce_events=debounce_events)
-        self._init_table(columns=columns, value_names=value_names, data=data, sort=sort)
+    def remove(self, ids):
+        """Remove rows."""
+        for id in ids:
+            self.added.pop(id, None)
+            for values in self.changed.values():
+                values.pop(id, None)
+            self.removed.add(id)
 
-    def eval_js(self, expr, callback=None):
-        """Evaluate a Javascript expression.
+    @property
+    def changed_ids(self):
+        """Set of the ids of the changed rows."""
+        return set().union(*self.changed.values())
 
-        The `table` Javascript variable can be used to interact with the underlying Javascript
-        table.
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed_ids)
 
-        The table has sortable columns, a filter text box, support for single and multi selection
-        of rows. Rows can be skippable (used for ignored clusters in phy).
 
-        The table can raise Javascript events that are relayed to Python. Objects are
-        transparently serialized and deserialized in JSON. Basic types (numbers, strings, lists)
-        are transparently converted between Python and Javascript.
+class TableModel(QAbstractTableModel):
+    """Qt model with the rows of a Table.
 
-        Parameters
-        ----------
+    Rows are dictionaries with an integer `id` field and any other fields, stored in insertion
+    order. Only the rows matching the current filter are shown, in the order of the current
+    sort, so that the view only needs to access the shown rows it displays.
 
-        expr : str
-            A Javascript expression.
-        callback : function
-            A Python function that is called once the Javascript expression has been
-            evaluated. It takes as input the output of the Javascript expression.
+    """
+    def __init__(self, table, columns=None):
+        super(TableModel, self).__init__(table)
+        self._table = table
+        self.columns = list(columns or ['id'])
+        self._rows = []  # list of dictionaries
+        self._index = {}  # mapping {id: position in self._rows}
+        self._order = np.zeros(0, dtype=np.int64)  # positions of the shown rows in self._rows
+        self._shown = {}  # mapping {id: shown row index}
+        self.sort = None  # pair (column, 'asc' or 'desc')
+        self.filter = None  # compiled filter expression
+        self.selected = []  # selected ids, in selection order
+        self.selected_index_offset = 0
+
+    # Data
+    # -------------------------------------------------------------------------
+
+    def _reindex(self):
+        self._index = {row['id']: i for i, row in enumerate(self._rows)}
+
+    def set_rows(self, rows):
+        """Replace all rows."""
+        self._rows = [dict(row) for row in rows]
+        self._reindex()
+        self.update()
+
+    def apply_changes(self, changes):
+        """Apply a TableChanges instance: remove, add, and change rows in a single pass.
+
+        The shown rows are only sorted and filtered again if needed, otherwise only the
+        changed rows are repainted.
 
         """
-        # Avoid JS errors when the table is not yet fully loaded.
-        expr = 'if (typeof table !== "undefined") ' + expr
-        return super(Table, self).eval_js(expr, callback=callback)
+        if changes.removed:
+            self._rows = [row for row in self._rows if row['id'] not in changes.removed]
+            self._reindex()
+            self.selected = [id for id in self.selected if id not in changes.removed]
+        for id, row in changes.added.items():
+            if id in self._index:
+                self._rows[self._index[id]] = row
+            else:
+                self._index[id] = len(self._rows)
+                self._rows.append(row)
+        for column, values in changes.changed.items():
+            for id, value in values.items():
+                i = self._index.get(id, None)
+                if i is not None:
+                    self._rows[i][column] = value
+
+        columns = set(changes.changed)
+        if (changes.added or changes.removed or
+                (self.sort and self.sort[0] in columns) or
+                (self.filter is not None and columns.intersection(self.filter.co_names))):
+            self.update()
+            return
+        rows = [self._shown[id] for id in changes.changed_ids if id in self._shown]
+        if rows:
+            self.dataChanged.emit(
+                self.index(min(rows), 0), self.index(max(rows), len(self.columns) - 1))
 
-    def _init_table(self, columns=None, value_names=None, data=None, sort=None):
-        """Build the table."""
+    def get(self, id):
+        """Return a copy of a row, or None if it does not exist."""
+        i = self._index.get(id, None)
+        return dict(self._rows[i]) if i is not None else None
 
-        columns = columns or ['id']
-        value_names = value_names or columns
-        data = data or []
+    def __contains__(self, id):
+        return id in self._index
 
-        b = self.builder
-        b.set_body_src('index.html')
+    # Sort and filter
+    # -------------------------------------------------------------------------
 
-        b.add_style(_color_styles())
+    def _filter_mask(self):
+        """Return the boolean mask of the rows matching the current filter."""
+        names = [n for n in self.filter.co_names if n not in _FILTER_BUILTINS]
+        glob = {'__builtins__': _FILTER_BUILTINS}
+        mask = np.zeros(len(self._rows), dtype=bool)
+        for i, row in enumerate(self._rows):
+            try:
+                mask[i] = bool(eval(self.filter, glob, {n: row.get(n) for n in names}))
+            except Exception:
+                # Comparisons with missing values are false, like in Javascript.
+                pass
+        return mask
+
+    def _sorted_positions(self):
+        """Return the positions of all rows in the order of the current sort."""
+        n = len(self._rows)
+        if not self.sort or self.sort[0] is None:
+            return np.arange(n, dtype=np.int64)
+        name, sort_dir = self.sort
+        keys = _sort_keys([row.get(name, None) for row in self._rows])
+        # NOTE: stable sort, and missing values last in both directions.
+        return np.argsort(keys if sort_dir == 'asc' else -keys, kind='stable').astype(np.int64)
+
+    def update(self):
+        """Recompute the shown rows after a change in the data, the sort, or the filter."""
+        self.beginResetModel()
+        order = self._sorted_positions()
+        if self.filter is not None:
+            order = order[self._filter_mask()[order]]
+        self._order = order
+        self._shown = {self._rows[i]['id']: row for row, i in enumerate(order)}
+        self.endResetModel()
 
-        self.data = data
-        self.columns = columns
-        self.value_names = value_names
+    @property
+    def ids(self):
+        """List of the shown ids, in the current order."""
+        return [self._rows[i]['id'] for i in self._order]
+
+    def row(self, id):
+        """Return the index of the shown row with a given id, or None if it is not shown."""
+        return self._shown.get(id, None)
+
+    def id(self, row):
+        """Return the id of the shown row at a given index."""
+        return self._rows[self._order[row]]['id']
+
+    def is_masked(self, id):
+        """Return whether a row is masked, that is, skipped by next and previous."""
+        i = self._index.get(id, None)
+        return i is not None and bool(self._rows[i].get('is_masked', False))
+
+    # Qt model interface
+    # -------------------------------------------------------------------------
 
-        emit('pre_build', self)
+    def refresh(self):
+        """Repaint the shown rows, for example after a selection change."""
+        if len(self._order):
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(len(self._order) - 1, len(self.columns) - 1))
 
-        data_json = dumps(self.data)
-        columns_json = dumps(self.columns)
-        value_names_json = dumps(self.value_names)
-        sort_json = dumps(sort)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._order)
 
-        b.body += '''
-        <script>
-            var data = %s;
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
 
-            var options = {
-              valueNames: %s,
-              columns: %s,
-              sort: %s,
-            };
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
 
-            var table = new Table('table', options, data);
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return
+        row = self._rows[self._order[index.row()]]
+        name = self.columns[index.column()]
+        if role == Qt.DisplayRole:
+            return _format_value(row.get(name, None))
+        elif role in (Qt.ForegroundRole, Qt.BackgroundRole, Qt.FontRole):
+            try:
+                pos = self.selected.index(row['id'])
+            except ValueError:
+                pos = None
+            return self._table._cell_style(row, name, pos, role)
+
+
+class _FilterLineEdit(QLineEdit):
+    """Filter text box of the table, cleared with the Escape key."""
+    def keyPressEvent(self, e):
+        if e.key() == Qt.Key_Escape:
+            self.clear()
+            self.returnPressed.emit()
+            return
+        super(_FilterLineEdit, self).keyPressEvent(e)
+
+
+_TABLE_STYLESHEET = '''
+    * {
+        font-size: 8pt;
+        background-color: black;
+        color: white;
+    }
+
+    QLineEdit {
+        border: 1px solid #ddd;
+        padding: 3px;
+    }
+
+    QHeaderView::section {
+        background-color: black;
+        color: white;
+        border: 0;
+        padding: 4px 5px;
+        font-weight: bold;
+    }
+'''
 
-        </script>
-        ''' % (data_json, value_names_json, columns_json, sort_json)
-        self.build(lambda html: emit('ready', self))
 
-        connect(event='select', sender=self, func=lambda *args: self.update(), last=True)
-        connect(event='ready', sender=self, func=lambda *args: self._set_ready())
+class Table(QWidget):
+    """A sortable table with support for selection, using a Qt model/view with virtual
+    scrolling so that only the visible rows are rendered.
+
+    The table has sortable columns, a filter text box, support for single and multi selection
+    of rows. Rows can be skippable (used for ignored clusters in phy). The methods accept
+    an optional callback function, called with the output of the method, for compatibility
+    with the previous asynchronous HTML implementation.
+
+    Constructor
+    ------------
+
+    parent : Widget
+    columns : list
+        List of column names. The first column should be `id`.
+    data : list
+        List of dictionaries with an `id` integer field, and one field per column. The row
+        is masked if the `is_masked` field is true.
+    sort : 2-tuple
+        Initial sort as a pair `(column_name, order)` where `order` is either `asc` or `desc`.
+    title : str
+        Window title.
+    debounce_events : list-like
+        The list of event names, raised by the table, that should be debounced.
+
+    Events
+    ------
+
+    * `ready()`: when the table has been created.
+    * `select(obj)`: when rows are selected, `obj` is a dictionary with the keys `selected`
+      (the list of selected ids), `next` (the id of the next non-skipped row), and `kwargs`.
+    * `table_sort(ids)`: when the sort changes, with the ordered list of shown ids.
+    * `table_filter(ids)`: when the filter changes, with the ordered list of shown ids.
+
+    """
+
+    _ready = False
+    _masked_color = '#888'
+    _selected_color = '#444'
+
+    def __init__(
+            self, *args, columns=None, data=None, sort=None, title='', debounce_events=()):
+        super(Table, self).__init__(*args)
+        self._init_widget(title=title, debounce_events=debounce_events)
+        self._init_table(columns=columns, data=data, sort=sort)
+
+    def _init_widget(self, title='', debounce_events=()):
+        """Create the filter text box and the table view."""
+        self.setWindowTitle(title)
+        self._debouncer = Debouncer()
+        self._debounce_events = debounce_events
+        self._is_busy = False
+        self._pending = None  # pending TableChanges instance
+
+        self.model = TableModel(self)
+
+        self._filter_edit = _FilterLineEdit(self)
+        self._filter_edit.setPlaceholderText('filter')
+        self._filter_edit.returnPressed.connect(
+            lambda: self.filter(self._filter_edit.text(), update_text=False))
+
+        self.view = QTableView(self)
+        self.view.setModel(self.model)
+        self.view.setShowGrid(False)
+        self.view.setWordWrap(False)
+        self.view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.view.verticalHeader().hide()
+        self.view.verticalHeader().setDefaultSectionSize(20)
+        header = self.view.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(True)
+        header.setHighlightSections(False)
+        header.setStretchLastSection(True)
+        header.sortIndicatorChanged.connect(self._on_sort_indicator_changed)
+        self.view.clicked.connect(self._on_click)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.addWidget(self._filter_edit)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+        self.setStyleSheet(_TABLE_STYLESHEET)
+
+    def _init_table(self, columns=None, data=None, sort=None):
+        """Build the table."""
+        columns = columns or ['id']
+        data = data or []
+
+        self.columns = columns
+        self._pending = None
+        self.model.beginResetModel()
+        self.model.columns = list(columns)
+        self.model.endResetModel()
+        self._set_sort(*(sort or (None, None)))
+        self.model.set_rows(data)
+        self.view.resizeColumnsToContents()
+
+        # NOTE: emit the ready event asynchronously, once the caller has connected to it.
+        QTimer.singleShot(0, self._set_ready)
 
     def _set_ready(self):
         """Set the widget as ready."""
         self._ready = True
+        emit('ready', self)
 
     def is_ready(self):
         """Whether the widget has been fully loaded."""
         return self._ready
 
+    @property
+    def debouncer(self):
+        """Widget debouncer."""
+        return self._debouncer
+
+    def _emit(self, name, *args, **kwargs):
+        """Emit an event, debounced if needed."""
+        if name in self._debounce_events:
+            self._debouncer.submit(emit, name, self, *args, **kwargs)
+        else:
+            emit(name, self, *args, **kwargs)
+
+    # Styling
+    # -------------------------------------------------------------------------
+
+    def _row_color(self, row):
+        """Return the text color of a row, or None for the default color."""
+        if row.get('is_masked', False):
+            return self._masked_color
+
+    def _cell_style(self, row, column, selected_pos, role):
+        """Return the foreground, background, or font of a cell. `selected_pos` is the position
+        of the row in the selection, or None if it is not selected."""
+        if selected_pos is None:
+            color = self._row_color(row) if role == Qt.ForegroundRole else None
+            return QBrush(_qcolor(color)) if color else None
+        if column != 'id':
+            if role == Qt.BackgroundRole:
+                return QBrush(_qcolor(self._selected_color))
+            color = self._row_color(row) if role == Qt.ForegroundRole else None
+            return QBrush(_qcolor(color)) if color else None
+        # The id cell of selected rows has the color of the cluster in the views.
+        i = (selected_pos + self.model.selected_index_offset) % len(colormaps.default)
+        rgb = colormaps.default[i]
+        if role == Qt.BackgroundRole:
+            return QBrush(_qcolor(rgb))
+        elif role == Qt.ForegroundRole:
+            return QBrush(QColor('black' if _is_bright(rgb * 255) else 'white'))
+        elif role == Qt.FontRole:
+            font = QFont()
+            font.setBold(True)
+            return font
+
+    # Mouse interactions
+    # -------------------------------------------------------------------------
+
+    def _on_click(self, index):
+        """Select rows with the mouse, with support for the Control and Shift modifiers."""
+        id = self.model.id(index.row())
+        modifiers = QApplication.keyboardModifiers()
+        if modifiers & (Qt.ControlModifier | Qt.MetaModifier):
+            self.select_toggle(id)
+        elif modifiers & Qt.ShiftModifier:
+            self.select_until(id)
+        else:
+            self.select([id])
+
+    def _on_sort_indicator_changed(self, column, order):
+        """Sort the table when clicking on a column header."""
+        self.sort_by(self.columns[column], 'asc' if order == Qt.AscendingOrder else 'desc')
+
+    # Sort and filter
+    # -------------------------------------------------------------------------
+
+    def _set_sort(self, name, sort_dir='asc'):
+        """Set the sort, and update the sort indicator in the header."""
+        header = self.view.horizontalHeader()
+        header.blockSignals(True)
+        if name in self.columns:
+            header.setSortIndicator(
+                self.columns.index(name),
+                Qt.AscendingOrder if sort_dir == 'asc' else Qt.DescendingOrder)
+        else:
+            header.setSortIndicator(-1, Qt.AscendingOrder)
+        header.blockSignals(False)
+        self.model.sort = (name, sort_dir) if name else None
+
     def sort_by(self, name, sort_dir='asc'):
         """Sort by a given variable."""
+        self._flush()
         logger.log(5, "Sort by `%s` %s.", name, sort_dir)
-        self.eval_js('table.sort_("{}", "{}");'.format(name, sort_dir))
+        self._set_sort(name, sort_dir)
+        self.model.update()
+        self._emit('table_sort', self.model.ids)
+
+    def filter(self, text='', update_text=True):
+        """Filter the view with a boolean expression on the column names.
 
-    def filter(self, text=''):
-        """Filter the view with a Javascript expression."""
+        The expression is a Python expression, where the Javascript operators `&&`, `||`, `!`
+        are also supported, for example: `group != 'noise' && n_spikes > 1000`.
+
+        """
+        self._flush()
         logger.log(5, "Filter table with `%s`.", text)
-        self.eval_js('table.filter_("{}", true);'.format(text))
+        if update_text:
+            self._filter_edit.setText(text)
+        code = _compile_filter(text) if text else None
+        if text and code is None:
+            return
+        self.model.filter = code
+        self.model.update()
+        self._emit('table_filter', self.model.ids)
+
+    # Navigation
+    # -------------------------------------------------------------------------
+
+    def _sibling_id(self, id=None, dir='next'):
+        """Return the id of the next or previous non-masked shown row."""
+        if id is None:
+            id = self.model.selected[0] if self.model.selected else None
+        row = self.model.row(id) if id is not None else None
+        if row is None:
+            return None
+        step = 1 if dir == 'next' else -1
+        row += step
+        while 0 <= row < self.model.rowCount():
+            sibling = self.model.id(row)
+            if not self.model.is_masked(sibling):
+                return sibling
+            row += step
+
+    def _selected_and_next(self, kwargs=None):
+        selected = list(self.model.selected)
+        next = self._sibling_id(selected[-1]) if selected else None
+        return {'selected': selected, 'next': next, 'kwargs': dict(kwargs or {})}
+
+    def _emit_selected(self, kwargs=None):
+        """Repaint the selection and emit the select event."""
+        self.model.refresh()
+        obj = self._selected_and_next(kwargs)
+        self._emit('select', obj)
+        return obj
+
+    def _select_first_or_last(self, dir='next'):
+        """Select the first or last non-masked row."""
+        n = self.model.rowCount()
+        if n == 0:
+            return
+        id = self.model.id(0 if dir == 'next' else n - 1)
+        if self.model.is_masked(id):
+            id = self._sibling_id(id, dir=dir)
+        return self.select([id] if id is not None else [])
+
+    def _move_to_sibling(self, dir='next'):
+        """Select the next or previous non-masked row. Return None if there is no such row."""
+        if not self.model.selected:
+            return self._select_first_or_last('next')
+        id = self._sibling_id(dir=dir)
+        if id is None:
+            return
+        return self.select([id])
 
     def get_ids(self, callback=None):
         """Get the list of ids."""
-        self.eval_js('table._getIds();', callback=callback)
+        self._flush()
+        return _call(callback, self.model.ids)
 
     def get_next_id(self, callback=None):
         """Get the next non-skipped row id."""
-        self.eval_js('table.getSiblingId(undefined, "next");', callback=callback)
+        self._flush()
+        return _call(callback, self._sibling_id(dir='next'))
 
     def get_previous_id(self, callback=None):
         """Get the previous non-skipped row id."""
-        self.eval_js('table.getSiblingId(undefined, "previous");', callback=callback)
+        self._flush()
+        return _call(callback, self._sibling_id(dir='previous'))
 
     def first(self, callback=None):
         """Select the first item."""
-        self.eval_js('table.selectFirst();', callback=callback)
+        self._flush()
+        return _call(callback, self._select_first_or_last('next'))
 
     def last(self, callback=None):
         """Select the last item."""
-        self.eval_js('table.selectLast();', callback=callback)
+        self._flush()
+        return _call(callback, self._select_first_or_last('previous'))
 
     def next(self, callback=None):
         """Select the next non-skipped row."""
-        self.eval_js('table.moveToSibling(undefined, "next");', callback=callback)
+        self._flush()
+        return _call(callback, self._move_to_sibling('next'))
 
     def previous(self, callback=None):
         """Select the previous non-skipped row."""
-        self.eval_js('table.moveToSibling(undefined, "previous");', callback=callback)
+        self._flush()
+        return _call(callback, self._move_to_sibling('previous'))
+
+    # Selection
+    # -------------------------------------------------------------------------
 
     def select(self, ids, callback=None, **kwargs):
         """Select some rows in the table from Python.
 
-        This function calls `table.select()` in Javascript, which raises a Javascript event
-        relayed to Python. This sequence of actions is the same when the user selects
-        rows directly in the HTML view.
+        This raises a `select` event, like when the user selects rows directly in the table.
 
         """
+        self._flush()
         ids = _uniq(ids)
         assert all(_is_integer(_) for _ in ids)
-        self.eval_js('table.select({}, {});'.format(dumps(ids), dumps(kwargs)), callback=callback)
+        self.model.selected = [id for id in ids if id in self.model]
+        return _call(callback, self._emit_selected(kwargs))
+
+    def select_toggle(self, id):
+        """Add or remove a row from the selection."""
+        self._flush()
+        selected = self.model.selected
+        if id in selected:
+            selected.remove(id)
+        else:
+            selected.append(id)
+        return self._emit_selected()
+
+    def select_until(self, id):
+        """Extend the selection until a given row."""
+        self._flush()
+        rows = [self.model.row(i) for i in self.model.selected]
+        rows = [r for r in rows if r is not None]
+        clicked = self.model.row(id)
+        if not rows or clicked is None:
+            return self.select([id])
+        last = max(rows)
+        for row in range(min(clicked, last), max(clicked, last) + 1):
+            if self.model.id(row) not in self.model.selected:
+                self.model.selected.append(self.model.id(row))
+        return self._emit_selected()
+
+    def set_selected_index_offset(self, n):
+        """Set the index of the first selected row, used for the color of the selected rows."""
+        self.model.selected_index_offset = n
+        self.model.refresh()
 
     def scroll_to(self, id):
         """Scroll until a given row is visible."""
-        self.eval_js('table._scrollTo({});'.format(id))
+        self._flush()
+        row = self.model.row(id)
+        if row is not None:
+            self.view.scrollTo(self.model.index(row, 0), QAbstractItemView.EnsureVisible)
 
     def set_busy(self, busy):
         """Set the busy state of the GUI."""
-        self.eval_js('table.setBusy({});'.format('true' if busy else 'false'))
+        self._is_busy = busy
+
+    # Data
+    # -------------------------------------------------------------------------
 
     def get(self, id, callback=None):
         """Get the object given its id."""
-        self.eval_js('table.get("id", {})[0]["_values"]'.format(id), callback=callback)
+        self._flush()
+        return _call(callback, self.model.get(id))
+
+    def _changes(self):
+        """Return the pending changes, that are applied at the next iteration of the event loop,
+        or before the next access to the table."""
+        if self._pending is None:
+            self._pending = TableChanges()
+            QTimer.singleShot(0, self._flush)
+        return self._pending
+
+    def _flush(self):
+        """Apply the pending changes to the table in a single pass."""
+        changes, self._pending = self._pending, None
+        if changes:
+            self.model.apply_changes(changes)
+
+    def apply_changes(self, added=None, removed=None, changed=None):
+        """Add rows, remove rows from their ids, and change some fields of existing rows.
+
+        All changes made until the next iteration of the event loop are coalesced and applied
+        together, so that the table is sorted, filtered, and repainted only once.
+
+        """
+        if not (added or removed or changed):
+            return
+        changes = self._changes()
+        if removed:
+            changes.remove(removed)
+        if added:
+            changes.add(_as_list(added))
+        if changed:
+            changes.change(_as_list(changed))
 
     def add(self, objects):
         """Add objects object to the table."""
-        if not objects:
-            return
-        self.eval_js('table.add_({});'.format(dumps(objects)))
+        self.apply_changes(added=objects)
 
     def change(self, objects):
         """Change some objects."""
-        if not objects:
-            return
-        self.eval_js('table.change_({});'.format(dumps(objects)))
+        self.apply_changes(changed=objects)
 
     def remove(self, ids):
         """Remove some objects from their ids."""
-        if not ids:
-            return
-        self.eval_js('table.remove_({});'.format(dumps(ids)))
+        self.apply_changes(removed=ids)
 
     def remove_all(self):
         """Remove all rows in the table."""
-        self.eval_js('table.removeAll();')
+        self.remove_all_and_add([])
 
     def remove_all_and_add(self, objects):
         """Remove all rows in the table and add new objects."""
-        if not objects:
-            return self.remove_all()
-        self.eval_js('table.removeAllAndAdd({});'.format(dumps(objects)))
+        self._pending = None
+        self.model.selected = []
+        self.model.set_rows(_as_list(objects or []))
 
     def get_selected(self, callback=None):
         """Get the currently selected rows."""
-        self.eval_js('table.selected()', callback=callback)
+        self._flush()
+        return _call(callback, list(self.model.selected))
 
     def get_current_sort(self, callback=None):
         """Get the current sort as a tuple `(name, dir)`."""
-        self.eval_js('table._currentSort()', callback=callback)
+        return _call(callback, list(self.model.sort) if self.model.sort else None)
 
 
 # -----------------------------------------------------------------------------
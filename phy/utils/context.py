@@ -6,45 +6,722 @@
 # Imports
 #------------------------------------------------------------------------------
 
+from collections import OrderedDict
 from functools import wraps
+from operator import attrgetter
+import hashlib
 import inspect
+import io
 import logging
 import os
 from pathlib import Path
-from pickle import dump, load
+import pickle
+import shutil
+import struct
+import sys
+import threading
 
+import numpy as np
+
+from phylib.utils import Bunch
 from phylib.utils._misc import save_json, load_json, load_pickle, save_pickle, _fullname
 from .config import phy_config_dir, ensure_dir_exists
 
 logger = logging.getLogger(__name__)
 
 
+#------------------------------------------------------------------------------
+# Memory cache
+#------------------------------------------------------------------------------
+
+def _nbytes(obj):
+    """Approximate size in memory of an object, in bytes, including NumPy arrays."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + 112
+    elif isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_nbytes(k) + _nbytes(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_nbytes(x) for x in obj)
+    return sys.getsizeof(obj)
+
+
+class MemoryCache(object):
+    """In-memory cache with a byte budget and least-recently-used eviction.
+
+    The cache is shared by several functions. Every item is stored with the name of its function
+    and its estimated size in bytes. When the total size exceeds the budget, the least recently
+    used items are evicted and passed to the `on_evict(name, key, value)` callback.
+
+    Constructor
+    -----------
+
+    limit : int
+        The maximum total size of the cached items, in bytes.
+    on_evict : function
+        Called with `(name, key, value)` when an item is evicted.
+
+    """
+    def __init__(self, limit, on_evict=None):
+        self.limit = limit
+        self.on_evict = on_evict
+        self.size = 0
+        # Mapping (name, key) => (value, size), in the order of last use.
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def get(self, name, key, default=None):
+        """Return a cached item, and mark it as the most recently used."""
+        with self._lock:
+            item = self._items.get((name, key), None)
+            if item is None:
+                return default
+            self._items.move_to_end((name, key))
+            return item[0]
+
+    def set(self, name, key, value):
+        """Add an item to the cache, and evict the least recently used items if needed."""
+        size = _nbytes(value)
+        evicted = []
+        with self._lock:
+            old = self._items.pop((name, key), None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[name, key] = (value, size)
+            self.size += size
+            while self.size > self.limit and len(self._items) > 1:
+                (n, k), (v, sz) = self._items.popitem(last=False)
+                self.size -= sz
+                evicted.append((n, k, v))
+        if evicted:
+            logger.log(5, "Evict %d items from the memory cache.", len(evicted))
+        for item in evicted:
+            if self.on_evict:
+                self.on_evict(*item)
+
+    def pop(self, name, key):
+        """Remove an item from the cache."""
+        with self._lock:
+            item = self._items.pop((name, key), None)
+            if item is not None:
+                self.size -= item[1]
+
+    def items(self, name=None):
+        """Return the list of the `(name, key, value)` cached items, for a given function
+        if specified."""
+        with self._lock:
+            return [
+                (n, k, v) for (n, k), (v, _) in self._items.items() if name in (None, n)]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+# Record header in the memcache files: key size, value size.
+_MEMCACHE_RECORD = struct.Struct('<II')
+
+
+class _MemcacheFile(object):
+    """Append-only file persisting the memcached items of a function.
+
+    Every record contains the pickled key and the pickled value. Only the offsets of the
+    values are kept in memory, values are read from disk on demand.
+
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        # Mapping key => (offset, size) of the pickled value.
+        self._index = {}
+        # Number of items removed since the file was last compacted.
+        self._n_removed = 0
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        if not self.path.exists():
+            return
+        size = self.path.stat().st_size
+        with open(str(self.path), 'rb') as f:
+            while True:
+                offset = f.tell()
+                header = f.read(_MEMCACHE_RECORD.size)
+                if len(header) < _MEMCACHE_RECORD.size:
+                    break
+                key_size, value_size = _MEMCACHE_RECORD.unpack(header)
+                if offset + _MEMCACHE_RECORD.size + key_size + value_size > size:
+                    break
+                try:
+                    key = pickle.loads(f.read(key_size))
+                except Exception:  # pragma: no cover
+                    break
+                self._index[key] = (f.tell(), value_size)
+                f.seek(value_size, os.SEEK_CUR)
+        if offset < size:
+            # Remove the truncated end of the file, after a crash in the middle of a write.
+            logger.debug("Truncate the memcache file %s.", self.path)
+            os.truncate(str(self.path), offset)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        """Load a value from disk."""
+        with self._lock:
+            offset, size = self._index[key]
+            with open(str(self.path), 'rb') as f:
+                f.seek(offset)
+                return pickle.loads(f.read(size))
+
+    @property
+    def keys(self):
+        return list(self._index)
+
+    def remove(self, keys):
+        """Remove items. The space is reclaimed when the file is compacted."""
+        with self._lock:
+            for key in keys:
+                item = self._index.pop(key, None)
+                if item is not None:
+                    self._n_removed += 1
+
+    def compact(self):
+        """Rewrite the file without the removed items."""
+        if not self._n_removed:
+            return
+        with self._lock:
+            tmp_path = self.path.with_suffix('.tmp')
+            index = {}
+            with open(str(self.path), 'rb') as f, open(str(tmp_path), 'wb') as g:
+                for key, (offset, size) in self._index.items():
+                    k = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+                    f.seek(offset)
+                    v = f.read(size)
+                    g.write(_MEMCACHE_RECORD.pack(len(k), len(v)))
+                    g.write(k)
+                    index[key] = (g.tell(), len(v))
+                    g.write(v)
+            os.replace(str(tmp_path), str(self.path))
+            logger.debug(
+                "Compacted the memcache file %s (%d items removed).", self.path, self._n_removed)
+            self._index = index
+            self._n_removed = 0
+
+    def append(self, items):
+        """Append `(key, value)` items to the file."""
+        items = [(key, value) for key, value in items if key not in self._index]
+        if not items:
+            return
+        with self._lock, open(str(self.path), 'ab') as f:
+            for key, value in items:
+                try:
+                    k = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+                    v = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception as e:  # pragma: no cover
+                    logger.debug("Could not persist the memcache item %s: %s.", key, e)
+                    continue
+                f.write(_MEMCACHE_RECORD.pack(len(k), len(v)))
+                f.write(k)
+                self._index[key] = (f.tell(), len(v))
+                f.write(v)
+
+
+#------------------------------------------------------------------------------
+# Disk cache
+#------------------------------------------------------------------------------
+
+# Record header in the disk cache index file: size of the pickled record.
+_INDEX_RECORD = struct.Struct('<I')
+
+# Alignment of the records and of the NumPy buffers in the disk cache data files, in bytes.
+_ALIGNMENT = 64
+
+# Returned by `DiskCache.get()` when an item is not in the cache.
+_MISSING = object()
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class _ArrayPickler(pickle.Pickler):
+    """Pickle the data of the contiguous NumPy arrays as separate buffers.
+
+    NOTE: this is similar to the out-of-band buffers of pickle protocol 5, which requires
+    Python 3.8.
+
+    """
+    def __init__(self, f):
+        super(_ArrayPickler, self).__init__(f, protocol=4)
+        self.buffers = []
+
+    def persistent_id(self, obj):
+        if (type(obj) not in (np.ndarray, np.memmap) or obj.dtype.hasobject or
+                obj.nbytes == 0 or not (obj.flags.c_contiguous or obj.flags.f_contiguous)):
+            return None
+        order = 'C' if obj.flags.c_contiguous else 'F'
+        self.buffers.append(memoryview(obj.ravel(order=order).view(np.uint8)))
+        return ('ndarray', len(self.buffers) - 1, obj.dtype, obj.shape, order)
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """Unpickle an object pickled with `_ArrayPickler`, with the arrays as views of the
+    buffers."""
+    def __init__(self, f, buffers):
+        super(_ArrayUnpickler, self).__init__(f)
+        self.buffers = buffers
+
+    def persistent_load(self, pid):
+        _, i, dtype, shape, order = pid
+        return np.frombuffer(self.buffers[i], dtype=dtype).reshape(shape, order=order)
+
+
+def _dumps(value):
+    """Pickle an object, with the data of the contiguous NumPy arrays as separate buffers."""
+    f = io.BytesIO()
+    pickler = _ArrayPickler(f)
+    pickler.dump(value)
+    return f.getvalue(), pickler.buffers
+
+
+def _loads(data, buffers):
+    """Unpickle an object pickled with `_dumps()`."""
+    return _ArrayUnpickler(io.BytesIO(data), buffers).load()
+
+
+class DiskCache(object):
+    """Size-bounded on-disk store of function results.
+
+    The values are appended to data files (segments) of about `segment_size` bytes. Every value
+    is pickled with the data of its NumPy arrays stored separately and aligned, so that the
+    arrays are read back as copy-on-write memory-mapped views without any copy.
+
+    The index of the items is an append-only log, read once on the first access. The items
+    are kept in least recently used order. When the total size exceeds the limit, the least
+    recently used items are removed, the segments with no item left are deleted, and the
+    remaining items of the segments that are mostly empty are moved to the current segment.
+
+    Every item may be associated to cluster ids, so that the items of the deleted clusters can
+    be removed with `remove_clusters()`, including items saved during previous sessions.
+
+    Constructor
+    -----------
+
+    path : str or Path
+        The directory of the store.
+    limit : int
+        The maximum total size of the items, in bytes.
+
+    """
+
+    """Approximate maximum size of a data file, in bytes."""
+    segment_size = 64 * 1024 ** 2  # 64 MB
+
+    def __init__(self, path, limit):
+        self.path = Path(path)
+        self.limit = limit
+        # Mapping key => entry (segment, offset, size, pickle_size, buffers, cluster_ids),
+        # in the order of last use. The buffers are pairs (offset, size) relative to the
+        # record offset.
+        self._index = None
+        self._lock = threading.RLock()
+
+    # Internal methods
+    # -------------------------------------------------------------------------
+
+    @property
+    def _index_path(self):
+        return self.path / 'index.log'
+
+    def _segment_path(self, segment):
+        return self.path / ('%06d.bin' % segment)
+
+    def _load(self):
+        """Load the index on the first access."""
+        if self._index is not None:
+            return
+        ensure_dir_exists(self.path)
+        self._index = OrderedDict()
+        # Mapping {cluster_id: set of keys}.
+        self._clusters = {}
+        # Mapping {segment: total size of the items}.
+        self._live = {}
+        self.size = 0
+        self._n_records = 0
+        for record in self._read_log():
+            if record[0] == 'put':
+                self._insert(record[1], record[2])
+            else:
+                self._discard(record[1])
+        # Remove the items whose data was not fully written, and the orphan data files.
+        sizes = {
+            int(p.stem): p.stat().st_size for p in self.path.glob('*.bin') if p.stem.isdigit()}
+        invalid = [
+            key for key, entry in self._index.items()
+            if entry[1] + entry[2] > sizes.get(entry[0], 0)]
+        if invalid:
+            for key in invalid:
+                self._discard(key)
+            self._log([('del', key) for key in invalid])
+        for segment in set(sizes) - set(self._live):
+            self._unlink(segment)
+        self._segment = max(self._live, default=0)
+        if sizes.get(self._segment, 0) >= self.segment_size:
+            self._segment += 1
+        logger.debug(
+            "Loaded the disk cache index with %d items (%.1f MB).",
+            len(self._index), self.size / 1024. ** 2)
+
+    def _read_log(self):
+        """Yield the records of the index log, and truncate its incomplete end if needed."""
+        path = self._index_path
+        if not path.exists():
+            return
+        with open(str(path), 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + _INDEX_RECORD.size <= len(data):
+            size, = _INDEX_RECORD.unpack_from(data, offset)
+            end = offset + _INDEX_RECORD.size + size
+            if end > len(data):
+                break
+            try:
+                record = pickle.loads(data[offset + _INDEX_RECORD.size:end])
+            except Exception:  # pragma: no cover
+                break
+            self._n_records += 1
+            yield record
+            offset = end
+        if offset < len(data):
+            # Remove the truncated end of the file, after a crash in the middle of a write.
+            logger.debug("Truncate the disk cache index %s.", path)
+            os.truncate(str(path), offset)
+
+    def _log(self, records, rewrite=False):
+        """Append records to the index log, or replace the index log by these records."""
+        path = self._index_path
+        tmp_path = path.with_suffix('.tmp')
+        with open(str(tmp_path if rewrite else path), 'wb' if rewrite else 'ab') as f:
+            for record in records:
+                data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(_INDEX_RECORD.pack(len(data)))
+                f.write(data)
+        if rewrite:
+            os.replace(str(tmp_path), str(path))
+            self._n_records = 0
+        self._n_records += len(records)
+
+    def _rewrite_log(self):
+        """Rewrite the index log with the current items, in the order of last use."""
+        self._log([('put', key, entry) for key, entry in self._index.items()], rewrite=True)
+
+    def _insert(self, key, entry):
+        self._discard(key)
+        self._index[key] = entry
+        for cluster_id in entry[5]:
+            self._clusters.setdefault(cluster_id, set()).add(key)
+        self._live[entry[0]] = self._live.get(entry[0], 0) + entry[2]
+        self.size += entry[2]
+
+    def _discard(self, key):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        for cluster_id in entry[5]:
+            keys = self._clusters.get(cluster_id, set())
+            keys.discard(key)
+            if not keys:
+                self._clusters.pop(cluster_id, None)
+        self._live[entry[0]] -= entry[2]
+        self.size -= entry[2]
+        if not self._live[entry[0]]:
+            del self._live[entry[0]]
+        return entry
+
+    def _unlink(self, segment):
+        """Delete a data file."""
+        try:
+            self._segment_path(segment).unlink()
+        except OSError as e:  # pragma: no cover
+            # The file may still be memory-mapped on Windows, it will be removed later.
+            logger.debug("Could not delete the disk cache file: %s.", e)
+
+    def _map(self, segment):
+        """Return a copy-on-write memmap of a data file.
+
+        A new memmap is created for every read, so that modifying a returned array does not
+        modify the subsequent values returned by the cache.
+
+        """
+        return np.memmap(str(self._segment_path(segment)), dtype=np.uint8, mode='c')
+
+    def _append(self, pickled, buffers):
+        """Append a record to the current data file, and return its data file, offset, total
+        size, and the buffer positions relative to the offset."""
+        segment = self._segment
+        with open(str(self._segment_path(segment)), 'ab') as f:
+            offset = _align(f.seek(0, os.SEEK_END))
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(pickled)
+            spans = []
+            for buf in buffers:
+                pos = _align(f.tell())
+                f.write(b'\0' * (pos - f.tell()))
+                spans.append((pos - offset, buf.nbytes))
+                f.write(buf)
+            size = f.tell() - offset
+        if offset + size >= self.segment_size:
+            self._segment += 1
+        return segment, offset, size, spans
+
+    def _collect(self):
+        """Remove the least recently used items if needed, delete the empty data files, and
+        move the remaining items of the mostly empty data files to the current one."""
+        records = []
+        # NOTE: remove a few more items than needed so that this does not happen at every
+        # new item.
+        if self.size > self.limit:
+            while self.size > .9 * self.limit and len(self._index) > 1:
+                key = next(iter(self._index))
+                self._discard(key)
+                records.append(('del', key))
+        if records:
+            logger.debug("Removed %d items from the disk cache.", len(records))
+        sizes = {
+            int(p.stem): p.stat().st_size for p in self.path.glob('*.bin') if p.stem.isdigit()}
+        for segment, size in sizes.items():
+            if segment == self._segment:
+                continue
+            live = self._live.get(segment, 0)
+            if not live:
+                self._unlink(segment)
+            elif live < size // 2:
+                records.extend(self._move(segment))
+                self._unlink(segment)
+        if records:
+            self._log(records)
+        if self._n_records > 2 * len(self._index) + 1024:
+            self._rewrite_log()
+
+    def _move(self, segment):
+        """Move the items of a data file to the current data file, and return the index
+        records."""
+        records = []
+        mm = self._map(segment)
+        for key, entry in list(self._index.items()):
+            if entry[0] != segment:
+                continue
+            offset, size = entry[1:3]
+            # The buffers keep their alignment as the records are aligned.
+            new_segment, new_offset, _, _ = self._append(mm[offset:offset + size], [])
+            # NOTE: the item keeps its place in the order of last use.
+            self._index[key] = entry = (new_segment, new_offset) + entry[2:]
+            self._live[new_segment] = self._live.get(new_segment, 0) + size
+            records.append(('put', key, entry))
+        self._live.pop(segment, None)
+        return records
+
+    # Public methods
+    # -------------------------------------------------------------------------
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._index)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._load()
+            return key in self._index
+
+    @property
+    def keys(self):
+        """The keys of the items, from the least recently used to the most recently used."""
+        with self._lock:
+            self._load()
+            return list(self._index)
+
+    def get(self, key, default=_MISSING):
+        """Return a value, with the NumPy arrays memory-mapped, and mark it as the most
+        recently used."""
+        with self._lock:
+            self._load()
+            entry = self._index.get(key, None)
+            if entry is None:
+                return default
+            self._index.move_to_end(key)
+            segment, offset, size, pickle_size, spans, _ = entry
+            mm = self._map(segment)
+            try:
+                return _loads(
+                    mm[offset:offset + pickle_size],
+                    [mm[offset + o:offset + o + n] for o, n in spans])
+            except Exception as e:  # pragma: no cover
+                logger.debug("Could not load a disk cache item: %s.", e)
+                self.remove([key])
+                return default
+
+    def set(self, key, value, cluster_ids=()):
+        """Store a value, associated to some cluster ids."""
+        pickled, buffers = _dumps(value)
+        with self._lock:
+            self._load()
+            segment, offset, size, spans = self._append(pickled, buffers)
+            entry = (segment, offset, size, len(pickled), spans, tuple(cluster_ids))
+            self._insert(key, entry)
+            self._log([('put', key, entry)])
+            if self.size > self.limit:
+                self._collect()
+
+    def remove(self, keys):
+        """Remove items."""
+        with self._lock:
+            self._load()
+            keys = [key for key in keys if self._discard(key) is not None]
+            if keys:
+                self._log([('del', key) for key in keys])
+                self._collect()
+            return len(keys)
+
+    def remove_clusters(self, cluster_ids):
+        """Remove all items associated to some clusters, and return the number of removed
+        items."""
+        with self._lock:
+            self._load()
+            keys = set()
+            for cluster_id in cluster_ids:
+                keys.update(self._clusters.get(cluster_id, ()))
+            return self.remove(keys)
+
+    def flush(self):
+        """Save the order of last use of the items."""
+        with self._lock:
+            if self._index is not None:
+                self._rewrite_log()
+
+    def clear(self):
+        """Remove all items."""
+        with self._lock:
+            self._load()
+            self.remove(list(self._index))
+
+
 #------------------------------------------------------------------------------
 # Context
 #------------------------------------------------------------------------------
 
-def _cache_methods(obj, memcached, cached):  # pragma: no cover
+def _state_getter(obj, attrs):
+    """Return a function returning the values of some (dotted) attributes of an object."""
+    if not attrs:
+        return None
+    getters = [attrgetter(attr) for attr in attrs]
+
+    def state():
+        return tuple(getter(obj) for getter in getters)
+    return state
+
+
+def _cache_methods(obj, memcached, cached, cluster_keyed=(), state=()):  # pragma: no cover
+    """Cache methods of an object.
+
+    Parameters
+    ----------
+
+    obj : object
+        An object with a `context` attribute.
+    memcached : list
+        Names of the methods to cache in memory.
+    cached : list
+        Names of the methods to cache on disk.
+    cluster_keyed : list
+        Names of the methods whose first argument is a cluster id or a list of cluster ids.
+    state : list
+        List of pairs `(method_name, attribute)` with the object attributes on which the
+        methods depend, in addition to their arguments.
+
+    """
     for name in memcached:
         f = getattr(obj, name)
-        setattr(obj, name, obj.context.memcache(f))
+        setattr(obj, name, obj.context.memcache(
+            f, cluster_keyed=name in cluster_keyed,
+            state=_state_getter(obj, [a for n, a in state if n == name])))
 
     for name in cached:
         f = getattr(obj, name)
-        setattr(obj, name, obj.context.cache(f))
+        setattr(obj, name, obj.context.cache(
+            f, cluster_keyed=name in cluster_keyed,
+            state=_state_getter(obj, [a for n, a in state if n == name])))
+
+
+def _key_clusters(args, kwargs):
+    """Return the cluster ids in the first argument of a cluster-keyed function call."""
+    if args:
+        clusters = args[0]
+    else:
+        clusters = kwargs.get('cluster_id', kwargs.get('cluster_ids', None))
+    if clusters is None:
+        return ()
+    if isinstance(clusters, (list, tuple, np.ndarray)):
+        return [int(c) for c in clusters if c is not None]
+    return (int(clusters),)
+
+
+def _code_key(code):
+    """Return the bytecode and the constants of a code object, including nested functions."""
+    return (code.co_code, tuple(
+        _code_key(const) if inspect.iscode(const) else repr(const)
+        for const in code.co_consts))
+
+
+def _function_key(f):
+    """Return the source code of a function, or its bytecode and constants when the source is
+    not available."""
+    try:
+        return inspect.getsource(f)
+    except (OSError, TypeError):
+        code = getattr(f, '__code__', None)
+        return repr(_code_key(code)) if code is not None else ''
+
+
+def _hash_key(name, code, args, kwargs, state):
+    """Return the key of a disk cached function call."""
+    key = (name, code, args, tuple(sorted(kwargs.items())), state() if state else None)
+    return hashlib.sha1(pickle.dumps(key, protocol=4)).hexdigest()
+
+
+def _make_key(args, kwargs, state):
+    """Return the hashable key of a memcached function call."""
+    key = args
+    if kwargs:
+        key = key + (tuple(sorted(kwargs.items())),)
+    if state is not None:
+        key = key + (state(),)
+    return key
 
 
 class Context(object):
-    """Handle function disk and memory caching with joblib.
+    """Handle function disk and memory caching.
 
     Memcaching a function is used to save *in memory* the output of the function for all
-    passed inputs. Input should be hashable. NumPy arrays are supported. The contents of the
-    memcache in memory can be persisted to disk with `context.save_memcache()` and
-    `context.load_memcache()`.
+    passed inputs. Input should be hashable. NumPy arrays are supported. The memcache of all
+    functions shares a memory budget of `memcache_limit` bytes, the least recently used items
+    being evicted first. Items are persisted incrementally to disk, when they are evicted and
+    when calling `context.save_memcache()`, and evicted items are reloaded from disk on demand.
 
     Caching a function is used to save *on disk* the output of the function for all passed
-    inputs. Input should be hashable. NumPy arrays are supported. This is to be preferred
-    over memcache when the inputs or outputs are large, and when the computations are longer
-    than loading the result from disk.
+    inputs. Input should be picklable. NumPy arrays are supported, and are memory-mapped when
+    loaded from the cache. This is to be preferred over memcache when the inputs or outputs are
+    large, and when the computations are longer than loading the result from disk. The disk
+    cache is limited to `cache_limit` bytes, the least recently used items being removed first.
 
     Constructor
     -----------
@@ -52,7 +729,7 @@ class Context(object):
     cache_dir : str
         The directory in which the cache will be created.
     verbose : int
-        The verbosity level passed to joblib Memory.
+        Whether to log the disk cache hits and misses.
 
     Examples
     --------
@@ -72,6 +749,9 @@ class Context(object):
     """Maximum cache size, in bytes."""
     cache_limit = 2 * 1024 ** 3  # 2 GB
 
+    """Maximum memory cache size, in bytes."""
+    memcache_limit = 512 * 1024 ** 2  # 512 MB
+
     def __init__(self, cache_dir, verbose=0):
         self.verbose = verbose
         # Make sure the cache directory exists.
@@ -85,77 +765,173 @@ class Context(object):
         if not path.exists():
             path.mkdir()
 
-        self._set_memory(self.cache_dir)
+        self._set_disk_cache()
+        self._set_memcache()
+
+    def _set_memcache(self):
+        """Create the memory cache shared by all memcached functions."""
+        # Mapping {name: _MemcacheFile}.
         self._memcache = {}
+        # Mapping {name: Bunch(hits, disk_hits, misses)}.
+        self._memcache_stats = {}
+        self._memory_cache = MemoryCache(self.memcache_limit, on_evict=self._on_evict)
+        # Names of the cluster-keyed memcached functions.
+        self._cluster_keyed = set()
+
+    def _on_evict(self, name, key, value):
+        """Persist an evicted item if needed."""
+        if name in self._memcache:
+            self._memcache[name].append([(key, value)])
+
+    def _set_disk_cache(self):
+        """Create the disk cache."""
+        # Remove the cache of older versions, which used joblib.
+        legacy_path = self.cache_dir / 'joblib'
+        if legacy_path.exists():
+            logger.debug("Remove the obsolete joblib cache %s.", legacy_path)
+            shutil.rmtree(str(legacy_path), ignore_errors=True)
+        self._disk_cache = DiskCache(self.cache_dir / 'diskcache', limit=self.cache_limit)
+
+    def cache(self, f, cluster_keyed=False, state=None):
+        """Cache a function using the context's cache directory.
+
+        Parameters
+        ----------
 
-    def _set_memory(self, cache_dir):
-        """Create the joblib Memory instance."""
+        f : function
+            The function to cache.
+        cluster_keyed : boolean
+            Whether the first argument of the function is a cluster id or a list of cluster ids.
+            The cached results of the deleted clusters are removed by
+            `context.invalidate_clusters()`.
+        state : function
+            Return a hashable object with the state on which the function depends, in
+            addition to its arguments.
 
-        # Try importing joblib.
-        try:
-            from joblib import Memory
-            self._memory = Memory(
-                location=self.cache_dir, mmap_mode=None, verbose=self.verbose,
-                bytes_limit=self.cache_limit)
-            logger.debug("Initialize joblib cache dir at `%s`.", self.cache_dir)
-            logger.debug("Reducing the size of the cache if needed.")
-            self._memory.reduce_size()
-        except ImportError:  # pragma: no cover
-            logger.warning(
-                "Joblib is not installed. Install it with `conda install joblib`.")
-            self._memory = None
-
-    def cache(self, f):
-        """Cache a function using the context's cache directory."""
-        if self._memory is None:  # pragma: no cover
-            logger.debug("Joblib is not installed: skipping caching.")
-            return f
+        """
         assert f
-        # NOTE: discard self in instance methods.
-        if 'self' in inspect.getfullargspec(f).args:
-            ignore = ['self']
-        else:
-            ignore = None
-        disk_cached = self._memory.cache(f, ignore=ignore)
-        return disk_cached
+        store = self._disk_cache
+        name = f.__module__ + '.' + getattr(f, '__qualname__', f.__name__)
+        # The results are invalidated when the code of the function changes.
+        code = _function_key(f)
+        # NOTE: discard self in instance methods that are not bound yet.
+        skip_self = 'self' in inspect.getfullargspec(f).args and not inspect.ismethod(f)
+
+        @wraps(f)
+        def cached(*args, **kwargs):
+            key_args = args[1:] if skip_self else args
+            try:
+                key = _hash_key(name, code, key_args, kwargs, state)
+            except Exception as e:  # pragma: no cover
+                logger.debug("Could not hash the arguments of %s: %s.", name, e)
+                return f(*args, **kwargs)
+            out = store.get(key)
+            if out is not _MISSING:
+                if self.verbose:
+                    logger.debug("Disk cache hit for %s.", name)
+                return out
+            if self.verbose:
+                logger.debug("Disk cache miss for %s.", name)
+            out = f(*args, **kwargs)
+            try:
+                store.set(
+                    key, out, cluster_ids=_key_clusters(key_args, kwargs) if cluster_keyed else ())
+            except Exception as e:  # pragma: no cover
+                logger.debug("Could not cache the output of %s: %s.", name, e)
+            return out
+        return cached
 
     def load_memcache(self, name):
-        """Load the memcache from disk (pickle file), if it exists."""
-        path = self.cache_dir / 'memcache' / (name + '.pkl')
-        if path.exists():
-            logger.debug("Load memcache for `%s`.", name)
-            with open(str(path), 'rb') as fd:
-                cache = load(fd)
-        else:
-            cache = {}
-        self._memcache[name] = cache
-        return cache
+        """Open the memcache file of a function. The items are loaded from disk on demand."""
+        path = self.cache_dir / 'memcache' / (name + '.bin')
+        # Remove the memcache files of older versions, where every function's memcache was
+        # saved as a single pickle file.
+        legacy_path = path.with_suffix('.pkl')
+        if legacy_path.exists():
+            logger.debug("Remove the obsolete memcache file %s.", legacy_path)
+            legacy_path.unlink()
+        logger.debug("Load memcache for `%s`.", name)
+        self._memcache[name] = _MemcacheFile(path)
+        self._memcache_stats.setdefault(name, Bunch(hits=0, disk_hits=0, misses=0))
+        return self._memcache[name]
 
     def save_memcache(self):
-        """Save the memcache to disk using pickle."""
-        for name, cache in self._memcache.items():
-            path = self.cache_dir / 'memcache' / (name + '.pkl')
+        """Append the memcached items that are not on disk yet to the memcache files, and save
+        the order of last use of the disk cache items."""
+        self._disk_cache.flush()
+        for name, store in self._memcache.items():
+            items = [(key, value) for _, key, value in self._memory_cache.items(name)]
             logger.debug("Save memcache for `%s`.", name)
-            with open(str(path), 'wb') as fd:
-                dump(cache, fd)
+            store.append(items)
+            store.compact()
+        for name, stats in self.memcache_stats.items():
+            logger.debug(
+                "Memcache `%s`: %d hits, %d disk hits, %d misses.",
+                name, stats.hits, stats.disk_hits, stats.misses)
 
-    def memcache(self, f):
-        """Cache a function in memory using an internal dictionary."""
+    @property
+    def memcache_stats(self):
+        """Per-function hit and miss counts of the memcache, as a dictionary
+        `{name: Bunch(hits, disk_hits, misses)}`."""
+        return self._memcache_stats
+
+    def memcache(self, f, cluster_keyed=False, state=None):
+        """Cache a function in memory, with a least recently used eviction policy.
+
+        The `cluster_keyed` and `state` parameters are the same as in `context.cache()`.
+
+        """
         name = _fullname(f)
-        cache = self.load_memcache(name)
+        store = self.load_memcache(name)
+        stats = self._memcache_stats[name]
+        if cluster_keyed:
+            self._cluster_keyed.add(name)
 
         @wraps(f)
         def memcached(*args, **kwargs):
             """Cache the function in memory."""
             # The arguments need to be hashable. Much faster than using hash().
-            h = args
-            out = cache.get(h, None)
-            if out is None:
+            h = _make_key(args, kwargs, state)
+            out = self._memory_cache.get(name, h)
+            if out is not None:
+                stats.hits += 1
+                return out
+            if h in store:
+                out = store.get(h)
+                stats.disk_hits += 1
+            else:
                 out = f(*args, **kwargs)
-                cache[h] = out
+                stats.misses += 1
+            if out is not None:
+                self._memory_cache.set(name, h, out)
             return out
         return memcached
 
+    def invalidate_clusters(self, cluster_ids):
+        """Remove the cached results of the cluster-keyed functions involving some clusters,
+        typically the clusters deleted by a clustering action."""
+        cluster_ids = set(int(c) for c in cluster_ids)
+        if not cluster_ids:
+            return
+
+        def _involves(key):
+            return key and not cluster_ids.isdisjoint(_key_clusters(key[:1], {}))
+
+        n = 0
+        # Memory cache.
+        for name in self._cluster_keyed:
+            for _, key, _ in self._memory_cache.items(name):
+                if _involves(key):
+                    self._memory_cache.pop(name, key)
+                    n += 1
+            store = self._memcache[name]
+            keys = [key for key in store.keys if _involves(key)]
+            store.remove(keys)
+            n += len(keys)
+        # Disk cache.
+        n += self._disk_cache.remove_clusters(cluster_ids)
+        logger.log(5, "Removed %d cached items of %d deleted clusters.", n, len(cluster_ids))
+
     def _get_path(self, name, location, file_ext='.json'):
         """Get the path to the cache file."""
         if location == 'local':
@@ -212,11 +988,14 @@ class Context(object):
     def __getstate__(self):
         """Make sure that this class is picklable."""
         state = self.__dict__.copy()
-        state['_memory'] = None
+        for k in (
+                '_disk_cache', '_memcache', '_memcache_stats', '_memory_cache',
+                '_cluster_keyed'):
+            state.pop(k, None)
         return state
 
     def __setstate__(self, state):
         """Make sure that this class is picklable."""
         self.__dict__ = state
-        # Recreate the joblib Memory instance.
-        self._set_memory(state['cache_dir'])
+        self._set_disk_cache()
+        self._set_memcache()
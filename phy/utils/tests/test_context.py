@@ -13,7 +13,9 @@ from numpy.testing import assert_array_equal as ae
 from pytest import fixture, yield_fixture
 
 from phylib.io.array import write_array, read_array
-from ..context import Context, _fullname
+from ..context import (
+    Context, DiskCache, MemoryCache, _MemcacheFile, _MISSING, _nbytes, _fullname,
+    _function_key)
 
 
 #------------------------------------------------------------------------------
@@ -62,6 +64,25 @@ def test_context_load_save_pickle(tempdir, context, temp_phy_config_dir):
     ae(context.load('arr'), arr)
 
 
+def test_function_key():
+    def f(x):
+        return x + 1
+
+    def g(x):
+        return x + 2
+
+    # The functions only differ by a constant.
+    assert f.__code__.co_code == g.__code__.co_code
+    assert _function_key(f) != _function_key(g)
+    assert 'x + 1' in _function_key(f)
+
+    # Functions without source code.
+    ns = {}
+    exec('def f(x):\n    return x + 1\ndef g(x):\n    return x + 2\n', ns)
+    assert _function_key(ns['f']) != _function_key(ns['g'])
+    assert _function_key(ns['f']) == _function_key(ns['f'])
+
+
 def test_context_cache(context):
 
     _res = []
@@ -137,6 +158,7 @@ def test_context_memcache(tempdir, context):
 
     # We artificially clear the memory cache.
     context.save_memcache()
+    context._memory_cache.clear()
     del context._memcache[_fullname(f)]
     context.load_memcache(_fullname(f))
 
@@ -144,6 +166,92 @@ def test_context_memcache(tempdir, context):
     ae(f(x), x ** 2)
     assert len(_res) == 1
 
+    stats = context.memcache_stats[_fullname(f)]
+    assert (stats.hits, stats.disk_hits, stats.misses) == (1, 1, 1)
+
+
+def test_nbytes():
+    arr = np.zeros(1000)
+    assert _nbytes(arr) > 8000
+    assert _nbytes({'a': arr, 'b': [arr, arr]}) > 24000
+    assert 0 < _nbytes(1) < 100
+
+
+def test_memory_cache_lru():
+    evicted = []
+    cache = MemoryCache(limit=10000, on_evict=lambda *args: evicted.append(args[:2]))
+    arr = np.zeros(400)  # about 3 KB
+
+    cache.set('f', (0,), arr)
+    cache.set('f', (1,), arr)
+    cache.set('g', (0,), arr)
+    assert len(cache) == 3
+    # Mark (f, 0) as the most recently used.
+    assert cache.get('f', (0,)) is arr
+    assert cache.get('f', (2,)) is None
+
+    # The least recently used item is evicted.
+    cache.set('g', (1,), arr)
+    assert evicted == [('f', (1,))]
+    assert ('f', (0,)) in cache
+    assert cache.size <= cache.limit
+    assert [k for _, k, _ in cache.items('g')] == [(0,), (1,)]
+
+    # An item larger than the budget is kept until the next insertion.
+    cache.set('h', (0,), np.zeros(10000))
+    assert len(cache) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_memcache_file(tempdir):
+    path = tempdir / 'memcache.bin'
+    store = _MemcacheFile(path)
+    assert len(store) == 0
+    store.append([((1,), np.arange(3)), ((2, 'a'), {'x': 1})])
+    store.append([((1,), None)])
+    ae(store.get((1,)), np.arange(3))
+
+    # Simulate a crash in the middle of the last write.
+    store.append([((3,), 'hello')])
+    path.write_bytes(path.read_bytes()[:-3])
+
+    store = _MemcacheFile(path)
+    assert len(store) == 2
+    ae(store.get((1,)), np.arange(3))
+    assert store.get((2, 'a')) == {'x': 1}
+    assert (3,) not in store
+
+    # The file can be appended after the truncation.
+    store.append([((3,), 'world')])
+    assert _MemcacheFile(path).get((3,)) == 'world'
+
+
+def test_context_memcache_eviction(tempdir, context):
+    context._memory_cache.limit = 10000
+    _res = []
+
+    @context.memcache
+    def f(x):
+        _res.append(x)
+        return np.zeros(400) + x
+
+    for i in range(10):
+        f(i)
+    assert len(context._memory_cache) <= 3
+    # The evicted items have been persisted to disk, and are not recomputed.
+    ae(f(0), np.zeros(400))
+    assert _res == list(range(10))
+    assert context.memcache_stats[_fullname(f)].disk_hits == 1
+
+    context.save_memcache()
+    ctx = Context('{}/cache/'.format(tempdir))
+    g = ctx.memcache(f.__wrapped__)
+    ae(g(9), np.zeros(400) + 9)
+    assert _res == list(range(10))
+
 
 def test_pickle_cache(tempdir, context):
     """Make sure the Context is picklable."""
@@ -153,3 +261,193 @@ def test_pickle_cache(tempdir, context):
         ctx = load(f)
     assert isinstance(ctx, Context)
     assert ctx.cache_dir == context.cache_dir
+
+
+def test_context_memcache_state(context):
+    _res = []
+    state = {'filter': 'raw'}
+
+    def f(x):
+        _res.append((x, state['filter']))
+        return x
+
+    f = context.memcache(f, state=lambda: (state['filter'],))
+    f(1)
+    f(1)
+    assert len(_res) == 1
+
+    # The cache key depends on the state.
+    state['filter'] = 'high_pass'
+    f(1)
+    assert _res == [(1, 'raw'), (1, 'high_pass')]
+
+    state['filter'] = 'raw'
+    f(1)
+    assert len(_res) == 2
+
+
+def test_context_memcache_invalidate(context):
+    _res = []
+
+    def f(cluster_ids):
+        _res.append(cluster_ids)
+        return 0
+
+    def g(cluster_id):
+        _res.append(cluster_id)
+        return 1
+
+    f = context.memcache(f, cluster_keyed=True)
+    g = context.memcache(g, cluster_keyed=True)
+    f((1, 2))
+    f((3, 4))
+    g(1)
+    g(3)
+    context.save_memcache()
+    assert len(_res) == 4
+
+    context.invalidate_clusters([1, 5])
+    f((1, 2))
+    f((3, 4))
+    g(1)
+    g(3)
+    assert _res[4:] == [(1, 2), 1]
+
+    # The invalidated items are removed from disk too.
+    context.invalidate_clusters([2])
+    context.save_memcache()
+    context._memory_cache.clear()
+    f((1, 2))
+    assert len(_res) == 7
+
+
+def test_context_cache_state_invalidate(context):
+    _res = []
+    state = {'n': 10}
+
+    def f(cluster_id, bin_size=1):
+        _res.append((cluster_id, state['n']))
+        return cluster_id
+
+    f = context.cache(f, cluster_keyed=True, state=lambda: (state['n'],))
+    assert f(1) == 1
+    assert f(1) == 1
+    assert len(_res) == 1
+
+    state['n'] = 20
+    f(1)
+    f(2, bin_size=2)
+    assert _res == [(1, 10), (1, 20), (2, 20)]
+
+    context.invalidate_clusters([1])
+    f(1)
+    f(2, bin_size=2)
+    assert _res[3:] == [(1, 20)]
+
+
+def test_disk_cache(tempdir):
+    path = tempdir / 'diskcache'
+    cache = DiskCache(path, limit=1e6)
+    assert cache.get('a') is _MISSING
+    assert cache.get('a', None) is None
+
+    x = np.random.rand(100)
+    y = np.arange(12).reshape((3, 4)).T
+    cache.set('a', {'x': x, 'y': y, 'z': 'hello'}, cluster_ids=(1, 2))
+    cache.set('b', x[::2], cluster_ids=(3,))
+    assert len(cache) == 2
+
+    out = cache.get('a')
+    ae(out['x'], x)
+    ae(out['y'], y)
+    assert out['z'] == 'hello'
+    # The arrays are aligned views on the data file.
+    assert not out['x'].flags.owndata
+    assert out['x'].ctypes.data % 64 == 0
+    # Modifying the arrays does not modify the cache.
+    out['x'][0] = -1
+    assert cache.get('a')['x'][0] == x[0]
+    ae(cache.get('b'), x[::2])
+
+    # Other arrays are pickled with their data.
+    values = [
+        np.zeros((0, 3)), np.array([1, 'a'], dtype=object),
+        np.zeros(3, dtype=[('a', np.int32), ('b', np.float64)]), np.float32(2.5)]
+    other = DiskCache(tempdir / 'diskcache_other', limit=1e6)
+    other.set('c', values)
+    for value, out in zip(values, other.get('c')):
+        ae(out, value)
+        assert out.dtype == value.dtype
+    assert cache.get('a')['y'].flags.f_contiguous
+
+    # Reopen the store.
+    cache = DiskCache(path, limit=1e6)
+    assert 'a' in cache
+    ae(cache.get('b'), x[::2])
+
+    assert cache.remove_clusters([2, 4]) == 1
+    cache = DiskCache(path, limit=1e6)
+    assert 'a' not in cache
+    assert 'b' in cache
+
+    # Incomplete index record after a crash.
+    with open(path / 'index.log', 'ab') as f:
+        f.write(b'\x10\x00\x00\x00abc')
+    cache = DiskCache(path, limit=1e6)
+    assert len(cache) == 1
+    cache.set('c', 1)
+    assert DiskCache(path, limit=1e6).get('c') == 1
+
+    cache.clear()
+    assert len(DiskCache(path, limit=1e6)) == 0
+
+
+def test_disk_cache_lru(tempdir):
+    path = tempdir / 'diskcache'
+    cache = DiskCache(path, limit=100000)
+    cache.segment_size = 20000
+
+    arrs = [np.random.rand(1000) for _ in range(50)]
+    for i, arr in enumerate(arrs):
+        cache.set(i, arr)
+        # The first item is used regularly.
+        ae(cache.get(0), arrs[0])
+        assert cache.size <= cache.limit
+    assert 0 in cache
+    assert 1 not in cache
+    assert 49 in cache
+
+    # The data files with no items left are deleted, the others are compacted.
+    assert len(list(path.glob('*.bin'))) <= 8
+
+    cache.flush()
+    cache = DiskCache(path, limit=100000)
+    keys = cache.keys
+    assert keys[-1] == 0
+    for i in keys:
+        ae(cache.get(i), arrs[i])
+
+
+def test_context_cache_invalidate_sessions(tempdir, context):
+    _res = []
+
+    def f(cluster_id):
+        _res.append(cluster_id)
+        return np.zeros(cluster_id)
+
+    g = context.cache(f, cluster_keyed=True)
+    g(1)
+    g(2)
+
+    context = Context('{}/cache/'.format(tempdir))
+    g = context.cache(f, cluster_keyed=True)
+    context.invalidate_clusters([1])
+    ae(g(1), np.zeros(1))
+    ae(g(2), np.zeros(2))
+    assert _res == [1, 2, 1]
+
+
+def test_context_legacy_joblib_cache(tempdir):
+    (tempdir / 'cache' / 'joblib' / 'func').mkdir(parents=True)
+    Context('{}/cache/'.format(tempdir))
+    assert not (tempdir / 'cache' / 'joblib').exists()
@@ -38,12 +38,8 @@ class ExampleActionPlugin(IPlugin):
                 submenu='My submenu', shortcut='ctrl+c', prompt=True, prompt_default=lambda: 10)
             def select_n_first_clusters(n_clusters):
 
-                # All cluster view methods are called with a callback function because of the
-                # asynchronous nature of Python-Javascript interactions in Qt5.
-                @controller.supervisor.cluster_view.get_ids
-                def get_cluster_ids(cluster_ids):
-                    """This function is called when the ordered list of cluster ids is returned
-                    by the Javascript view."""
-
-                    # We select the first n_clusters clusters.
-                    controller.supervisor.select(cluster_ids[:n_clusters])
+                # We get the ordered list of cluster ids as shown in the cluster view.
+                cluster_ids = controller.supervisor.cluster_view.get_ids()
+
+                # We select the first n_clusters clusters.
+                controller.supervisor.select(cluster_ids[:n_clusters])